@@ -0,0 +1,74 @@
+"""Compares the memory and query times of the ColumnarRepository and the MemoryRepository.
+
+Run from the project directory with: python -m benchmarks.columnar_benchmark [number of tracks]
+"""
+import sys
+import time
+import tracemalloc
+
+from music.adapters.columnar_repository import ColumnarRepository
+from music.adapters.memory_repository import MemoryRepository
+
+NUM_TRACKS = 200_000
+TRACKS_PER_ARTIST = 20
+TRACKS_PER_ALBUM = 10
+NUM_GENRES = 100
+
+
+def track_rows(num_tracks):
+    # Rows shaped like those of TrackCSVReader.iter_tracks_file, generated so none of them are kept around.
+    for track_id in range(num_tracks):
+        artist_id = track_id // TRACKS_PER_ARTIST
+        album_id = track_id // TRACKS_PER_ALBUM
+        genre_id = track_id % NUM_GENRES
+        yield {
+            'track_id': str(track_id), 'track_title': f'Track {track_id}',
+            'artist_id': str(artist_id), 'artist_name': f'Artist {artist_id}',
+            'album_id': str(album_id), 'album_title': f'Album {album_id}',
+            'track_duration': str(60 + track_id % 300),
+            'track_url': f'http://freemusicarchive.org/music/Artist_{artist_id}/Album_{album_id}/Track_{track_id}',
+            'track_genres': f"[{{'genre_id': '{genre_id}', 'genre_title': 'Genre {genre_id}', "
+                            f"'genre_url': 'http://freemusicarchive.org/genre/{genre_id}/'}}]"
+        }
+
+
+def populate(repository, num_tracks):
+    tracemalloc.start()
+    repository.populate_tracks(track_rows(num_tracks))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+def time_ms(function, repeats=5):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    num_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_TRACKS
+    repositories = {'MemoryRepository': MemoryRepository(), 'ColumnarRepository': ColumnarRepository()}
+
+    print(f"{num_tracks} tracks, MB held by the repository and ms per call of: a page of 50 tracks, the tracks of a "
+          f"genre and of an artist, and the number of tracks of every genre")
+    print(f"  {'':20} {'MB':>8} {'page':>8} {'genre':>8} {'artist':>8} {'count':>8}")
+    for name, repository in repositories.items():
+        used = populate(repository, num_tracks)
+        # Built on first use, so the timings below are of warm indexes.
+        repository.get_tracks_by_genre('Genre 1')
+        repository.get_tracks_by_artist('Artist 1')
+        page = time_ms(lambda: repository.get_tracks_page(num_tracks // 2, 50))
+        genre = time_ms(lambda: len(repository.get_tracks_by_genre('Genre 7')))
+        artist = time_ms(lambda: repository.get_tracks_by_artist(f'Artist {num_tracks // TRACKS_PER_ARTIST // 2}'))
+        if isinstance(repository, ColumnarRepository):
+            count = time_ms(repository.count_tracks_by_genre)
+        else:
+            count = time_ms(lambda: {genre_name: len(repository.get_tracks_by_genre(genre_name))
+                                     for genre_name in repository.get_genre_names()})
+        print(f"  {name:20} {used / 2 ** 20:8.1f} {page:8.3f} {genre:8.3f} {artist:8.3f} {count:8.3f}")
+
+
+if __name__ == '__main__':
+    main()
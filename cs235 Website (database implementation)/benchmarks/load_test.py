@@ -0,0 +1,69 @@
+"""Throughput of the app under gunicorn for an increasing number of workers.
+
+Every run starts gunicorn with gunicorn.conf.py and keeps CLIENTS threads requesting pages for DURATION seconds.
+Run from the project directory with: python -m benchmarks.load_test
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+WORKERS = (1, 2, 4)
+CLIENTS = 16
+DURATION = 5.0
+BIND = '127.0.0.1:5055'
+URLS = ('/', '/tracks/1', '/tracks/50', '/track_find/2', '/track_find_artist/AWOL', '/search_tracks/1?q=love')
+
+
+def wait_until_up(timeout=60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://{BIND}/', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+def requests_per_second():
+    counts = [0] * CLIENTS
+    errors = [0] * CLIENTS
+    deadline = time.time() + DURATION
+
+    def client(number):
+        while time.time() < deadline:
+            for url in URLS:
+                try:
+                    urllib.request.urlopen(f'http://{BIND}{url}', timeout=10).read()
+                    counts[number] += 1
+                except OSError:
+                    errors[number] += 1
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / DURATION, sum(errors)
+
+
+def main():
+    print(f"requests/s with {CLIENTS} concurrent clients ({os.cpu_count()} cpus)")
+    for workers in WORKERS:
+        environment = dict(os.environ, GUNICORN_WORKERS=str(workers), GUNICORN_BIND=BIND)
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                                  env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up()
+            result, errors = requests_per_second()
+            print(f"  {workers} workers {result:10.0f}   errors {errors}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Times TrackCSVReader.read_csv_files with the tracks file parsed by 1, 2, 4, ... worker processes.
+
+The tracks file is the excerpt repeated until it has the given number of rows, so it keeps the ~40 columns, the
+genre lists and the quoted newlines of the FMA dump.
+
+Run from the project directory with: python -m benchmarks.parallel_csv_benchmark [number of tracks]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from music.adapters.csvdatareader import TrackCSVReader, csv_record_ranges
+
+DATA_PATH = 'music/adapters/data'
+NUM_TRACKS = 100_000
+
+
+def write_tracks_file(path, num_tracks):
+    excerpt = os.path.join(DATA_PATH, 'raw_tracks_excerpt.csv')
+    header, ranges = csv_record_ranges(excerpt, 1)
+    with open(excerpt, 'rb') as excerpt_csv:
+        data = excerpt_csv.read()
+    body = data[ranges[0][0]:]
+    rows_per_copy = sum(1 for _ in TrackCSVReader(excerpt, excerpt).iter_tracks_file())
+    with open(path, 'wb') as tracks_csv:
+        tracks_csv.write(data[:ranges[0][0]])
+        for _ in range(max(1, num_tracks // rows_per_copy)):
+            tracks_csv.write(body)
+
+
+def describe(tracks):
+    return [(track.track_id, track.title, track.artist.full_name, track.album, tuple(track.genres)) for track in tracks]
+
+
+def main():
+    num_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_TRACKS
+    albums_path = os.path.join(DATA_PATH, 'raw_albums_excerpt.csv')
+    with tempfile.TemporaryDirectory() as directory:
+        tracks_path = os.path.join(directory, 'raw_tracks.csv')
+        write_tracks_file(tracks_path, num_tracks)
+        print(f"{os.path.getsize(tracks_path) / 2 ** 20:.1f} MB tracks file, {os.cpu_count()} cores")
+        expected = None
+        serial_seconds = None
+        workers = 1
+        while workers <= max(os.cpu_count(), 2):
+            start = time.perf_counter()
+            tracks = TrackCSVReader(albums_path, tracks_path).read_csv_files(workers=workers)
+            seconds = time.perf_counter() - start
+            serial_seconds = serial_seconds or seconds
+            if expected is None:
+                expected = describe(tracks)
+            same = describe(tracks) == expected
+            print(f"  {workers:3} workers {seconds:8.2f}s  x{serial_seconds / seconds:5.2f}  "
+                  f"{len(tracks)} tracks{'' if same else ', DIFFERENT FROM ONE WORKER'}")
+            workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Requests per second of concurrent readers for each SQLALCHEMY_POOL mode.
+
+Every reader is a separate process with its own app, all reading the same database file.
+Run from the project directory with: python -m benchmarks.pool_benchmark
+"""
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy.orm import clear_mappers
+
+from music import create_app
+import music.adapters.repository as repo
+from utils import get_project_root
+
+DATA_PATH = get_project_root() / "music" / "adapters" / "data"
+URLS = ('/', '/tracks/1', '/tracks/50', '/track_find/2', '/track_find_artist/AWOL')
+READERS = (1, 4, 8)
+DURATION = 3.0
+SESSIONS = 2000
+
+
+def read(database_uri, pool_mode, start):
+    clear_mappers()
+    app = create_app({'TESTING': False, 'TEST_DATA_PATH': DATA_PATH, 'SQLALCHEMY_DATABASE_URI': database_uri,
+                      'SQLALCHEMY_POOL': pool_mode})
+    client = app.test_client()
+    # All readers start together, after every app has been created.
+    time.sleep(max(start - time.time(), 0))
+    count = 0
+    while time.time() < start + DURATION:
+        for url in URLS:
+            client.get(url)
+            count += 1
+    return count
+
+
+def requests_per_second(database_uri, pool_mode, readers):
+    start = time.time() + 2.0
+    with multiprocessing.Pool(readers) as pool:
+        counts = pool.starmap(read, [(database_uri, pool_mode, start)] * readers)
+    return sum(counts) / DURATION
+
+
+def sessions_per_second(database_uri, pool_mode):
+    # Only the repository: a new session per lookup, the way every request starts with reset_session.
+    clear_mappers()
+    create_app({'TESTING': False, 'TEST_DATA_PATH': DATA_PATH, 'SQLALCHEMY_DATABASE_URI': database_uri,
+                'SQLALCHEMY_POOL': pool_mode})
+    start = time.perf_counter()
+    for track_id in range(SESSIONS):
+        repo.repo_instance.reset_session()
+        repo.repo_instance.get_track_by_id(track_id)
+        repo.repo_instance.close_session()
+    return SESSIONS / (time.perf_counter() - start)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = f"sqlite:///{Path(directory) / 'music.db'}"
+        # Populates the database file once, the readers only open it.
+        create_app({'TESTING': True, 'TEST_DATA_PATH': DATA_PATH, 'SQLALCHEMY_DATABASE_URI': database_uri})
+        print("requests/s by pool mode and number of concurrent readers")
+        print(f"  {'pool':10}" + ''.join(f"{readers:>10}" for readers in READERS))
+        for pool_mode in ('null', 'singleton', 'queue'):
+            results = [requests_per_second(database_uri, pool_mode, readers) for readers in READERS]
+            print(f"  {pool_mode:10}" + ''.join(f"{result:10.0f}" for result in results))
+        print("sessions/s with one track lookup each, by pool mode")
+        for pool_mode in ('null', 'singleton', 'queue'):
+            print(f"  {pool_mode:10}{sessions_per_second(database_uri, pool_mode):10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Compares search_tracks against a linear scan over every track.
+
+Run from the project directory with: python -m benchmarks.search_benchmark
+"""
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, clear_mappers
+
+from music.adapters.csvdatareader import TrackCSVReader
+from music.adapters.csv_data_importer import create_objects_bulk
+from music.adapters.database_repository import SqlAlchemyRepository
+from music.adapters.memory_repository import MemoryRepository
+from music.adapters.orm import metadata, map_model_to_tables
+from music.adapters.repository import search_terms
+from utils import get_project_root
+
+DATA_PATH = get_project_root() / "music" / "adapters" / "data"
+QUERIES = ('kurt', 'love', 'the night', 'live at', 'remix', 'zzz')
+REPEATS = 20
+
+
+def linear_scan(tracks, query, limit=10):
+    # What searching costs without an index: every title, artist name and album title is checked per query.
+    terms = search_terms(query)
+    matches = []
+    for track in tracks:
+        words = search_terms(' '.join(text for text in (
+            track.title,
+            track.artist.full_name if track.artist is not None else None,
+            track.album.title if track.album is not None else None
+        ) if text is not None))
+        if terms and all(any(word.startswith(term) for word in words) for term in terms):
+            matches.append(track)
+    return matches[:limit]
+
+
+def time_queries(search):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        for query in QUERIES:
+            search(query)
+    return (time.perf_counter() - start) / (REPEATS * len(QUERIES)) * 1000
+
+
+def main():
+    data = TrackCSVReader(str(DATA_PATH / 'raw_albums_excerpt.csv'), str(DATA_PATH / 'raw_tracks_excerpt.csv'))
+
+    memory_repo = MemoryRepository()
+    memory_repo.populate_tracks(data.iter_tracks_file())
+    tracks = memory_repo.get_track_list()
+
+    clear_mappers()
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+    map_model_to_tables()
+    database_repo = SqlAlchemyRepository(sessionmaker(autocommit=False, autoflush=True, bind=engine))
+    create_objects_bulk(data.iter_tracks_file(), data.iter_albums_file(), database_repo)
+
+    print(f"{len(tracks)} tracks, {len(QUERIES)} queries x {REPEATS} repeats, average ms per query:")
+    print(f"  linear scan             {time_queries(lambda query: linear_scan(tracks, query)):8.3f}")
+    print(f"  MemoryRepository index  {time_queries(memory_repo.search_tracks):8.3f}")
+    print(f"  SQLite FTS5             {time_queries(database_repo.search_tracks):8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Compares starting from a catalogue snapshot with importing the rows into a ColumnarRepository.
+
+Run from the project directory with: python -m benchmarks.snapshot_benchmark [number of tracks]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.columnar_benchmark import NUM_TRACKS, track_rows
+from music.adapters.columnar_repository import ColumnarRepository
+
+
+def start(function):
+    # Seconds and MB allocated on the Python heap until the repository is ready to answer a page.
+    tracemalloc.start()
+    started = time.perf_counter()
+    repository = function()
+    repository.get_tracks_page(-1, 50)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return repository, elapsed, current
+
+
+def main():
+    num_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_TRACKS
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'catalogue.snapshot')
+
+        def populate():
+            repository = ColumnarRepository()
+            repository.populate_tracks(track_rows(num_tracks))
+            return repository
+
+        populated, populate_seconds, populate_bytes = start(populate)
+        populated.save_snapshot(path)
+        snapshot, open_seconds, open_bytes = start(lambda: ColumnarRepository.open_snapshot(path))
+
+        print(f"{num_tracks} tracks, seconds and MB on the heap until the first page, snapshot of "
+              f"{os.path.getsize(path) / 2 ** 20:.1f} MB mapped and shared between processes")
+        print(f"  {'import':10} {populate_seconds:8.3f} {populate_bytes / 2 ** 20:8.1f}")
+        print(f"  {'snapshot':10} {open_seconds:8.3f} {open_bytes / 2 ** 20:8.1f}")
+        del snapshot
+
+
+if __name__ == '__main__':
+    main()
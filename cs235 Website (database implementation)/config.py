@@ -18,9 +18,11 @@ class Config:
     TESTING = environ.get('TESTING')
 
     REPOSITORY = environ.get('REPOSITORY')
+    CATALOGUE_SNAPSHOT = environ.get('CATALOGUE_SNAPSHOT', 'catalogue.snapshot')
 
     # Database configuration
     SQLALCHEMY_DATABASE_URI = environ.get('SQLALCHEMY_DATABASE_URI')
+    SQLALCHEMY_POOL = environ.get('SQLALCHEMY_POOL', 'queue')
 
     echo_string = environ.get('SQLALCHEMY_ECHO')
     SQLALCHEMY_ECHO = False
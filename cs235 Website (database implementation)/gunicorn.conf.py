@@ -0,0 +1,38 @@
+"""gunicorn settings, used from this directory with: gunicorn wsgi:app"""
+import multiprocessing
+from os import environ
+
+bind = environ.get('GUNICORN_BIND', '127.0.0.1:5000')
+workers = int(environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(environ.get('GUNICORN_THREADS', 4))
+
+# The app is created, and the database populated, once in the master process before the workers are forked.
+preload_app = True
+
+
+def on_starting(server):
+    # The 'memory', 'columnar' and 'snapshot' repositories keep users and reviews in the memory of the process, where
+    # other workers would never see them. Those modes run a single worker, whose threads share the repository.
+    import music.adapters.repository as repo
+    from music.adapters.memory_repository import MemoryRepository
+    from music.adapters.columnar_repository import ColumnarRepository
+    if isinstance(repo.repo_instance, (MemoryRepository, ColumnarRepository)) and server.num_workers > 1:
+        server.log.warning("%s keeps users and reviews in memory, running 1 worker instead of %s",
+                           type(repo.repo_instance).__name__, server.num_workers)
+        server.num_workers = 1
+
+
+def pre_fork(server, worker):
+    # A catalogue reload started by the preloaded app runs in this process, so it is finished before forking: every
+    # worker starts from the new catalogue, and no connection is in use by the reload when the pool is emptied.
+    # Imports by other processes are noticed by the workers through the catalogue version of the database.
+    import threading
+    from music.adapters.csv_data_importer import RELOAD_THREAD_NAME
+    for thread in threading.enumerate():
+        if thread.name == RELOAD_THREAD_NAME:
+            thread.join()
+
+    # An open SQLite connection must not be carried into a forked process, so the pool is emptied first.
+    import music.adapters.repository as repo
+    if hasattr(repo.repo_instance, 'dispose_connections'):
+        repo.repo_instance.dispose_connections()
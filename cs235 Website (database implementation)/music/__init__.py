@@ -1,52 +1,93 @@
 """Initialize Flask app."""
 
 # from pathlib import Path
+import threading
 
-from flask import Flask
+from flask import Flask, g, has_app_context
 from music.adapters.csvdatareader import TrackCSVReader
 from music.adapters import database_repository
 from music.adapters.abstract_repository import new_repository as new_repo
-from music.adapters.orm import metadata, map_model_to_tables
-from music.adapters.csv_data_importer import create_objects
+from music.adapters.orm import metadata, map_model_to_tables, create_missing_indexes
+from music.adapters.database_engine import create_database_engine
+from music.adapters.caching_repository import CachingRepository
+from music.adapters.columnar_repository import ColumnarRepository
+from music.page_cache import PageCache
+from music.adapters.csv_data_importer import create_objects_bulk, csv_import_metadata, stale_import_metadata, \
+    reload_catalogue, reload_catalogue_in_background, open_catalogue_snapshot
 
 import music.adapters.repository as repo
 from flask_wtf.csrf import CSRFProtect
 
 # imports from SQLAlchemy
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, clear_mappers
-from sqlalchemy.pool import NullPool
 
-def create_app():
+def app_context_scope():
+    # Database sessions belong to the Flask app context, which is pushed for every request, so concurrent requests
+    # never share one. Outside of an app context, e.g. while the database is populated, the thread is the scope.
+    if has_app_context():
+        return g._get_current_object()
+    return threading.get_ident()
+
+
+def create_app(test_config=None):
     app = Flask(__name__)
 
     app.secret_key = 'very secret'
     CSRFProtect(app)
 
     data_path = 'music/adapters/data'
-
-    data = TrackCSVReader(data_path+'/raw_albums_excerpt.csv', data_path+'/raw_tracks_excerpt.csv')
-    tracks = data.read_tracks_file()
-    albums = data.read_albums_file()
-
     testing = False
-
     database_uri = 'sqlite:///music.db'
     SQLALCHEMY_ECHO = False
+    pool_mode = "queue"
     repository_mode = "database"
+    repository_cache = True
+    repository_cache_ttl = 300.0
+    page_cache = True
+    page_cache_ttl = 300.0
+    import_in_background = True
+    import_mode = "sync"
+    catalogue_snapshot = 'catalogue.snapshot'
+
+    if test_config is not None:
+        # Load test configuration, and override any configuration settings.
+        app.config.from_mapping(test_config)
+        data_path = str(app.config.get('TEST_DATA_PATH', data_path))
+        testing = app.config.get('TESTING', testing)
+        database_uri = app.config.get('SQLALCHEMY_DATABASE_URI', database_uri)
+        pool_mode = app.config.get('SQLALCHEMY_POOL', pool_mode)
+        repository_mode = app.config.get('REPOSITORY', repository_mode)
+        repository_cache = app.config.get('REPOSITORY_CACHE', repository_cache)
+        repository_cache_ttl = app.config.get('REPOSITORY_CACHE_TTL', repository_cache_ttl)
+        page_cache = app.config.get('PAGE_CACHE', page_cache)
+        page_cache_ttl = app.config.get('PAGE_CACHE_TTL', page_cache_ttl)
+        import_in_background = app.config.get('IMPORT_IN_BACKGROUND', import_in_background)
+        import_mode = app.config.get('IMPORT_MODE', import_mode)
+        catalogue_snapshot = app.config.get('CATALOGUE_SNAPSHOT', catalogue_snapshot)
+
+    data_files = (data_path+'/raw_albums_excerpt.csv', data_path+'/raw_tracks_excerpt.csv')
+    data = TrackCSVReader(*data_files)
+    # Rows are streamed from the csv files only when the repository is populated, nothing is kept around.
+    tracks = data.iter_tracks_file()
+    albums = data.iter_albums_file()
+    # Import metadata of csv files that still have to be loaded into an existing database.
+    stale_import = None
     if repository_mode == "database":
         # We create a comparatively simple SQLite database, which is based on a single file (see .env for URI).
         # For example the file database could be located locally and relative to the application in music.db,
         # leading to a URI of "sqlite:///music.db".
         # Note that create_engine does not establish any actual DB connection directly!
         database_echo = SQLALCHEMY_ECHO
-        # Please do not change the settings for connect_args and poolclass!
-        database_engine = create_engine(database_uri, connect_args={"check_same_thread": False}, poolclass=NullPool,
-                                        echo=database_echo)
+        # Connections are pooled (SQLALCHEMY_POOL is 'queue', 'singleton' or 'null' for one connection per
+        # session) and opened in WAL mode, see database_engine.py.
+        database_engine = create_database_engine(database_uri, pool_mode=pool_mode, echo=database_echo)
 
         # Create the database session factory using sessionmaker (this has to be done once, in a global manner)
-        session_factory = sessionmaker(autocommit=False, autoflush=True, bind=database_engine)
-        repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory)
+        # Objects are not expired on commit, so those held by the repository cache stay readable after their
+        # session has been closed.
+        session_factory = sessionmaker(autocommit=False, autoflush=True, expire_on_commit=False,
+                                       bind=database_engine)
+        repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory, scopefunc=app_context_scope)
 
         if testing or len(database_engine.table_names()) == 0:
             print("Populating database...")
@@ -56,12 +97,51 @@ def create_app():
             for table in reversed(metadata.sorted_tables):
                 database_engine.execute(table.delete())
 
-            create_objects(tracks, albums, repo.repo_instance)  # populates the database.
+            # populates the database.
+            create_objects_bulk(tracks, albums, repo.repo_instance, import_metadata=csv_import_metadata(*data_files))
             print("Population done.")
         else:
+            create_missing_indexes(database_engine)
             map_model_to_tables()
+            # The csv files are only read if they changed since the database was populated from them.
+            stale_import = stale_import_metadata(repo.repo_instance, *data_files)
+        # Requests start with their own sessions.
+        repo.repo_instance.close_session()
+        if repository_cache:
+            # The catalogue only changes on imports, so most reads are answered without a query.
+            repo.repo_instance = CachingRepository(repo.repo_instance, ttl=repository_cache_ttl)
+    elif repository_mode == "columnar":
+        # Read-optimised catalogue held in typed arrays, see columnar_repository.py.
+        repo.repo_instance = ColumnarRepository()
+        repo.repo_instance.populate_albums(albums)
+        repo.repo_instance.populate_tracks(tracks)
+    elif repository_mode == "snapshot":
+        # The columnar catalogue mapped read-only from a snapshot file, which is rewritten when the csv files change.
+        # Its pages are shared with every other process mapping the file, e.g. another app serving the same catalogue.
+        # Users and reviews are held in memory, as in the other in-memory modes, so the app is served by a single
+        # process; gunicorn.conf.py runs one worker for these modes.
+        repo.repo_instance = open_catalogue_snapshot(catalogue_snapshot, *data_files)
     else:
         new_repo.populate_tracks(tracks)
+        repo.repo_instance = new_repo
+
+    if page_cache and isinstance(repo.repo_instance, CachingRepository):
+        # Rendered pages for anonymous visitors, dropped by the same writes that invalidate the repository cache.
+        # Reviews and imports of the other gunicorn workers show in the data version of the shared database.
+        app.extensions['page_cache'] = PageCache(ttl=page_cache_ttl, version=repo.repo_instance.get_data_version)
+        repo.repo_instance.add_invalidation_listener(app.extensions['page_cache'].on_repository_change)
+
+    if stale_import is not None:
+        # Reloaded through repo_instance, so the caches are invalidated once the new catalogue is committed.
+        # IMPORT_MODE "sync" only writes the changed rows, "reload" replaces the whole catalogue.
+        incremental = import_mode == "sync"
+        if import_in_background:
+            reload_catalogue_in_background(tracks, albums, repo.repo_instance, import_metadata=stale_import,
+                                           incremental=incremental)
+        else:
+            reload_catalogue(tracks, albums, repo.repo_instance, import_metadata=stale_import,
+                             incremental=incremental)
+            repo.repo_instance.close_session()
 
     with app.app_context():
         # Register blueprints.
@@ -78,13 +158,13 @@ def create_app():
         # We reset the session inside the database repository before a new flask request is generated
         @app.before_request
         def before_flask_http_request_function():
-            if isinstance(repo.repo_instance, database_repository.SqlAlchemyRepository):
+            if isinstance(repo.repo_instance, (database_repository.SqlAlchemyRepository, CachingRepository)):
                 repo.repo_instance.reset_session()
 
         # Register a tear-down method that will be called after each request has been processed.
         @app.teardown_appcontext
         def shutdown_session(exception=None):
-            if isinstance(repo.repo_instance, database_repository.SqlAlchemyRepository):
+            if isinstance(repo.repo_instance, (database_repository.SqlAlchemyRepository, CachingRepository)):
                 repo.repo_instance.close_session()
 
     return app
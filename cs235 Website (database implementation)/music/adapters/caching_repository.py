@@ -0,0 +1,258 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+from music.domainmodel.review import Review
+from music.domainmodel.track import Track
+from music.domainmodel.album import Album
+from music.domainmodel.artist import Artist
+from music.domainmodel.user import User
+from music.domainmodel.genre import Genre
+from music.adapters.repository import AbstractRepository, VersionCheck
+
+# Cached read methods, grouped by the kind of write that makes their results stale. Only the catalogue is cached: it
+# changes on imports, while users and reviews change at runtime through any of the server's processes, and a write
+# only invalidates the caches of the process it went through.
+CACHED_METHODS = {
+    'catalogue': (
+        'get_track_by_id', 'get_track_ids', 'get_tracks_page', 'get_num_tracks', 'get_track_list',
+        'get_tracks_by_artist', 'get_tracks_by_title', 'get_tracks_by_genre', 'get_artist_names', 'get_track_titles',
+        'get_genre_names', 'search_tracks', 'get_suggestions', 'get_artist_list', 'get_album_list',
+        'get_album_by_id', 'get_artist_by_id'
+    ),
+}
+
+_MISSING = object()
+
+
+class TTLCache:
+    # Least recently used results of one method, by arguments. Entries expire ttl seconds after they were stored.
+
+    def __init__(self, maxsize: int, ttl: float, clock=time.monotonic):
+        self.__maxsize = maxsize
+        self.__ttl = ttl
+        self.__clock = clock
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires, value = entry
+            if expires <= self.__clock():
+                del self.__entries[key]
+                return _MISSING
+            self.__entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__entries[key] = (self.__clock() + self.__ttl, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__maxsize:
+                self.__entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+class CachingRepository(AbstractRepository):
+    # Read-through cache in front of any repository. Reads of CACHED_METHODS are answered from per-method caches,
+    # the add_* methods write through to the wrapped repository and then drop the cached results they make stale.
+    # Everything else, e.g. reset_session, is passed on to the wrapped repository unchanged.
+    # Imports by other processes are noticed through the catalogue version of the wrapped repository, which is checked
+    # at most every revalidate_interval seconds.
+
+    def __init__(self, repository, ttl: float = 300.0, maxsize: int = 4096, clock=time.monotonic,
+                 revalidate_interval: float = 1.0):
+        self.__repository = repository
+        self.__catalogue_version = VersionCheck(repository.get_catalogue_version, revalidate_interval, clock)
+        self.__caches = {method: TTLCache(maxsize, ttl, clock)
+                         for methods in CACHED_METHODS.values() for method in methods}
+        self.__hits = dict.fromkeys(self.__caches, 0)
+        self.__misses = dict.fromkeys(self.__caches, 0)
+        self.__listeners = []
+        # Track of the review last added by the current thread, for add_user_to_review.
+        self.__last_review = threading.local()
+
+    def __getattr__(self, name):
+        if name.startswith('_CachingRepository__'):
+            raise AttributeError(name)
+        return getattr(self.__repository, name)
+
+    @property
+    def repository(self):
+        return self.__repository
+
+    @property
+    def hits(self) -> int:
+        return sum(self.__hits.values())
+
+    @property
+    def misses(self) -> int:
+        return sum(self.__misses.values())
+
+    def cache_stats(self) -> dict:
+        return {method: {'hits': self.__hits[method], 'misses': self.__misses[method], 'size': len(cache)}
+                for method, cache in self.__caches.items()}
+
+    def add_invalidation_listener(self, listener):
+        # listener(group, track_id) is called after a write, with group 'catalogue', 'users' or 'reviews', and
+        # the id of the reviewed track for reviews (None when every track may be affected).
+        self.__listeners.append(listener)
+
+    def invalidate(self, group: str, track_id: int = None):
+        for method in CACHED_METHODS.get(group, ()):
+            self.__caches[method].clear()
+        for listener in self.__listeners:
+            listener(group, track_id)
+
+    def __cached(self, method: str, *args):
+        if self.__catalogue_version.changed():
+            self.invalidate('catalogue')
+        cache = self.__caches[method]
+        value = cache.get(args)
+        if value is not _MISSING:
+            self.__hits[method] += 1
+            return value
+        self.__misses[method] += 1
+        value = getattr(self.__repository, method)(*args)
+        cache.put(args, value)
+        return value
+
+    def add_user(self, user: User):
+        self.__repository.add_user(user)
+        self.invalidate('users')
+
+    def get_user(self, user_name) -> User:
+        return self.__repository.get_user(user_name)
+
+    def get_number_of_users(self):
+        return self.__repository.get_number_of_users()
+
+    def get_num_users(self):
+        return self.__repository.get_num_users()
+
+    def add_track(self, track: Track):
+        self.__repository.add_track(track)
+        self.invalidate('catalogue')
+
+    def add_genre(self, genre: Genre):
+        self.__repository.add_genre(genre)
+        self.invalidate('catalogue')
+
+    def add_artist(self, artist: Artist):
+        self.__repository.add_artist(artist)
+        self.invalidate('catalogue')
+
+    def add_album(self, album: Album):
+        self.__repository.add_album(album)
+        self.invalidate('catalogue')
+
+    def bulk_load(self, batches, replace: bool = False) -> int:
+        rows_inserted = self.__repository.bulk_load(batches, replace)
+        self.invalidate('catalogue')
+        return rows_inserted
+
+    def sync_catalogue(self, batches) -> dict:
+        changes = self.__repository.sync_catalogue(batches)
+        self.invalidate('catalogue')
+        return changes
+
+    def get_track_by_id(self, id: int) -> Track:
+        return self.__cached('get_track_by_id', id)
+
+    def get_track_ids(self) -> List[int]:
+        return self.__cached('get_track_ids')
+
+    def get_random_track(self) -> Track:
+        # Picked from the cached ids, so the sidebar track of every page is normally served from the cache.
+        track_ids = self.get_track_ids()
+        if len(track_ids) == 0:
+            return None
+        return self.get_track_by_id(random.choice(track_ids))
+
+    def get_tracks_page(self, after_id: int, limit: int) -> List[Track]:
+        return self.__cached('get_tracks_page', after_id, limit)
+
+    def get_num_tracks(self):
+        return self.__cached('get_num_tracks')
+
+    def get_track_list(self) -> List[Track]:
+        return self.__cached('get_track_list')
+
+    def get_tracks_by_artist(self, artist_name: str) -> List[Track]:
+        return self.__cached('get_tracks_by_artist', artist_name)
+
+    def get_tracks_by_title(self, track_title: str) -> List[Track]:
+        return self.__cached('get_tracks_by_title', track_title)
+
+    def get_tracks_by_genre(self, genre_name: str) -> List[Track]:
+        return self.__cached('get_tracks_by_genre', genre_name)
+
+    def get_artist_names(self) -> List[str]:
+        return self.__cached('get_artist_names')
+
+    def get_track_titles(self) -> List[str]:
+        return self.__cached('get_track_titles')
+
+    def get_genre_names(self) -> List[str]:
+        return self.__cached('get_genre_names')
+
+    def search_tracks(self, query: str, limit: int = 10, offset: int = 0) -> List[Track]:
+        return self.__cached('search_tracks', query, limit, offset)
+
+    def get_suggestions(self, field: str, prefix: str, limit: int = 10) -> List[str]:
+        return self.__cached('get_suggestions', field, prefix, limit)
+
+    def get_artist_list(self) -> List[Artist]:
+        return self.__cached('get_artist_list')
+
+    def get_album_list(self) -> List[Album]:
+        return self.__cached('get_album_list')
+
+    def get_album_by_id(self, id: int) -> Album:
+        return self.__cached('get_album_by_id', id)
+
+    def get_artist_by_id(self, id: int) -> Artist:
+        return self.__cached('get_artist_by_id', id)
+
+    def get_review_list(self) -> List[Review]:
+        return self.__repository.get_review_list()
+
+    def get_review_by_track(self, track_id: int) -> List[Review]:
+        return self.__repository.get_review_by_track(track_id)
+
+    def get_user_by_track(self, track_id: int) -> List[User]:
+        return self.__repository.get_user_by_track(track_id)
+
+    def get_reviews_and_users_by_track(self, track_id: int):
+        return self.__repository.get_reviews_and_users_by_track(track_id)
+
+    def get_data_version(self):
+        return self.__repository.get_data_version()
+
+    def get_catalogue_version(self):
+        return self.__repository.get_catalogue_version()
+
+    def add_review(self, review: Review, user: User = None):
+        self.__repository.add_review(review, user)
+        self.__last_review.track_id = review.track.track_id if review.track is not None else None
+        self.invalidate('reviews', self.__last_review.track_id)
+
+    def add_user_to_review(self, user: User):
+        # The wrapped repository gives the user to the latest review, i.e. the one just added by add_review.
+        self.__repository.add_user_to_review(user)
+        self.invalidate('reviews', getattr(self.__last_review, 'track_id', None))
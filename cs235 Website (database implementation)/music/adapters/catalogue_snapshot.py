@@ -0,0 +1,98 @@
+import json
+import mmap
+import os
+import struct
+import sys
+
+from music.adapters.repository import RepositoryException
+
+# A catalogue snapshot is one file of named, typed arrays that is mapped read-only into every process using it, so
+# gunicorn workers share the same physical pages and opening it does not depend on the size of the catalogue.
+#
+# Layout: a header, a directory with one entry per section, then the sections. Every section is the raw memory of
+# an array.array, aligned to 8 bytes and stored in the byte order of the machine that wrote it.
+SNAPSHOT_MAGIC = b'CS235CAT'
+# Incremented whenever the sections written by ColumnarRepository.save_snapshot change.
+SNAPSHOT_VERSION = 1
+# magic, version, byte order ('<' or '>'), number of sections
+HEADER = struct.Struct('<8sIcxxxI')
+# section name, array type code, item size, offset in the file, number of items
+SECTION = struct.Struct('<48scBxxxxxxQQ')
+ALIGNMENT = 8
+BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+
+
+def aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(path, sections: dict, metadata: dict):
+    # sections maps names to arrays (or anything else with a typed buffer), metadata is stored as json.
+    # The file is written next to path and then renamed over it, so a process opening path never sees half of it,
+    # and processes that mapped the previous file keep reading that.
+    views = {name: memoryview(section) for name, section in sections.items()}
+    views['metadata'] = memoryview(json.dumps(metadata).encode('utf-8'))
+    offset = aligned(HEADER.size + SECTION.size * len(views))
+    directory = []
+    for name, view in views.items():
+        directory.append(SECTION.pack(name.encode('utf-8'), view.format.encode('ascii'), view.itemsize, offset,
+                                      len(view)))
+        offset = aligned(offset + view.nbytes)
+
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, BYTE_ORDER, len(views)))
+        snapshot_file.write(b''.join(directory))
+        for view in views.values():
+            snapshot_file.write(bytes(aligned(snapshot_file.tell()) - snapshot_file.tell()))
+            snapshot_file.write(view)
+    os.replace(temporary_path, path)
+
+
+def read_snapshot(path):
+    # Maps the snapshot at path and returns the mmap, the sections as memoryviews of their array type, and the
+    # metadata. The memoryviews stay valid for as long as they are referenced.
+    with open(path, 'rb') as snapshot_file:
+        if os.fstat(snapshot_file.fileno()).st_size < HEADER.size:
+            raise RepositoryException(f'{path} is not a catalogue snapshot')
+        snapshot = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, byte_order, num_sections = HEADER.unpack_from(snapshot, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise RepositoryException(f'{path} is not a catalogue snapshot')
+    if version != SNAPSHOT_VERSION or byte_order != BYTE_ORDER:
+        raise RepositoryException(f'{path} is a version {version} snapshot in byte order {byte_order.decode()}, '
+                                  f'expected version {SNAPSHOT_VERSION} in {BYTE_ORDER.decode()}')
+
+    data = memoryview(snapshot)
+    sections = dict()
+    for index in range(num_sections):
+        name, type_code, item_size, offset, length = SECTION.unpack_from(snapshot, HEADER.size + SECTION.size * index)
+        if offset + item_size * length > len(snapshot):
+            raise RepositoryException(f'{path} is truncated')
+        section = data[offset:offset + item_size * length].cast(type_code.decode('ascii'))
+        if section.itemsize != item_size:
+            raise RepositoryException(f'{path} was written with {item_size} byte {type_code.decode()} items')
+        sections[name.rstrip(b'\0').decode('utf-8')] = section
+    metadata = json.loads(bytes(sections.pop('metadata')))
+    return snapshot, sections, metadata
+
+
+def update_snapshot_metadata(path, metadata: dict):
+    # Rewrites the snapshot at path with its metadata updated by metadata, the sections are copied as they are.
+    snapshot, sections, stored = read_snapshot(path)
+    write_snapshot(path, sections, {**stored, **metadata})
+
+
+def main():
+    # python -m music.adapters.catalogue_snapshot [data directory] [snapshot path]
+    # Writes the snapshot ahead of starting the app, e.g. in a deploy step.
+    from music.adapters.csv_data_importer import build_catalogue_snapshot
+
+    data_path = sys.argv[1] if len(sys.argv) > 1 else 'music/adapters/data'
+    snapshot_path = sys.argv[2] if len(sys.argv) > 2 else 'catalogue.snapshot'
+    build_catalogue_snapshot(os.path.join(data_path, 'raw_albums_excerpt.csv'),
+                             os.path.join(data_path, 'raw_tracks_excerpt.csv'), snapshot_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,714 @@
+import random
+import threading
+from array import array
+from bisect import bisect, bisect_left
+from collections.abc import Sequence
+from itertools import accumulate
+from typing import List
+
+from music.adapters.repository import AbstractRepository, RepositoryException, normalise_title, search_terms, \
+    SEARCH_FIELD_WEIGHTS
+from music.adapters.catalogue_snapshot import write_snapshot, read_snapshot
+from music.adapters.prefix_index import PrefixIndex
+from music.adapters.csvdatareader import ImportContext, extract_genres
+from music.domainmodel.review import Review
+from music.domainmodel.track import Track
+from music.domainmodel.album import Album
+from music.domainmodel.artist import Artist
+from music.domainmodel.user import User
+from music.domainmodel.genre import Genre
+
+# Stands for a missing value in the integer columns, i.e. no artist, album, duration or release year.
+NULL = -1
+
+# Array type codes: 64 bit for ids and offsets, 32 bit for row numbers, string codes and small numbers.
+ID_TYPE = 'q'
+ROW_TYPE = 'i'
+
+# Field -> (index of the artist, album or genre rows per string code, index of the track rows per owner row).
+OWNER_INDEXES = {
+    'artist': ('artists_by_name', 'tracks_by_artist'),
+    'album': ('albums_by_title', 'tracks_by_album'),
+    'genre': ('genres_by_name', 'tracks_by_genre'),
+}
+
+# Inverted indexes stored in a snapshot, so none of them has to be built in the processes opening it.
+SNAPSHOT_INDEXES = ('tracks_by_title', 'tracks_by_artist', 'tracks_by_album', 'tracks_by_genre', 'artists_by_name',
+                    'albums_by_title', 'genres_by_name')
+
+
+class StringTable:
+    # Interned strings. Every distinct string is stored once and referred to by its code, its position in the table.
+
+    def __init__(self):
+        self.__strings = []
+        self.__codes = dict()
+
+    def __len__(self):
+        return len(self.__strings)
+
+    def intern(self, text) -> int:
+        if text is None:
+            return NULL
+        code = self.__codes.get(text)
+        if code is None:
+            code = len(self.__strings)
+            self.__strings.append(text)
+            self.__codes[text] = code
+        return code
+
+    def code(self, text) -> int:
+        return self.__codes.get(text, NULL)
+
+    def text(self, code: int):
+        return self.__strings[code] if code != NULL else None
+
+
+class PackedStringTable:
+    # Read-only StringTable of a snapshot. The strings are packed in sorted order, string code is
+    # data[offsets[code]:offsets[code + 1]], so the code of a string is found by binary search.
+
+    def __init__(self, data, offsets):
+        self.__data = data
+        self.__offsets = offsets
+
+    def __len__(self):
+        return len(self.__offsets) - 1
+
+    def code(self, text) -> int:
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.text(middle) < text:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self) and self.text(low) == text else NULL
+
+    def text(self, code: int):
+        if code == NULL:
+            return None
+        return str(self.__data[self.__offsets[code]:self.__offsets[code + 1]], 'utf-8')
+
+
+class IdIndex:
+    # Row of each artist, album or genre id in a snapshot: the ids sorted ascending and the row of each.
+    # Answers get() like the dicts it replaces.
+
+    def __init__(self, sorted_ids, rows):
+        self.__sorted_ids = sorted_ids
+        self.__rows = rows
+
+    def get(self, key, default=None):
+        position = bisect_left(self.__sorted_ids, key)
+        if position < len(self.__sorted_ids) and self.__sorted_ids[position] == key:
+            return self.__rows[position]
+        return default
+
+
+class TextColumn:
+    # Strings that hardly ever repeat, such as urls, packed into one utf-8 buffer.
+    # Row i is data[offsets[i]:offsets[i + 1]]. Empty strings and None are both stored empty and read back as None.
+
+    def __init__(self, data=None, offsets: array = None):
+        self.data = data if data is not None else bytearray()
+        self.offsets = offsets if offsets is not None else array(ID_TYPE, [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return str(self.data[start:end], 'utf-8') if end > start else None
+
+    def append(self, text):
+        if text:
+            self.data += text.encode('utf-8')
+        self.offsets.append(len(self.data))
+
+
+class ListColumn:
+    # A list of integers per row, in compressed sparse row form: row i holds values[offsets[i]:offsets[i + 1]].
+
+    def __init__(self, offsets: array = None, values: array = None):
+        self.offsets = offsets if offsets is not None else array(ID_TYPE, [0])
+        self.values = values if values is not None else array(ROW_TYPE)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> array:
+        return self.values[self.offsets[row]:self.offsets[row + 1]]
+
+    def append(self, values):
+        self.values.extend(values)
+        self.offsets.append(len(self.values))
+
+    @staticmethod
+    def group(keys: array, num_keys: int, rows: array = None) -> 'ListColumn':
+        # Inverts a column: the rows holding each key, in row order. rows[i] is the row of keys[i], or i itself.
+        # A counting sort, so two passes over the column and no per-row objects.
+        counts = array(ID_TYPE, [0]) * (num_keys + 1)
+        for key in keys:
+            if key != NULL:
+                counts[key + 1] += 1
+        offsets = array(ID_TYPE, accumulate(counts))
+        values = array(ROW_TYPE, [0]) * offsets[-1]
+        positions = offsets[:-1]
+        for index, key in enumerate(keys):
+            if key != NULL:
+                values[positions[key]] = index if rows is None else rows[index]
+                positions[key] += 1
+        return ListColumn(offsets, values)
+
+
+class TrackRows(Sequence):
+    # The tracks of a listing or filter, as their rows. A Track is created when it is read, so counting or slicing
+    # the result creates none, and a rendered page only creates the tracks it shows.
+
+    def __init__(self, tracks, rows):
+        # tracks(rows) returns the list of Track objects of the given rows.
+        self.__tracks = tracks
+        self.__rows = rows
+
+    def __len__(self):
+        return len(self.__rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TrackRows(self.__tracks, self.__rows[index])
+        return self.__tracks([self.__rows[index]])[0]
+
+    def __iter__(self):
+        return iter(self.__tracks(self.__rows))
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f'TrackRows({len(self)} tracks)'
+
+
+class ColumnarRepository(AbstractRepository):
+    # Read-optimised catalogue held in columns instead of domain objects.
+    # Tracks, artists, albums and genres are rows of typed arrays. Titles and names are interned in StringTables,
+    # urls are packed in TextColumns and the genres of each track are a ListColumn. Rows are numbered in the order
+    # they were added; a sorted copy of the track ids gives pagination and lookups by id through binary search.
+    # Listing and filtering work on the arrays and on inverted indexes that are built from them on first use, and
+    # return the matching rows as TrackRows: Track, Artist, Album and Genre objects are only created for the rows
+    # that are read.
+    # Users and reviews are few and kept as objects, like in the MemoryRepository.
+    # The columns can be saved to a snapshot file and mapped back in by open_snapshot, read-only.
+
+    def __init__(self):
+        # Tracks
+        self.__track_ids = array(ID_TYPE)
+        self.__track_titles = array(ROW_TYPE)
+        self.__track_durations = array(ROW_TYPE)
+        self.__track_artists = array(ROW_TYPE)
+        self.__track_albums = array(ROW_TYPE)
+        self.__track_urls = TextColumn()
+        self.__track_genres = ListColumn()
+        # Track ids in ascending order and the row of each.
+        self.__sorted_ids = array(ID_TYPE)
+        self.__sorted_rows = array(ROW_TYPE)
+        # Artists
+        self.__artist_ids = array(ID_TYPE)
+        self.__artist_names = array(ROW_TYPE)
+        self.__artist_rows = dict()
+        # Albums
+        self.__album_ids = array(ID_TYPE)
+        self.__album_titles = array(ROW_TYPE)
+        self.__album_types = array(ROW_TYPE)
+        self.__album_years = array(ROW_TYPE)
+        self.__album_urls = TextColumn()
+        self.__album_rows = dict()
+        # Genres
+        self.__genre_ids = array(ID_TYPE)
+        self.__genre_names = array(ROW_TYPE)
+        self.__genre_rows = dict()
+        # Interned strings
+        self.__strings = {name: StringTable() for name in ('title', 'artist', 'album', 'album_type', 'genre')}
+        # Inverted indexes, sorted names and prefix indexes, built on first use and dropped when rows are added.
+        self.__indexes = dict()
+        # The mmap of the snapshot the columns are read from, if any, and its metadata.
+        self.__snapshot = None
+        self.__snapshot_metadata = None
+
+        self.__users = []
+        self.__users_index = dict()
+        self.__reviews = []
+        # Reviewing user of each review (by position), the pairing user_review.user_id stores in the database.
+        self.__review_users = []
+        # track_id -> positions of its reviews
+        self.__reviews_index = dict()
+        # Requests of a threaded server add reviews concurrently, a review's position is taken under the lock.
+        self.__reviews_lock = threading.Lock()
+
+    @classmethod
+    def open_snapshot(cls, path) -> 'ColumnarRepository':
+        # A repository over the columns of a snapshot written by save_snapshot. The catalogue can not be changed,
+        # users and reviews are kept in memory as usual.
+        snapshot, sections, metadata = read_snapshot(path)
+        repository = cls()
+        repository.__load_snapshot(snapshot, sections, metadata)
+        return repository
+
+    def __load_snapshot(self, snapshot, sections: dict, metadata: dict):
+        self.__snapshot = snapshot
+        self.__snapshot_metadata = metadata
+        self.__track_ids = sections['track_ids']
+        self.__track_titles = sections['track_titles']
+        self.__track_durations = sections['track_durations']
+        self.__track_artists = sections['track_artists']
+        self.__track_albums = sections['track_albums']
+        self.__track_urls = TextColumn(sections['track_urls.data'], sections['track_urls.offsets'])
+        self.__track_genres = ListColumn(sections['track_genres.offsets'], sections['track_genres.values'])
+        self.__sorted_ids = sections['sorted_ids']
+        self.__sorted_rows = sections['sorted_rows']
+        self.__artist_ids = sections['artist_ids']
+        self.__artist_names = sections['artist_names']
+        self.__artist_rows = IdIndex(sections['ids.artists.sorted_ids'], sections['ids.artists.rows'])
+        self.__album_ids = sections['album_ids']
+        self.__album_titles = sections['album_titles']
+        self.__album_types = sections['album_types']
+        self.__album_years = sections['album_years']
+        self.__album_urls = TextColumn(sections['album_urls.data'], sections['album_urls.offsets'])
+        self.__album_rows = IdIndex(sections['ids.albums.sorted_ids'], sections['ids.albums.rows'])
+        self.__genre_ids = sections['genre_ids']
+        self.__genre_names = sections['genre_names']
+        self.__genre_rows = IdIndex(sections['ids.genres.sorted_ids'], sections['ids.genres.rows'])
+        self.__strings = {field: PackedStringTable(sections[f'strings.{field}.data'],
+                                                   sections[f'strings.{field}.offsets'])
+                          for field in self.__strings}
+        self.__indexes = {name: ListColumn(sections[f'index.{name}.offsets'], sections[f'index.{name}.values'])
+                          for name in SNAPSHOT_INDEXES}
+
+    @property
+    def snapshot_metadata(self) -> dict:
+        return self.__snapshot_metadata
+
+    def save_snapshot(self, path, metadata: dict = None):
+        # Strings are written in sorted order, which renumbers their codes, so that a snapshot can look them up by
+        # binary search. The inverted indexes are written as well.
+        sections = {
+            'track_ids': self.__track_ids, 'track_durations': self.__track_durations,
+            'track_artists': self.__track_artists, 'track_albums': self.__track_albums,
+            'track_urls.data': self.__track_urls.data, 'track_urls.offsets': self.__track_urls.offsets,
+            'track_genres.offsets': self.__track_genres.offsets, 'track_genres.values': self.__track_genres.values,
+            'sorted_ids': self.__sorted_ids, 'sorted_rows': self.__sorted_rows,
+            'artist_ids': self.__artist_ids, 'album_ids': self.__album_ids, 'album_years': self.__album_years,
+            'album_urls.data': self.__album_urls.data, 'album_urls.offsets': self.__album_urls.offsets,
+            'genre_ids': self.__genre_ids,
+        }
+        renumbered_codes = dict()
+        for field, strings in self.__strings.items():
+            order = sorted(range(len(strings)), key=strings.text)
+            renumbered_codes[field] = array(ROW_TYPE, [0]) * len(order)
+            for code, previous_code in enumerate(order):
+                renumbered_codes[field][previous_code] = code
+            encoded = [strings.text(code).encode('utf-8') for code in order]
+            sections[f'strings.{field}.data'] = b''.join(encoded)
+            sections[f'strings.{field}.offsets'] = array(ID_TYPE, accumulate(map(len, encoded), initial=0))
+        for name, column, field in (('track_titles', self.__track_titles, 'title'),
+                                    ('artist_names', self.__artist_names, 'artist'),
+                                    ('album_titles', self.__album_titles, 'album'),
+                                    ('album_types', self.__album_types, 'album_type'),
+                                    ('genre_names', self.__genre_names, 'genre')):
+            codes = renumbered_codes[field]
+            sections[name] = array(ROW_TYPE, (codes[code] if code != NULL else NULL for code in column))
+
+        indexes = {
+            'tracks_by_title': ListColumn.group(sections['track_titles'], len(self.__strings['title'])),
+            'artists_by_name': ListColumn.group(sections['artist_names'], len(self.__strings['artist'])),
+            'albums_by_title': ListColumn.group(sections['album_titles'], len(self.__strings['album'])),
+            'genres_by_name': ListColumn.group(sections['genre_names'], len(self.__strings['genre'])),
+        }
+        for name in SNAPSHOT_INDEXES:
+            index = indexes[name] if name in indexes else self.__index(name)
+            sections[f'index.{name}.offsets'] = index.offsets
+            sections[f'index.{name}.values'] = index.values
+        for name, ids in (('artists', self.__artist_ids), ('albums', self.__album_ids), ('genres', self.__genre_ids)):
+            rows = sorted(range(len(ids)), key=ids.__getitem__)
+            sections[f'ids.{name}.sorted_ids'] = array(ID_TYPE, (ids[row] for row in rows))
+            sections[f'ids.{name}.rows'] = array(ROW_TYPE, rows)
+        write_snapshot(path, sections, metadata if metadata is not None else dict())
+
+    def __check_writable(self):
+        if self.__snapshot is not None:
+            raise RepositoryException('The catalogue of a snapshot can not be changed')
+
+    def populate_albums(self, album_rows):
+        self.__check_writable()
+        for item in album_rows:
+            if not item['album_id'].isdigit():
+                continue
+            year = item['album_year_released']
+            self.__add_album_row(int(item['album_id']), item['album_title'], item['album_url'], item['album_type'],
+                                 int(year) if year is not None and year.isdigit() else None)
+
+    def populate_tracks(self, track_rows, context: ImportContext = None):
+        # One import run, straight from the csv rows into the columns. Rows repeating a track id are skipped.
+        self.__check_writable()
+        if context is None:
+            context = ImportContext()
+        for item in track_rows:
+            track_id = int(item['track_id'])
+            if not context.first_seen('tracks', track_id) or self.__track_row(track_id) != NULL:
+                continue
+            artist_row = self.__add_artist_row(int(item['artist_id']), item['artist_name'])
+            album_row = NULL
+            if item['album_id'] is not None and item['album_id'].isdigit():
+                album_row = self.__album_rows.get(int(item['album_id']))
+                if album_row is None:
+                    album_row = self.__add_album_row(int(item['album_id']), item['album_title'])
+            genre_rows = [self.__add_genre_row(genre) for genre in extract_genres(item, context.genre_parser)]
+            self.__append_track(track_id, item['track_title'], round(float(item['track_duration'])),
+                                item['track_url'], artist_row, album_row, genre_rows)
+        self.__sort_track_ids()
+        self.__indexes = dict()
+
+    def __append_track(self, track_id, title, duration, url, artist_row, album_row, genre_rows) -> int:
+        self.__track_ids.append(track_id)
+        self.__track_titles.append(self.__strings['title'].intern(title.strip() if type(title) is str else None))
+        self.__track_durations.append(duration if duration is not None else NULL)
+        self.__track_artists.append(artist_row)
+        self.__track_albums.append(album_row)
+        self.__track_urls.append(url.strip() if type(url) is str else None)
+        self.__track_genres.append(dict.fromkeys(genre_rows))
+        return len(self.__track_ids) - 1
+
+    def __sort_track_ids(self):
+        rows = sorted(range(len(self.__track_ids)), key=self.__track_ids.__getitem__)
+        self.__sorted_rows = array(ROW_TYPE, rows)
+        self.__sorted_ids = array(ID_TYPE, (self.__track_ids[row] for row in rows))
+
+    def __track_row(self, track_id: int) -> int:
+        position = bisect_left(self.__sorted_ids, track_id)
+        if position < len(self.__sorted_ids) and self.__sorted_ids[position] == track_id:
+            return self.__sorted_rows[position]
+        return NULL
+
+    def __add_artist_row(self, artist_id: int, name) -> int:
+        row = self.__artist_rows.get(artist_id)
+        if row is None:
+            row = len(self.__artist_ids)
+            self.__artist_ids.append(artist_id)
+            self.__artist_names.append(self.__strings['artist'].intern(name.strip() if type(name) is str else None))
+            self.__artist_rows[artist_id] = row
+        return row
+
+    def __add_album_row(self, album_id: int, title, url=None, album_type=None, release_year=None) -> int:
+        row = self.__album_rows.get(album_id)
+        if row is None:
+            row = len(self.__album_ids)
+            self.__album_ids.append(album_id)
+            self.__album_titles.append(self.__strings['album'].intern(title.strip() if type(title) is str else None))
+            self.__album_types.append(
+                self.__strings['album_type'].intern(album_type.strip() if type(album_type) is str else None))
+            self.__album_years.append(release_year if release_year is not None else NULL)
+            self.__album_urls.append(url.strip() if type(url) is str else None)
+            self.__album_rows[album_id] = row
+        return row
+
+    def __add_genre_row(self, genre: Genre) -> int:
+        row = self.__genre_rows.get(genre.genre_id)
+        if row is None:
+            row = len(self.__genre_ids)
+            self.__genre_ids.append(genre.genre_id)
+            self.__genre_names.append(self.__strings['genre'].intern(genre.name))
+            self.__genre_rows[genre.genre_id] = row
+        return row
+
+    # Domain objects, created for the rows a caller asked for.
+
+    def __track(self, row: int) -> Track:
+        return self.__tracks((row,))[0]
+
+    def __tracks(self, rows) -> List[Track]:
+        # Tracks of the same artist, album or genre share one Artist, Album or Genre object.
+        titles = self.__strings['title']
+        artists, albums, genres = dict(), dict(), dict()
+        tracks = []
+        for row in rows:
+            track = Track(self.__track_ids[row], titles.text(self.__track_titles[row]))
+            track.track_url = self.__track_urls[row]
+            if self.__track_durations[row] != NULL:
+                track.track_duration = self.__track_durations[row]
+            artist_row = self.__track_artists[row]
+            if artist_row != NULL:
+                if artist_row not in artists:
+                    artists[artist_row] = self.__artist(artist_row)
+                track.artist = artists[artist_row]
+            album_row = self.__track_albums[row]
+            if album_row != NULL:
+                if album_row not in albums:
+                    albums[album_row] = self.__album(album_row)
+                track.album = albums[album_row]
+            for genre_row in self.__track_genres[row]:
+                if genre_row not in genres:
+                    genres[genre_row] = self.__genre(genre_row)
+                track.add_genre(genres[genre_row])
+            tracks.append(track)
+        return tracks
+
+    def __track_rows(self, rows) -> TrackRows:
+        return TrackRows(self.__tracks, rows)
+
+    def __artist(self, row: int) -> Artist:
+        return Artist(self.__artist_ids[row], self.__strings['artist'].text(self.__artist_names[row]))
+
+    def __album(self, row: int) -> Album:
+        album = Album(self.__album_ids[row], self.__strings['album'].text(self.__album_titles[row]))
+        album.album_url = self.__album_urls[row]
+        album.album_type = self.__strings['album_type'].text(self.__album_types[row])
+        if self.__album_years[row] != NULL:
+            album.release_year = self.__album_years[row]
+        return album
+
+    def __genre(self, row: int) -> Genre:
+        return Genre(self.__genre_ids[row], self.__strings['genre'].text(self.__genre_names[row]))
+
+    # Inverted indexes
+
+    def __index(self, name: str):
+        index = self.__indexes.get(name)
+        if index is None:
+            index = self.__indexes[name] = self.__build_index(name)
+        return index
+
+    def __build_index(self, name: str):
+        if name == 'tracks_by_title':
+            return ListColumn.group(self.__track_titles, len(self.__strings['title']))
+        if name == 'tracks_by_artist':
+            return ListColumn.group(self.__track_artists, len(self.__artist_ids))
+        if name == 'tracks_by_album':
+            return ListColumn.group(self.__track_albums, len(self.__album_ids))
+        if name == 'tracks_by_genre':
+            track_genres = self.__track_genres
+            owners = array(ROW_TYPE)
+            for row in range(len(track_genres)):
+                owners.extend(array(ROW_TYPE, [row]) * (track_genres.offsets[row + 1] - track_genres.offsets[row]))
+            return ListColumn.group(track_genres.values, len(self.__genre_ids), owners)
+        if name == 'artists_by_name':
+            return ListColumn.group(self.__artist_names, len(self.__strings['artist']))
+        if name == 'albums_by_title':
+            return ListColumn.group(self.__album_titles, len(self.__strings['album']))
+        if name == 'genres_by_name':
+            return ListColumn.group(self.__genre_names, len(self.__strings['genre']))
+        if name == 'search_words':
+            return self.__build_search_index()
+        raise KeyError(name)
+
+    def __tracks_with_string(self, field: str, code: int) -> array:
+        # Rows of the tracks, in row order, whose title, artist name, album title or genre name (field 'title',
+        # 'artist', 'album' or 'genre') is the string with the given code.
+        if field == 'title':
+            return self.__index('tracks_by_title')[code]
+        owners, tracks = OWNER_INDEXES[field]
+        owner_rows = self.__index(owners)[code]
+        if len(owner_rows) == 1:
+            return self.__index(tracks)[owner_rows[0]]
+        rows = array(ROW_TYPE)
+        for owner_row in owner_rows:
+            rows.extend(self.__index(tracks)[owner_row])
+        return array(ROW_TYPE, sorted(rows))
+
+    def __tracks_by_name(self, field: str, name) -> array:
+        code = self.__strings[field].code(name)
+        return self.__tracks_with_string(field, code) if code != NULL else array(ROW_TYPE)
+
+    def __names_with_tracks(self, field: str) -> List[str]:
+        key = 'names:' + field
+        if key not in self.__indexes:
+            strings = self.__strings[field]
+            self.__indexes[key] = sorted(strings.text(code) for code in range(len(strings))
+                                         if len(self.__tracks_with_string(field, code)) > 0)
+        return self.__indexes[key]
+
+    def __build_search_index(self):
+        # Words of the distinct titles, artist names and album titles: word -> {field: string codes}.
+        # The index grows with the number of distinct strings, not with the number of tracks.
+        words = dict()
+        for field in ('title', 'artist', 'album'):
+            strings = self.__strings[field]
+            for code in range(len(strings)):
+                for word in set(search_terms(strings.text(code))):
+                    words.setdefault(word, dict()).setdefault(field, array(ROW_TYPE)).append(code)
+        return words, sorted(words)
+
+    # Users
+
+    def add_user(self, user: User):
+        if user.user_name in self.__users_index:
+            raise RepositoryException(f'User name {user.user_name} is already taken')
+        user._User__user_id = len(self.__users) + 1
+        self.__users.append(user)
+        self.__users_index[user.user_name] = user
+
+    def get_user(self, user_name) -> User:
+        return self.__users_index.get(user_name)
+
+    def get_number_of_users(self):
+        return len(self.__users)
+
+    def get_num_users(self) -> int:
+        return len(self.__users)
+
+    # Catalogue
+
+    def add_track(self, track: Track):
+        self.__check_writable()
+        if self.__track_row(track.track_id) != NULL:
+            return
+        artist_row = NULL
+        if track.artist is not None:
+            artist_row = self.__add_artist_row(track.artist.artist_id, track.artist.full_name)
+        album_row = NULL
+        if track.album is not None:
+            album = track.album
+            album_row = self.__add_album_row(album.album_id, album.title, album.album_url, album.album_type,
+                                             album.release_year)
+        genre_rows = [self.__add_genre_row(genre) for genre in track.genres]
+        row = self.__append_track(track.track_id, track.title, track.track_duration, track.track_url, artist_row,
+                                  album_row, genre_rows)
+        position = bisect(self.__sorted_ids, track.track_id)
+        self.__sorted_ids.insert(position, track.track_id)
+        self.__sorted_rows.insert(position, row)
+        self.__indexes = dict()
+
+    def add_genre(self, genre: Genre):
+        self.__check_writable()
+        self.__add_genre_row(genre)
+        self.__indexes = dict()
+
+    def add_artist(self, artist: Artist):
+        self.__check_writable()
+        self.__add_artist_row(artist.artist_id, artist.full_name)
+        self.__indexes = dict()
+
+    def add_album(self, album: Album):
+        self.__check_writable()
+        self.__add_album_row(album.album_id, album.title, album.album_url, album.album_type, album.release_year)
+        self.__indexes = dict()
+
+    def get_track_by_id(self, id: int) -> Track:
+        row = self.__track_row(id)
+        return self.__track(row) if row != NULL else None
+
+    def get_track_ids(self) -> List[int]:
+        # The sorted id column itself, a read-only sequence of ints.
+        return self.__sorted_ids
+
+    def get_random_track(self) -> Track:
+        if len(self.__track_ids) == 0:
+            return None
+        return self.__track(random.randrange(len(self.__track_ids)))
+
+    def get_tracks_page(self, after_id: int, limit: int) -> List[Track]:
+        start = bisect(self.__sorted_ids, after_id)
+        return self.__tracks(self.__sorted_rows[start:start + limit])
+
+    def get_num_tracks(self) -> int:
+        return len(self.__track_ids)
+
+    # Listings and filters return TrackRows, which create the tracks as they are read.
+
+    def get_track_list(self) -> List[Track]:
+        return self.__track_rows(range(len(self.__track_ids)))
+
+    def get_tracks_by_artist(self, artist_name: str) -> List[Track]:
+        return self.__track_rows(self.__tracks_by_name('artist', artist_name))
+
+    def get_tracks_by_title(self, track_title: str) -> List[Track]:
+        return self.__track_rows(self.__tracks_by_name('title', normalise_title(track_title)))
+
+    def get_tracks_by_genre(self, genre_name: str) -> List[Track]:
+        return self.__track_rows(self.__tracks_by_name('genre', genre_name))
+
+    def get_artist_names(self) -> List[str]:
+        return self.__names_with_tracks('artist')
+
+    def get_track_titles(self) -> List[str]:
+        return self.__names_with_tracks('title')
+
+    def get_genre_names(self) -> List[str]:
+        return self.__names_with_tracks('genre')
+
+    def search_tracks(self, query: str, limit: int = 10, offset: int = 0) -> List[Track]:
+        # Ranked like MemoryRepository.search_tracks: per term, the best sum of the field weights of a matching word.
+        terms = search_terms(query)
+        if len(terms) == 0:
+            return []
+        words, sorted_words = self.__index('search_words')
+        scores = None
+        for term in terms:
+            term_scores = dict()
+            index = bisect_left(sorted_words, term)
+            while index < len(sorted_words) and sorted_words[index].startswith(term):
+                word_scores = dict()
+                for field, codes in words[sorted_words[index]].items():
+                    for code in codes:
+                        for row in self.__tracks_with_string(field, code):
+                            word_scores[row] = word_scores.get(row, 0) + SEARCH_FIELD_WEIGHTS[field]
+                for row, weight in word_scores.items():
+                    term_scores[row] = max(term_scores.get(row, 0), weight)
+                index += 1
+            # Every term has to match.
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {row: scores[row] + weight for row, weight in term_scores.items() if row in scores}
+        ranked = sorted(scores, key=lambda row: (-scores[row], self.__track_ids[row]))
+        return self.__tracks(ranked[offset:offset + limit])
+
+    def get_suggestions(self, field: str, prefix: str, limit: int = 10) -> List[str]:
+        key = 'prefix:' + field
+        if key not in self.__indexes:
+            self.__indexes[key] = PrefixIndex(self.__names_with_tracks(field))
+        return self.__indexes[key].search(prefix, limit)
+
+    def get_artist_list(self) -> List[Artist]:
+        return [self.__artist(row) for row in range(len(self.__artist_ids))]
+
+    def get_album_list(self) -> List[Album]:
+        return [self.__album(row) for row in range(len(self.__album_ids))]
+
+    def get_album_by_id(self, id: int) -> Album:
+        row = self.__album_rows.get(int(id)) if str(id).isdigit() else None
+        return self.__album(row) if row is not None else None
+
+    def get_artist_by_id(self, id: int) -> Artist:
+        row = self.__artist_rows.get(int(id)) if str(id).isdigit() else None
+        return self.__artist(row) if row is not None else None
+
+    def count_tracks_by_genre(self) -> dict:
+        # genre name -> number of tracks, read off the lengths of the inverted genre index.
+        offsets = self.__index('tracks_by_genre').offsets
+        return {self.__strings['genre'].text(self.__genre_names[row]): offsets[row + 1] - offsets[row]
+                for row in range(len(self.__genre_ids))}
+
+    # Reviews
+
+    def add_review(self, review: Review, user: User = None):
+        with self.__reviews_lock:
+            self.__reviews_index.setdefault(review.track.track_id, []).append(len(self.__reviews))
+            self.__reviews.append(review)
+            self.__review_users.append(user)
+
+    def add_user_to_review(self, user: User):
+        with self.__reviews_lock:
+            if self.__review_users:
+                self.__review_users[-1] = user
+
+    def get_review_list(self) -> List[Review]:
+        return self.__reviews
+
+    def get_review_by_track(self, track_id: int) -> List[Review]:
+        return [self.__reviews[position] for position in self.__reviews_index.get(track_id, [])]
+
+    def get_user_by_track(self, track_id: int) -> List[User]:
+        users = [self.__review_users[position] for position in self.__reviews_index.get(track_id, [])]
+        return [user for user in users if user is not None]
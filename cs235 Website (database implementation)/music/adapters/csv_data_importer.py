@@ -1,84 +1,249 @@
 import csv
+import hashlib
+import os
+import threading
+from itertools import chain
 from pathlib import Path
 from datetime import date, datetime
 from typing import List
 import math
 import json
+import time
 
 from bisect import bisect, bisect_left, insort_left
 
 from werkzeug.security import generate_password_hash
 
-from music.adapters.csvdatareader import TrackCSVReader, create_track_object, create_artist_object, create_album_object, extract_genres
-from music.adapters.repository import AbstractRepository
+from music.adapters.csvdatareader import TrackCSVReader, ImportContext, create_track_object, create_album_object, extract_genres
+from music.adapters.repository import AbstractRepository, RepositoryException
+from music.adapters.columnar_repository import ColumnarRepository
+from music.adapters.catalogue_snapshot import update_snapshot_metadata
 from music.domainmodel.user import User
 
-list_of_keys_album = []
-list_of_keys_artist = []
-list_of_keys_track = []
-list_of_genre_keys = []
-genre_list = []
+# Number of tracks written per multi-row insert when bulk loading.
+BULK_BATCH_SIZE = 1000
 
+# Name of the thread reloading the catalogue in the background, gunicorn waits for it before forking workers.
+RELOAD_THREAD_NAME = 'catalogue-reload'
 
-def create_objects(tracks, albums, repo: AbstractRepository):
+
+
+def create_objects(tracks, albums, repo: AbstractRepository, context: ImportContext = None):
     length_of_albums_list = len(albums)
     length_of_tracks_list = len(tracks)
     index = 0
+    # Per import run, so calling create_objects again starts from an empty set of seen ids.
+    if context is None:
+        context = ImportContext()
     create_admin(repo)
     while index < max(length_of_tracks_list, length_of_albums_list):
         if index < length_of_tracks_list:
             track_item = tracks[index]
-            artist = create_artist_object(track_item)
-            populate_artists(artist, repo)
+            artist = context.artist(track_item)
+            populate_artists(artist, repo, context)
 
         if index < length_of_albums_list:
             album_item = albums[index]
             album = create_album_object(album_item)
-            populate_albums(album, repo)
+            populate_albums(album, repo, context)
 
         if index < length_of_tracks_list:
             track = create_track_object(track_item)
-            if artist is not None:
-                current_artist = artist
             track_album_id = tracks[index]['album_id']
             track_album = repo.get_album_by_id(track_album_id)
-            genre = extract_genres(track_item)
-            populate_tracks(track, track_album, current_artist, genre, repo)
+            genre = extract_genres(track_item, context.genre_parser)
+            populate_genre(genre, repo, context)
+            populate_tracks(track, track_album, artist, genre, repo, context)
         index += 1
 
-def populate_tracks(track, album, artist, genre_list, repo: AbstractRepository):
+def create_objects_bulk(tracks, albums, repo: AbstractRepository, batch_size=BULK_BATCH_SIZE, import_metadata=None):
+    # Same data as create_objects, but written with batched multi-row inserts inside one transaction.
+    create_admin(repo)
+    start = time.perf_counter()
+    rows_inserted = repo.bulk_load(generate_import_rows(tracks, albums, batch_size, import_metadata))
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"Bulk loaded {rows_inserted} rows in {elapsed:.2f}s ({rows_inserted / elapsed:.0f} rows/s)")
+    return rows_inserted
+
+
+def reload_catalogue(tracks, albums, repo: AbstractRepository, batch_size=BULK_BATCH_SIZE, import_metadata=None,
+                     incremental=True):
+    # Brings the artists, albums, tracks and genres of an existing database in line with the csv files in one
+    # transaction, users and their reviews are kept. Incrementally only new, changed and removed rows are written,
+    # otherwise the catalogue tables are replaced.
+    start = time.perf_counter()
+    rows = generate_import_rows(tracks, albums, batch_size, import_metadata)
+    if incremental:
+        changes = repo.sync_catalogue(rows)
+        rows_written = sum(sum(counts.values()) for counts in changes.values())
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        print(f"Synced {rows_written} changed rows in {elapsed:.2f}s: " +
+              ', '.join(f"{table} +{counts['inserted']} ~{counts['updated']} -{counts['deleted']}"
+                        for table, counts in changes.items()))
+        return rows_written
+    rows_inserted = repo.bulk_load(rows, replace=True)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"Reloaded {rows_inserted} rows in {elapsed:.2f}s ({rows_inserted / elapsed:.0f} rows/s)")
+    return rows_inserted
+
+
+def reload_catalogue_in_background(tracks, albums, repo: AbstractRepository, import_metadata=None, incremental=True):
+    # The app keeps serving the previous catalogue until the reload commits.
+    def reload():
+        try:
+            reload_catalogue(tracks, albums, repo, import_metadata=import_metadata, incremental=incremental)
+        finally:
+            repo.close_session()
+
+    thread = threading.Thread(target=reload, name=RELOAD_THREAD_NAME, daemon=True)
+    thread.start()
+    return thread
+
+
+def csv_import_metadata(*paths) -> dict:
+    # Identifies the csv files an import is read from: their sizes and modification times, which are cheap to
+    # check on every start, and a hash of their contents for when only the modification times changed.
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as csv_file:
+            for chunk in iter(lambda: csv_file.read(1 << 20), b''):
+                digest.update(chunk)
+    return {'csv_stat': csv_stat_signature(*paths), 'csv_sha256': digest.hexdigest()}
+
+
+def csv_stat_signature(*paths) -> str:
+    return ';'.join(f"{os.stat(path).st_size}:{os.stat(path).st_mtime_ns}" for path in paths)
+
+
+def stale_import_metadata(repo: AbstractRepository, *paths):
+    # Returns None if the database was imported from the csv files as they are now, otherwise the import metadata
+    # to store once they have been imported.
+    stored = repo.get_import_metadata()
+    if stored.get('csv_stat') == csv_stat_signature(*paths):
+        return None
+    import_metadata = csv_import_metadata(*paths)
+    if stored.get('csv_sha256') == import_metadata['csv_sha256']:
+        # Same contents, e.g. the files were copied. Remember the new modification times.
+        repo.set_import_metadata({'csv_stat': import_metadata['csv_stat']})
+        return None
+    return import_metadata
+
+
+def build_catalogue_snapshot(albums_path, tracks_path, snapshot_path):
+    # Imports the csv files into a ColumnarRepository and saves its columns, with the import metadata of the files,
+    # as a snapshot that can be mapped in by every process serving the catalogue.
+    start = time.perf_counter()
+    reader = TrackCSVReader(albums_path, tracks_path)
+    columnar = ColumnarRepository()
+    columnar.populate_albums(reader.iter_albums_file())
+    columnar.populate_tracks(reader.iter_tracks_file())
+    columnar.save_snapshot(snapshot_path, csv_import_metadata(albums_path, tracks_path))
+    print(f"Wrote a snapshot of {columnar.get_num_tracks()} tracks to {snapshot_path} in "
+          f"{time.perf_counter() - start:.2f}s")
+
+
+def open_catalogue_snapshot(snapshot_path, albums_path, tracks_path) -> ColumnarRepository:
+    # Maps in the snapshot at snapshot_path, which is written first if it is missing, was written by another
+    # snapshot version or was not imported from the csv files as they are now.
+    try:
+        repository = ColumnarRepository.open_snapshot(snapshot_path)
+    except (FileNotFoundError, RepositoryException):
+        repository = None
+    if repository is not None:
+        stored = repository.snapshot_metadata
+        if stored.get('csv_stat') == csv_stat_signature(albums_path, tracks_path):
+            return repository
+        import_metadata = csv_import_metadata(albums_path, tracks_path)
+        if stored.get('csv_sha256') == import_metadata['csv_sha256']:
+            # Same contents with other modification times, the snapshot is still current. The new modification
+            # times are stored, so the next start does not hash the files again.
+            update_snapshot_metadata(snapshot_path, {'csv_stat': import_metadata['csv_stat']})
+            return repository
+    build_catalogue_snapshot(albums_path, tracks_path, snapshot_path)
+    return ColumnarRepository.open_snapshot(snapshot_path)
+
+
+def generate_import_rows(tracks, albums, batch_size=BULK_BATCH_SIZE, import_metadata=None):
+    rows = generate_catalogue_rows(tracks, albums, batch_size)
+    if import_metadata:
+        rows = chain(rows, [{'import_metadata': [{'name': name, 'value': value}
+                                                 for name, value in import_metadata.items()]}])
+    return rows
+
+
+def generate_catalogue_rows(tracks, albums, batch_size=BULK_BATCH_SIZE, context: ImportContext = None):
+    # Yields dictionaries of table name -> list of rows, ready to be passed to SqlAlchemyRepository.bulk_load.
+    if context is None:
+        context = ImportContext()
+    album_rows = []
+    for album_item in albums:
+        if not album_item['album_id'].isdigit():
+            continue
+        album = create_album_object(album_item)
+        if context.first_seen('albums', album.album_id):
+            album_rows.append({'id': album.album_id, 'title': album.title,
+                               'year': album.release_year, 'url': album.album_url})
+    yield {'albums': album_rows}
+
+    batch = new_catalogue_batch()
+    for track_item in tracks:
+        track = create_track_object(track_item)
+        if not context.first_seen('tracks', track.track_id):
+            continue
+
+        artist_id = int(track_item['artist_id'])
+        if context.first_seen('artists', artist_id):
+            batch['artists'].append({'id': artist_id, 'name': track_item['artist_name'].strip()})
+
+        album_id = int(track_item['album_id']) if track_item['album_id'].isdigit() else None
+        batch['tracks'].append({'id': track.track_id, 'title': track.title, 'artist_id': artist_id,
+                                'album_id': album_id if context.seen('albums', album_id) else None,
+                                'duration': track.track_duration, 'url': track.track_url})
+
+        for genre in extract_genres(track_item, context.genre_parser):
+            track.add_genre(genre)
+        for genre in track.genres:
+            if context.first_seen('genres', genre.genre_id):
+                batch['genres'].append({'genre_id': genre.genre_id, 'name': genre.name})
+            batch['track_genres'].append({'genre_id': genre.genre_id, 'track_id': track.track_id})
+
+        if len(batch['tracks']) >= batch_size:
+            yield batch
+            batch = new_catalogue_batch()
+    yield batch
+
+
+def new_catalogue_batch():
+    return {'artists': [], 'genres': [], 'tracks': [], 'track_genres': []}
+
+
+def populate_tracks(track, album, artist, genre_list, repo: AbstractRepository, context: ImportContext):
     # Create Track objects
-    global list_of_keys_track
     track.album = album
     track.artist = artist
     for genre in genre_list:
         track.add_genre(genre)
-    if track.track_id not in list_of_keys_track:
+    if context.first_seen('tracks', track.track_id):
         repo.add_track(track)
-        list_of_keys_track.append(track.track_id)
 
 
-def populate_genre(genre, repo: AbstractRepository):
-    global list_of_genre_keys
-    repo.add_genre(i)
-    for i in genre:
-        if i.genre_id not in list_of_genre_keys:
-            repo.add_genre(i)
-            list_of_genre_keys.append(i.genre_id)
+def populate_genre(genre_list, repo: AbstractRepository, context: ImportContext):
+    # Stores the genres of a track that were not stored earlier in the run, before the track refers to them.
+    for genre in genre_list:
+        if context.first_seen('genres', genre.genre_id):
+            repo.add_genre(genre)
 
 
 
-def populate_albums(album, repo: AbstractRepository):
+def populate_albums(album, repo: AbstractRepository, context: ImportContext):
     # Create Album object.
-    global list_of_keys_album
-    if album.album_id not in list_of_keys_album:
+    if context.first_seen('albums', album.album_id):
         repo.add_album(album)
-        list_of_keys_album.append(album.album_id)
 
 
-def populate_artists(artist, repo: AbstractRepository):
+def populate_artists(artist, repo: AbstractRepository, context: ImportContext):
     # Create Artist object.
-    if artist is not None:
+    if artist is not None and context.first_seen('artists', artist.artist_id):
         repo.add_artist(artist)
 
 
@@ -1,14 +1,28 @@
 import os
 import csv
 import ast
+import io
 import json
+import mmap
+import re
+from concurrent.futures import ProcessPoolExecutor
 
 from music.domainmodel.artist import Artist
 from music.domainmodel.album import Album
 from music.domainmodel.track import Track
 from music.domainmodel.genre import Genre
 
-list_of_artist_ids = []
+# Columns of the FMA csv files that are actually used by the domain model.
+TRACK_COLUMNS = ('track_id', 'track_title', 'artist_id', 'artist_name', 'album_id', 'album_title',
+                 'track_duration', 'track_url', 'track_genres')
+ALBUM_COLUMNS = ('album_id', 'album_title', 'album_url', 'album_type', 'album_year_released')
+
+# Matches one genre dictionary of a track_genres cell, e.g. {'genre_id': '21', 'genre_title': 'Hip-Hop', ...}.
+# Titles containing an apostrophe are written with double quotes, so both quoting styles are accepted.
+GENRE_PATTERN = re.compile(
+    r"""'genre_id':\s*'(\d+)',\s*'genre_title':\s*('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+# Byte ranges parsed per worker process when reading in parallel. More ranges than workers even out their load.
+RANGES_PER_WORKER = 4
 
 def create_track_object(track_row):
     track = Track(int(track_row['track_id']), track_row['track_title'])
@@ -21,12 +35,9 @@ def create_track_object(track_row):
 
 
 def create_artist_object(track_row):
-    global list_of_artist_ids
-    if int(track_row['artist_id']) not in list_of_artist_ids:
-        artist_id = int(track_row['artist_id'])
-        artist = Artist(artist_id, track_row['artist_name'])
-        list_of_artist_ids.append(int(track_row['artist_id']))
-        return artist
+    artist_id = int(track_row['artist_id'])
+    artist = Artist(artist_id, track_row['artist_name'])
+    return artist
 
 
 def create_album_object(row):
@@ -41,25 +52,166 @@ def create_album_object(row):
     return album
 
 
-def extract_genres(track_row: dict):
-    # List of dictionaries inside the string.
-    track_genres_raw = track_row['track_genres']
+def extract_genres(track_row: dict, genre_parser=None):
     # Populate genres. track_genres can be empty (None)
-    genres = []
-    if track_genres_raw:
-        try:
-            genre_dicts = ast.literal_eval(
-                track_genres_raw) if track_genres_raw != "" else []
+    if genre_parser is None:
+        genre_parser = GenreParser()
+    return list(genre_parser.parse(track_row['track_genres']))
+
+
+def split_genres(track_genres_raw: str) -> list:
+    # The (genre_id, genre_title) pairs of a track_genres cell.
+    matches = GENRE_PATTERN.findall(track_genres_raw)
+    if matches:
+        # Titles only need a full literal evaluation when they contain escape sequences.
+        return [(genre_id, ast.literal_eval(title) if '\\' in title else title[1:-1])
+                for genre_id, title in matches]
+    if track_genres_raw.strip() in ('', '[]'):
+        return []
+    # Anything unusual falls back to evaluating the whole cell.
+    try:
+        return [(genre_dict['genre_id'], genre_dict['genre_title'])
+                for genre_dict in ast.literal_eval(track_genres_raw)]
+    except Exception as e:
+        print(track_genres_raw)
+        print(f'Exception occurred while parsing genres: {e}')
+        return []
+
+
+def csv_record_ranges(csv_file: str, num_ranges: int):
+    # Splits the rows of a csv file into about num_ranges byte ranges, each starting and ending on a record
+    # boundary. A newline only ends a record if the quotes before it are balanced, so quoted newlines are kept
+    # inside their record. The file is mapped and its quotes counted with bytes.count, so the scan runs at C speed.
+    # Returns the header row and the list of (start, end) ranges.
+    with open(csv_file, 'rb') as data_csv:
+        size = os.fstat(data_csv.fileno()).st_size
+        if size == 0:
+            return [], []
+        with mmap.mmap(data_csv.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header_end = next_record_start(data, 0, 0, size)
+            header = next(csv.reader(io.StringIO(data[:header_end].decode('unicode_escape'), newline=None)), [])
+            ranges = []
+            start = header_end
+            for index in range(1, num_ranges + 1):
+                end = size
+                if index < num_ranges:
+                    target = max(start, header_end + (size - header_end) * index // num_ranges)
+                    end = next_record_start(data, start, target, size)
+                if end > start:
+                    ranges.append((start, end))
+                    start = end
+    return header, ranges
+
+
+def next_record_start(data, record_start: int, position: int, size: int) -> int:
+    # Offset just past the first newline at or after position that ends a record. record_start is a record boundary
+    # before position, so the quotes are balanced there.
+    quotes = data[record_start:position].count(b'"')
+    while position < size:
+        newline = data.find(b'\n', position)
+        if newline == -1:
+            return size
+        quotes += data[position:newline].count(b'"')
+        if quotes % 2 == 0:
+            return newline + 1
+        position = newline + 1
+    return size
+
+
+def parse_track_range(csv_file: str, header: list, start: int, end: int) -> list:
+    # Runs in a worker process. Parses the track rows in the byte range into (row, genre pairs) tuples, the rows
+    # like those of TrackCSVReader.iter_tracks_file and the pairs those of split_genres for its track_genres cell.
+    with open(csv_file, 'rb') as data_csv:
+        data_csv.seek(start)
+        text = data_csv.read(end - start).decode('unicode_escape')
+    positions = [(column, header.index(column)) for column in TRACK_COLUMNS if column in header]
+    cells = dict()
+    parsed = []
+    for row in csv.reader(io.StringIO(text, newline=None)):
+        track_row = {column: row[position] if position < len(row) else None for column, position in positions}
+        track_genres_raw = track_row.get('track_genres')
+        split = None
+        if track_genres_raw:
+            split = cells.get(track_genres_raw)
+            if split is None:
+                split = cells[track_genres_raw] = split_genres(track_genres_raw)
+        parsed.append((track_row, split))
+    return parsed
+
+
+class GenreParser:
+    # Parses track_genres cells into Genre objects.
+    # Identical cells are only parsed once, and every Genre id maps to a single shared Genre object.
+
+    def __init__(self):
+        # raw track_genres string -> tuple of Genre
+        self.__cells = dict()
+        # genre_id -> Genre
+        self.__genres = dict()
+
+    @property
+    def genres(self) -> list:
+        return list(self.__genres.values())
+
+    def parse(self, track_genres_raw, split: list = None) -> tuple:
+        # split is the result of split_genres for the cell, if that was already computed, e.g. by a worker process.
+        if not track_genres_raw:
+            return ()
+        genres = self.__cells.get(track_genres_raw)
+        if genres is None:
+            if split is None:
+                split = split_genres(track_genres_raw)
+            genres = tuple(self.__intern(genre_id, title) for genre_id, title in split)
+            self.__cells[track_genres_raw] = genres
+        return genres
+
+    def __intern(self, genre_id, title) -> Genre:
+        genre_id = int(genre_id)
+        genre = self.__genres.get(genre_id)
+        if genre is None:
+            genre = Genre(genre_id, title)
+            self.__genres[genre_id] = genre
+        return genre
+
+
+class ImportContext:
+    # State of one import run, created per run so nothing carries over into the next one.
+    # The ids already written are kept per kind ('albums', 'artists', 'tracks', 'genres') in sets, so checking
+    # for a duplicate is O(1) and an import is linear in the number of rows. Every artist id maps to a single
+    # Artist object, and every genre id to a single Genre object through the shared GenreParser.
+
+    def __init__(self):
+        # kind -> set of ids
+        self.__seen = dict()
+        # artist_id -> Artist
+        self.__artists = dict()
+        self.__genre_parser = GenreParser()
+
+    @property
+    def genre_parser(self) -> GenreParser:
+        return self.__genre_parser
+
+    def first_seen(self, kind: str, key) -> bool:
+        # True the first time key is seen for kind, False for every later duplicate.
+        seen = self.__seen.setdefault(kind, set())
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
 
-            for genre_dict in genre_dicts:
-                genre = Genre(
-                    int(genre_dict['genre_id']), genre_dict['genre_title'])
-                genres.append(genre)
-        except Exception as e:
-            print(track_genres_raw)
-            print(f'Exception occurred while parsing genres: {e}')
+    def seen(self, kind: str, key) -> bool:
+        return key in self.__seen.get(kind, ())
 
-    return genres
+    def count(self, kind: str) -> int:
+        return len(self.__seen.get(kind, ()))
+
+    def artist(self, track_row) -> Artist:
+        artist_id = int(track_row['artist_id'])
+        artist = self.__artists.get(artist_id)
+        if artist is None:
+            artist = create_artist_object(track_row)
+            self.__artists[artist_id] = artist
+        return artist
 
 
 class TrackCSVReader:
@@ -84,6 +236,8 @@ class TrackCSVReader:
         # Set of unique genres
         self.__dataset_of_genres = set()
 
+        self.__import_context = ImportContext()
+
     @property
     def dataset_of_tracks(self) -> list:
         return self.__dataset_of_tracks
@@ -101,22 +255,16 @@ class TrackCSVReader:
         return self.__dataset_of_genres
 
     def read_albums_file_as_dict(self) -> dict:
-        if not os.path.exists(self.__albums_csv_file):
-            print(f"path {self.__albums_csv_file} does not exist!")
-
         album_dict = dict()
-        # encoding of unicode_escape is required to decode successfully
-        with open(self.__albums_csv_file, encoding="unicode_escape") as album_csv:
-            reader = csv.DictReader(album_csv)
-            for row in reader:
-                album_id = int(
-                    row['album_id']) if row['album_id'].isdigit() else row['album_id']
-                if type(album_id) is not int:
-                    print(f'Invalid album_id: {album_id}')
-                    print(row)
-                    continue
-                album = create_album_object(row)
-                album_dict[album_id] = album
+        for row in self.iter_albums_file():
+            album_id = int(
+                row['album_id']) if row['album_id'].isdigit() else row['album_id']
+            if type(album_id) is not int:
+                print(f'Invalid album_id: {album_id}')
+                print(row)
+                continue
+            album = create_album_object(row)
+            album_dict[album_id] = album
 
         return album_dict
 
@@ -144,22 +292,61 @@ class TrackCSVReader:
                 album_rows.append(album_row)
         return album_rows
 
-    def read_csv_files(self):
+    def iter_tracks_file(self):
+        # Streams the track rows one at a time, keeping only the TRACK_COLUMNS of each row.
+        return self.__iter_csv_file(self.__tracks_csv_file, TRACK_COLUMNS)
+
+    def iter_albums_file(self):
+        # Streams the album rows one at a time, keeping only the ALBUM_COLUMNS of each row.
+        return self.__iter_csv_file(self.__albums_csv_file, ALBUM_COLUMNS)
+
+    @staticmethod
+    def __iter_csv_file(csv_file: str, columns: tuple):
+        if not os.path.exists(csv_file):
+            print(f"path {csv_file} does not exist!")
+            return
+        # encoding of unicode_escape is required to decode successfully
+        with open(csv_file, encoding='unicode_escape') as data_csv:
+            reader = csv.reader(data_csv)
+            header = next(reader, [])
+            positions = [(column, header.index(column)) for column in columns if column in header]
+            for row in reader:
+                yield {column: row[position] if position < len(row) else None for column, position in positions}
+
+    def iter_parsed_tracks_file(self, workers: int):
+        # Like iter_tracks_file, but the rows are parsed by a pool of worker processes, each given byte ranges of
+        # whole records, and come with the split_genres pairs of their track_genres cell. The rows are yielded in
+        # file order, so everything built from them is the same as when they are read by one process.
+        if not os.path.exists(self.__tracks_csv_file):
+            print(f"path {self.__tracks_csv_file} does not exist!")
+            return
+        header, ranges = csv_record_ranges(self.__tracks_csv_file, workers * RANGES_PER_WORKER)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(parse_track_range, self.__tracks_csv_file, header, start, end)
+                       for start, end in ranges]
+            for future in futures:
+                yield from future.result()
+
+    def read_csv_files(self, workers: int = 1):
+        # workers > 1 parses the tracks file in that many processes, see iter_parsed_tracks_file.
         # key is album_id
         albums_dict: dict = self.read_albums_file_as_dict()
-        # list of track csv rows, not track objects
-        track_rows: list = self.read_tracks_file()
+        # track csv rows, not track objects, with the genre pairs of each row if they were split by a worker.
+        if workers > 1:
+            track_rows = self.iter_parsed_tracks_file(workers)
+        else:
+            track_rows = ((track_row, None) for track_row in self.iter_tracks_file())
 
         # Make sure re-initialize to empty list, so that calling this function multiple times does not create
         # duplicated dataset.
         self.__dataset_of_tracks = []
-        for track_row in track_rows:
+        for track_row, genre_split in track_rows:
             track = create_track_object(track_row)
-            artist = create_artist_object(track_row)
+            artist = self.__import_context.artist(track_row)
             track.artist = artist
 
             # Extract track_genres attributes and assign genres to the track.
-            track_genres = extract_genres(track_row)
+            track_genres = list(self.__import_context.genre_parser.parse(track_row['track_genres'], genre_split))
             for genre in track_genres:
                 track.add_genre(genre)
 
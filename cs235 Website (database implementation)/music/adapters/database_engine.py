@@ -0,0 +1,51 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool
+
+# How connections are reused between sessions:
+# 'null' opens and closes a connection per session, 'queue' keeps a shared pool of connections and
+# 'singleton' keeps one connection per thread.
+POOL_CLASSES = {
+    'null': NullPool,
+    'queue': QueuePool,
+    'singleton': SingletonThreadPool
+}
+
+# Set on every new connection. WAL lets readers carry on while a review is written, synchronous=NORMAL only
+# syncs at checkpoints in WAL mode, and the memory map and the (negative, i.e. in KiB) page cache save reads.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 64 * 1024 * 1024,
+    'cache_size': -16 * 1024
+}
+
+
+def create_database_engine(database_uri: str, pool_mode: str = 'queue', echo: bool = False, pragmas=None):
+    if pool_mode not in POOL_CLASSES:
+        raise ValueError(f"pool_mode should be one of {', '.join(POOL_CLASSES)}, not {pool_mode!r}")
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    url = make_url(database_uri)
+    engine_args = {'poolclass': POOL_CLASSES[pool_mode], 'echo': echo}
+    if url.get_backend_name() == 'sqlite':
+        # Sessions of different request threads share the pooled connections.
+        engine_args['connect_args'] = {'check_same_thread': False}
+        if url.database in (None, '', ':memory:') and pool_mode == 'queue':
+            # Every connection to sqlite:// is a new empty database, so there has to be exactly one per thread.
+            engine_args['poolclass'] = SingletonThreadPool
+    if engine_args['poolclass'] is QueuePool:
+        # One connection per worker thread of the development server, plus some for bursts.
+        engine_args.update(pool_size=10, max_overflow=20)
+
+    database_engine = create_engine(database_uri, **engine_args)
+
+    if url.get_backend_name() == 'sqlite' and pragmas:
+        @event.listens_for(database_engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    return database_engine
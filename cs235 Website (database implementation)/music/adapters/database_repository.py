@@ -1,10 +1,12 @@
 from datetime import date
 from typing import List
+import random
 
-from sqlalchemy import desc, asc, insert, delete
+from sqlalchemy import desc, asc, insert, delete, select, text, and_, bindparam, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
-from sqlalchemy.orm import scoped_session, make_transient
+from sqlalchemy.orm import scoped_session, make_transient, joinedload, selectinload
 
 from music.domainmodel.review import Review
 from music.domainmodel.track import Track
@@ -12,13 +14,32 @@ from music.domainmodel.album import Album
 from music.domainmodel.artist import Artist
 from music.domainmodel.user import User
 from music.domainmodel.genre import Genre
-from music.adapters.repository import AbstractRepository
+from music.adapters.repository import AbstractRepository, RepositoryException, VersionCheck, normalise_title, \
+    search_terms, SEARCH_FIELD_WEIGHTS
+from music.adapters.prefix_index import PrefixIndex
+from music.adapters.orm import metadata, reviews_table, tracks_table, artists_table, genres_table, track_genres_table, \
+    import_metadata_table, catalogue_tables, catalogue_keys, index_tracks_for_search
+
+
+# Loader strategies for the relationships of Track, per use case. A single track view joins its artist and album
+# into the same query; lists use selectin loading, i.e. one extra query per relationship rather than one per track.
+TRACK_LOADER_STRATEGIES = {
+    'detail': {'_Track__artist': joinedload, '_Track__album': joinedload, '_Track__genres': selectinload},
+    'list': {'_Track__artist': selectinload, '_Track__album': selectinload, '_Track__genres': selectinload},
+}
+
+
+def hash_row(values) -> int:
+    # Values are compared as text, the way SQLite hands back e.g. a duration stored in a String column.
+    return hash(tuple(None if value is None else str(value) for value in values))
 
 
 class SessionContextManager:
-    def __init__(self, session_factory):
+    def __init__(self, session_factory, scopefunc=None):
+        # A single registry of sessions, one per scope: the current thread, or whatever scopefunc returns
+        # (create_app passes the Flask app context, i.e. one session per request).
         self.__session_factory = session_factory
-        self.__session = scoped_session(self.__session_factory)
+        self.__session = scoped_session(self.__session_factory, scopefunc=scopefunc)
 
     def __enter__(self):
         return self
@@ -40,17 +61,41 @@ class SessionContextManager:
         # this method can be used e.g. to allow Flask to start a new session for each http request,
         # via the 'before_request' callback
         self.close_current_session()
-        self.__session = scoped_session(self.__session_factory)
 
     def close_current_session(self):
-        if not self.__session is None:
-            self.__session.close()
+        # Closes and forgets the session of the current scope only, the next access in this scope opens a new one.
+        self.__session.remove()
+
+    def dispose_connections(self):
+        # Drops the pooled connections, e.g. in a server process before it forks its workers.
+        self.__session.get_bind().dispose()
 
 
 class SqlAlchemyRepository(AbstractRepository):
 
-    def __init__(self, session_factory):
-        self._session_cm = SessionContextManager(session_factory)
+    def __init__(self, session_factory, loader_strategies=None, scopefunc=None):
+        self._session_cm = SessionContextManager(session_factory, scopefunc)
+        self._loader_strategies = TRACK_LOADER_STRATEGIES if loader_strategies is None else loader_strategies
+        # Sorted ids of every track and the distinct names offered by the search form. Both are loaded on first use
+        # and dropped whenever the catalogue changes, here or in another process importing into the same database.
+        self._track_ids = None
+        self._distinct_names = dict()
+        self._prefix_indexes = dict()
+        self._catalogue_version = VersionCheck(self.get_catalogue_version)
+
+    def track_loader_options(self, use_case: str) -> list:
+        # Turns the strategies configured for a use case ('detail' or 'list') into query options.
+        strategies = self._loader_strategies.get(use_case, {})
+        return [loader(getattr(Track, attribute)) for attribute, loader in strategies.items()]
+
+    def invalidate_catalogue_cache(self):
+        self._track_ids = None
+        self._distinct_names = dict()
+        self._prefix_indexes = dict()
+
+    def _revalidate_catalogue_cache(self):
+        if self._catalogue_version.changed():
+            self.invalidate_catalogue_cache()
 
     def close_session(self):
         self._session_cm.close_current_session()
@@ -58,10 +103,19 @@ class SqlAlchemyRepository(AbstractRepository):
     def reset_session(self):
         self._session_cm.reset_session()
 
+    def dispose_connections(self):
+        self._session_cm.dispose_connections()
+
     def add_user(self, user: User):
+        # The id comes from the users table, so users registered at the same time through different processes
+        # never share one. The unique user name decides which of two registrations of the same name wins.
         with self._session_cm as scm:
+            user._User__user_id = None
             scm.session.add(user)
-            scm.commit()
+            try:
+                scm.commit()
+            except IntegrityError:
+                raise RepositoryException(f'User name {user.user_name} is already taken')
 
     def get_user(self, user_name: str) -> User:
         user = None
@@ -78,26 +132,57 @@ class SqlAlchemyRepository(AbstractRepository):
 
     def add_track(self, track: Track):
         with self._session_cm as scm:
+            # A genre that is already stored is linked to as it is, rather than inserted again.
+            for index, genre in enumerate(track.genres):
+                stored_genre = scm.session.get(Genre, genre.genre_id)
+                if stored_genre is not None:
+                    track.genres[index] = stored_genre
             scm.session.add(track)
+            scm.session.flush()
+            index_tracks_for_search(scm.session, [track.track_id])
             scm.commit()
+        self.invalidate_catalogue_cache()
 
     def add_genre(self, genre: Genre):
         with self._session_cm as scm:
-            scm.session.add(genre)
+            if scm.session.get(Genre, genre.genre_id) is None:
+                scm.session.add(genre)
             scm.commit()
+        self.invalidate_catalogue_cache()
 
     def get_track_by_id(self, id: int) -> Track:
-        track = None
-        try:
-            track = self._session_cm.session.query(Track).filter(Track._Track__track_id == id).one()
-        except NoResultFound:
-            # Ignore any exception and return None.
-            pass
+        # Primary key lookup, with the artist, album and genres loaded together with the track.
+        # Returns None if there is no track with the given id.
+        track = self._session_cm.session.get(Track, id, options=self.track_loader_options('detail'))
         return track
 
+    def get_track_ids(self) -> List[int]:
+        self._revalidate_catalogue_cache()
+        if self._track_ids is None:
+            rows = self._session_cm.session.execute(tracks_table.select().with_only_columns(
+                [tracks_table.c.id]).order_by(tracks_table.c.id))
+            self._track_ids = [row[0] for row in rows]
+        return self._track_ids
+
+    def get_random_track(self) -> Track:
+        # Picks from the cached id list, so a valid track is found with a single primary key lookup.
+        track_ids = self.get_track_ids()
+        if not track_ids:
+            return None
+        return self.get_track_by_id(random.choice(track_ids))
+
+    def get_tracks_page(self, after_id: int, limit: int) -> List[Track]:
+        tracks = self._session_cm.session.query(Track) \
+            .options(*self.track_loader_options('list')) \
+            .filter(Track._Track__track_id > after_id) \
+            .order_by(Track._Track__track_id) \
+            .limit(limit) \
+            .all()
+        return tracks
+
     def get_num_tracks(self):
-        number_of_tracks = self._session_cm.session.query(Track).count()
-        return number_of_tracks
+        # The cached id list doubles as the track count.
+        return len(self.get_track_ids())
 
     def get_num_users(self):
         number_of_users = self._session_cm.session.query(User).count()
@@ -108,32 +193,104 @@ class SqlAlchemyRepository(AbstractRepository):
         return reviews
 
     def get_review_by_track(self, track_id: int) -> List[Review]:
-        all_reviews = self._session_cm.session.query(Review).all()
-        reviews = []
-        for review in all_reviews:
-            if review.track.track_id == track_id:
-                reviews.append(review)
+        # A single indexed query on user_review.track_id, with the reviewing user joined in.
+        reviews = self._session_cm.session.query(Review) \
+            .options(joinedload(Review._Review__user)) \
+            .filter(reviews_table.c.track_id == track_id) \
+            .order_by(Review._Review__review_id) \
+            .all()
         return reviews
 
     def get_user_by_track(self, track_id: int) -> List[User]:
-        all_reviews = self._session_cm.session.query(Review).all()
-        reviews = []
-        users = []
-        for review in all_reviews:
-            if review.track.track_id == track_id:
-                reviews.append(review)
-
-        for review in reviews:
-            user_id = review.user_id
-            if user_id is not None:
-                user = self._session_cm.session.query(User).filter(User._User__user_id == user_id).one()
-                users.append(user)
-        return users
+        return self.__review_users(self.get_review_by_track(track_id))
+
+    def get_reviews_and_users_by_track(self, track_id: int):
+        # The users were joined into the review query, so both lists come from a single query.
+        reviews = self.get_review_by_track(track_id)
+        return reviews, self.__review_users(reviews)
+
+    @staticmethod
+    def __review_users(reviews: List[Review]) -> List[User]:
+        return [review._Review__user for review in reviews if review._Review__user is not None]
 
     def get_track_list(self) -> List[Track]:
-        tracks = self._session_cm.session.query(Track).all()
+        tracks = self._session_cm.session.query(Track).options(*self.track_loader_options('list')).all()
+        return tracks
+
+    def get_tracks_by_artist(self, artist_name: str) -> List[Track]:
+        tracks = self._session_cm.session.query(Track) \
+            .join(Track._Track__artist) \
+            .options(*self.track_loader_options('list')) \
+            .filter(Artist._Artist__full_name == artist_name) \
+            .order_by(Track._Track__track_id) \
+            .all()
         return tracks
 
+    def get_tracks_by_title(self, track_title: str) -> List[Track]:
+        tracks = self._session_cm.session.query(Track) \
+            .options(*self.track_loader_options('list')) \
+            .filter(Track._Track__title == normalise_title(track_title)) \
+            .order_by(Track._Track__track_id) \
+            .all()
+        return tracks
+
+    def get_tracks_by_genre(self, genre_name: str) -> List[Track]:
+        # genres.name -> genres.genre_id -> track_genres(genre_id, track_id) -> tracks, all resolved through indexes.
+        matching_track_ids = self._session_cm.session.query(track_genres_table.c.track_id) \
+            .join(genres_table, genres_table.c.genre_id == track_genres_table.c.genre_id) \
+            .filter(genres_table.c.name == genre_name)
+        tracks = self._session_cm.session.query(Track) \
+            .options(*self.track_loader_options('list')) \
+            .filter(Track._Track__track_id.in_(matching_track_ids)) \
+            .order_by(Track._Track__track_id) \
+            .all()
+        return tracks
+
+    def get_artist_names(self) -> List[str]:
+        return self._get_distinct_names(artists_table.c.name)
+
+    def get_track_titles(self) -> List[str]:
+        return self._get_distinct_names(tracks_table.c.title)
+
+    def get_genre_names(self) -> List[str]:
+        return self._get_distinct_names(genres_table.c.name)
+
+    def search_tracks(self, query: str, limit: int = 10, offset: int = 0) -> List[Track]:
+        terms = search_terms(query)
+        if len(terms) == 0:
+            return []
+        # Every word has to match, as a prefix, in one of the indexed columns. bm25 ranks lower as better.
+        match = ' '.join(f'"{term}"*' for term in terms)
+        rows = self._session_cm.session.execute(text(
+            "SELECT rowid FROM track_search WHERE track_search MATCH :match "
+            "ORDER BY bm25(track_search, :title_weight, :artist_weight, :album_weight), rowid "
+            "LIMIT :limit OFFSET :offset"
+        ), {'match': match, 'limit': limit, 'offset': offset, 'title_weight': SEARCH_FIELD_WEIGHTS['title'],
+            'artist_weight': SEARCH_FIELD_WEIGHTS['artist'], 'album_weight': SEARCH_FIELD_WEIGHTS['album']})
+        track_ids = [row[0] for row in rows]
+        if len(track_ids) == 0:
+            return []
+        tracks = self._session_cm.session.query(Track).options(*self.track_loader_options('list')) \
+            .filter(Track._Track__track_id.in_(track_ids)).all()
+        tracks_by_id = {track.track_id: track for track in tracks}
+        return [tracks_by_id[track_id] for track_id in track_ids if track_id in tracks_by_id]
+
+    def get_suggestions(self, field: str, prefix: str, limit: int = 10) -> List[str]:
+        # Built once from the cached distinct names, so a lookup is a binary search rather than a LIKE query.
+        self._revalidate_catalogue_cache()
+        if field not in self._prefix_indexes:
+            names = {'artist': self.get_artist_names, 'title': self.get_track_titles, 'genre': self.get_genre_names}
+            self._prefix_indexes[field] = PrefixIndex(names[field]())
+        return self._prefix_indexes[field].search(prefix, limit)
+
+    def _get_distinct_names(self, column) -> List[str]:
+        self._revalidate_catalogue_cache()
+        key = str(column)
+        if key not in self._distinct_names:
+            rows = self._session_cm.session.query(column).filter(column.isnot(None)).distinct().order_by(column)
+            self._distinct_names[key] = [row[0] for row in rows]
+        return self._distinct_names[key]
+
     def get_artist_list(self) -> List[Artist]:
         artists = self._session_cm.session.query(Artist).all()
         return artists
@@ -145,32 +302,84 @@ class SqlAlchemyRepository(AbstractRepository):
     def add_user_to_review(self, user: User):
         with self._session_cm as scm:
             item = scm.session.query(Review).order_by(desc(Review._Review__review_id)).first()
-            item.user_id = user.user_id
+            # Assigning through the mapped relationship is what persists user_review.user_id. The user may come
+            # from another session (e.g. through the repository cache), merge uses this session's copy of it.
+            item._Review__user = scm.session.merge(user)
             scm.commit()
 
     def add_genre_to_tracks(self, genre_list: List[Genre], track_id: int):
+        # Inserts the genres that are not stored yet and the missing track_genres rows of the track, each as a
+        # single multi-row insert.
+        genres = {genre.genre_id: genre for genre in genre_list}
         with self._session_cm as scm:
-            track_item = self._session_cm.session.query(Track).filter(Track._Track__track_id == track_id).one()
-            genre_string = ""
-            for genre in genre_list:
-                genre_string += str(genre.genre_id) + ","
-            genre_string = genre_string[:-2]
-            track_item.genre_id = "9"
+            stored_genre_ids = set(scm.session.execute(
+                select(genres_table.c.genre_id).where(genres_table.c.genre_id.in_(genres))).scalars())
+            linked_genre_ids = set(scm.session.execute(
+                select(track_genres_table.c.genre_id).where(track_genres_table.c.track_id == track_id)).scalars())
+            new_genres = [{'genre_id': genre_id, 'name': genre.name} for genre_id, genre in genres.items()
+                          if genre_id not in stored_genre_ids]
+            new_links = [{'genre_id': genre_id, 'track_id': track_id} for genre_id in genres
+                         if genre_id not in linked_genre_ids]
+            if new_genres:
+                scm.session.execute(genres_table.insert(), new_genres)
+            if new_links:
+                scm.session.execute(track_genres_table.insert(), new_links)
             scm.commit()
+        self.invalidate_catalogue_cache()
 
-    def add_review(self, review: Review):
+    def add_review(self, review: Review, user: User = None):
         with self._session_cm as scm:
-            scm.session.add(review)
+            # merge rather than add, the reviewed track and the user may have been loaded by another session.
+            # The user is assigned in the same transaction, so concurrent reviews cannot swap their users.
+            review = scm.session.merge(review)
+            if user is not None:
+                review._Review__user = scm.session.merge(user)
             scm.commit()
 
     def add_artist(self, artist: Artist):
         with self._session_cm as scm:
             scm.session.add(artist)
+            scm.session.flush()
+            self._index_tracks_for_search(scm.session, tracks_table.c.artist_id == artist.artist_id)
             scm.commit()
+        self.invalidate_catalogue_cache()
 
     def add_album(self, album: Album):
         with self._session_cm as scm:
             scm.session.add(album)
+            scm.session.flush()
+            self._index_tracks_for_search(scm.session, tracks_table.c.album_id == album.album_id)
+            scm.commit()
+        self.invalidate_catalogue_cache()
+
+    def _index_tracks_for_search(self, session, condition):
+        # Tracks can be added before their artist or album, their search rows are rewritten once those are known.
+        track_ids = [row[0] for row in session.execute(select(tracks_table.c.id).where(condition))]
+        index_tracks_for_search(session, track_ids)
+
+    def get_data_version(self):
+        # The latest review and the hash of the imported csv files, in one query.
+        latest_review = select(func.max(reviews_table.c.id)).scalar_subquery()
+        return tuple(self._session_cm.session.execute(select(latest_review, self.__imported_csv())).one())
+
+    def get_catalogue_version(self):
+        return self._session_cm.session.execute(select(self.__imported_csv())).scalar()
+
+    @staticmethod
+    def __imported_csv():
+        # csv_stat is left out, it is refreshed without the catalogue changing.
+        return select(import_metadata_table.c.value) \
+            .where(import_metadata_table.c.name == 'csv_sha256').scalar_subquery()
+
+    def get_import_metadata(self) -> dict:
+        rows = self._session_cm.session.execute(import_metadata_table.select())
+        return {row.name: row.value for row in rows}
+
+    def set_import_metadata(self, values: dict):
+        with self._session_cm as scm:
+            scm.session.execute(import_metadata_table.delete().where(import_metadata_table.c.name.in_(list(values))))
+            scm.session.execute(import_metadata_table.insert(),
+                                [{'name': name, 'value': value} for name, value in values.items()])
             scm.commit()
 
     def get_album_by_id(self, id: int) -> Album:
@@ -182,6 +391,138 @@ class SqlAlchemyRepository(AbstractRepository):
             pass
         return album
 
+    def bulk_load(self, batches, replace: bool = False) -> int:
+        # Inserts batches of plain row dictionaries (table name -> list of rows) as multi-row inserts.
+        # Everything is written in a single transaction, so a cold start costs one commit instead of one per row.
+        # With replace, the catalogue tables are emptied first in the same transaction, so readers see either the
+        # old or the new catalogue. Users and reviews are kept.
+        rows_inserted = 0
+        with self._session_cm as scm:
+            if replace:
+                for table in reversed(catalogue_tables):
+                    scm.session.execute(table.delete())
+            for batch in batches:
+                # sorted_tables is in foreign key order, so referenced rows are always inserted first.
+                for table in metadata.sorted_tables:
+                    rows = batch.get(table.name)
+                    if rows:
+                        scm.session.execute(table.insert(), rows)
+                        rows_inserted += len(rows)
+            index_tracks_for_search(scm.session)
+            scm.commit()
+        self.invalidate_catalogue_cache()
+        return rows_inserted
+
+    def sync_catalogue(self, batches) -> dict:
+        # Brings the catalogue tables in line with batches of rows (as for bulk_load) in a single transaction and
+        # writes only the difference: rows are matched by their catalogue_keys and compared by a hash of their
+        # values. Tracks with reviews stay, together with their artist, album and genres, even if they are no
+        # longer imported. Returns the number of inserted, updated and deleted rows per table.
+        changes = {table.name: {'inserted': 0, 'updated': 0, 'deleted': 0} for table in catalogue_tables}
+        # table name -> {key: row hash} of the rows in the database, and the keys of the imported rows.
+        stored = dict()
+        imported = {table.name: set() for table in catalogue_tables}
+        # table name -> keys of new or changed rows
+        written = {table.name: set() for table in catalogue_tables}
+        with self._session_cm as scm:
+            session = scm.session
+            for batch in batches:
+                for table in catalogue_tables:
+                    rows = batch.get(table.name)
+                    if not rows:
+                        continue
+                    key_columns = catalogue_keys[table.name]
+                    columns = list(rows[0])
+                    if table.name not in stored:
+                        stored[table.name] = self._row_hashes(session, table, key_columns, columns)
+                    new_rows = []
+                    changed_rows = []
+                    for row in rows:
+                        key = tuple(row[column] for column in key_columns)
+                        imported[table.name].add(key)
+                        row_hash = stored[table.name].get(key)
+                        if row_hash is None:
+                            new_rows.append(row)
+                        elif row_hash != hash_row(row[column] for column in columns):
+                            changed_rows.append(row)
+                        else:
+                            continue
+                        written[table.name].add(key)
+                    if new_rows:
+                        session.execute(table.insert(), new_rows)
+                    if changed_rows:
+                        self._update_rows(session, table, key_columns, changed_rows)
+                    changes[table.name]['inserted'] += len(new_rows)
+                    changes[table.name]['updated'] += len(changed_rows)
+
+            removed = self._removed_catalogue_rows(session, stored, imported)
+            for table in reversed(catalogue_tables):
+                if removed[table.name]:
+                    key_columns = catalogue_keys[table.name]
+                    session.execute(
+                        table.delete().where(and_(*[table.c[column] == bindparam('key_' + column)
+                                                    for column in key_columns])),
+                        [{'key_' + column: value for column, value in zip(key_columns, key)}
+                         for key in removed[table.name]])
+                    changes[table.name]['deleted'] += len(removed[table.name])
+
+            # Search rows of new, changed and removed tracks, and of tracks whose artist or album changed.
+            track_ids = {key[0] for key in written['tracks'] | removed['tracks']}
+            artist_ids = [key[0] for key in written['artists']]
+            album_ids = [key[0] for key in written['albums']]
+            if artist_ids or album_ids:
+                rows = session.execute(select(tracks_table.c.id).where(
+                    tracks_table.c.artist_id.in_(artist_ids) | tracks_table.c.album_id.in_(album_ids)))
+                track_ids.update(row[0] for row in rows)
+            index_tracks_for_search(session, track_ids)
+            scm.commit()
+        self.invalidate_catalogue_cache()
+        return changes
+
+    def _row_hashes(self, session, table, key_columns, columns) -> dict:
+        rows = session.execute(select(*[table.c[column] for column in key_columns + tuple(columns)]))
+        return {tuple(row[:len(key_columns)]): hash_row(row[len(key_columns):]) for row in rows}
+
+    def _update_rows(self, session, table, key_columns, rows):
+        value_columns = [column for column in rows[0] if column not in key_columns]
+        statement = table.update() \
+            .where(and_(*[table.c[column] == bindparam('key_' + column) for column in key_columns])) \
+            .values({column: bindparam('value_' + column) for column in value_columns})
+        session.execute(statement, [
+            {**{'key_' + column: row[column] for column in key_columns},
+             **{'value_' + column: row[column] for column in value_columns}} for row in rows])
+
+    def _removed_catalogue_rows(self, session, stored, imported) -> dict:
+        # Keys of the rows that are no longer imported, without the reviewed tracks and everything they refer to.
+        removed = dict()
+        for table in catalogue_tables:
+            if table.name not in stored:
+                if table is import_metadata_table:
+                    # Only replaced when the import comes with metadata.
+                    removed[table.name] = set()
+                    continue
+                key_columns = catalogue_keys[table.name]
+                stored[table.name] = self._row_hashes(session, table, key_columns, ())
+            removed[table.name] = set(stored[table.name]) - imported[table.name]
+
+        reviewed_track_ids = {row[0] for row in session.execute(select(reviews_table.c.track_id).distinct())}
+        kept_track_ids = {key[0] for key in removed['tracks'] if key[0] in reviewed_track_ids}
+        if kept_track_ids:
+            rows = session.execute(select(tracks_table.c.artist_id, tracks_table.c.album_id)
+                                   .where(tracks_table.c.id.in_(kept_track_ids)))
+            kept_artist_ids = set()
+            kept_album_ids = set()
+            for artist_id, album_id in rows:
+                kept_artist_ids.add(artist_id)
+                kept_album_ids.add(album_id)
+            kept_genre_ids = {key[0] for key in stored['track_genres'] if key[1] in kept_track_ids}
+            removed['tracks'] = {key for key in removed['tracks'] if key[0] not in kept_track_ids}
+            removed['track_genres'] = {key for key in removed['track_genres'] if key[1] not in kept_track_ids}
+            removed['artists'] = {key for key in removed['artists'] if key[0] not in kept_artist_ids}
+            removed['albums'] = {key for key in removed['albums'] if key[0] not in kept_album_ids}
+            removed['genres'] = {key for key in removed['genres'] if key[0] not in kept_genre_ids}
+        return removed
+
     def get_artist_by_id(self, id: int) -> Artist:
         artist = None
         try:
@@ -4,12 +4,16 @@ from datetime import date, datetime
 from typing import List
 import math
 import json
+import random
+import threading
 
-from bisect import bisect, bisect_left, insort_left
+from bisect import bisect, bisect_left
 
 from werkzeug.security import generate_password_hash
 
-from music.adapters.csvdatareader import TrackCSVReader, create_track_object, create_artist_object, create_album_object
+from music.adapters.repository import RepositoryException, normalise_title, search_terms, SEARCH_FIELD_WEIGHTS
+from music.adapters.prefix_index import PrefixIndex
+from music.adapters.csvdatareader import TrackCSVReader, ImportContext, create_track_object, create_artist_object, create_album_object, extract_genres
 from music.domainmodel import artist, user, review
 from music.domainmodel.track import Track
 from music.domainmodel.album import Album
@@ -23,20 +27,48 @@ class MemoryRepository:
     def __init__(self):
         self.__tracks = []
         self.__tracks_index = dict()
+        # Track ids, used for pagination. Appended as tracks are added and sorted on the next read if they came
+        # out of order, so populating the repository does not shift the list for every track.
+        self.__track_ids = []
+        self.__track_ids_sorted = True
         self.__albums = []
         self.__artist = []
         self.__users = []
         self.__genres = []
         self.__num_tracks = 0
+        # Hash indexes for searching: artist name, track title and genre name -> tracks, user_name -> user.
+        self.__artist_index = dict()
+        self.__title_index = dict()
+        self.__genre_index = dict()
+        self.__users_index = dict()
+        # Sorted keys of the search indexes, rebuilt after tracks are added.
+        self.__sorted_names = dict()
+        # Prefix indexes over those keys for autocomplete, rebuilt alongside them.
+        self.__prefix_indexes = dict()
+        # Inverted index for full-text search: word -> {track_id: summed weight of the fields containing the word}.
+        self.__search_index = dict()
+        # Sorted words of the inverted index for prefix matching, rebuilt after tracks are added.
+        self.__search_words = None
+        self.__reviews = []
+        # Reviewing user of each review (by position), the pairing user_review.user_id stores in the database.
+        self.__review_users = []
+        # track_id -> positions of its reviews
+        self.__reviews_index = dict()
+        # Requests of a threaded server add reviews concurrently, a review's position is taken under the lock.
+        self.__reviews_lock = threading.Lock()
 
     def add_user(self, user: user):
+        if user.user_name in self.__users_index:
+            raise RepositoryException(f'User name {user.user_name} is already taken')
+        user._User__user_id = len(self.__users) + 1
         self.__users.append(user)
+        self.__users_index[user.user_name] = user
 
     def get_users(self):
         return self.__users
 
     def get_user(self, user_name) -> user:
-        return next((user for user in self.__users if user.user_name == user_name), None)
+        return self.__users_index.get(user_name)
 
     def get_number_of_users(self):
         return len(self.__users)
@@ -44,13 +76,56 @@ class MemoryRepository:
     def add_track(self, track: Track):
         self.__tracks.append(track)
         self.__tracks_index[track.track_id] = track
+        if self.__track_ids and track.track_id < self.__track_ids[-1]:
+            self.__track_ids_sorted = False
+        self.__track_ids.append(track.track_id)
         self.__num_tracks += 1
+        if track.artist is not None:
+            self.__artist_index.setdefault(track.artist.full_name, []).append(track)
+        if track.title is not None:
+            self.__title_index.setdefault(normalise_title(track.title), []).append(track)
+        for genre in track.genres:
+            self.__genre_index.setdefault(genre.name, []).append(track)
+        self.__sorted_names = dict()
+        self.__prefix_indexes = dict()
+        self.__index_track_for_search(track)
+
+    def __index_track_for_search(self, track: Track):
+        fields = {
+            'title': track.title,
+            'artist': track.artist.full_name if track.artist is not None else None,
+            'album': track.album.title if track.album is not None else None
+        }
+        for field, text in fields.items():
+            for word in set(search_terms(text)):
+                weights = self.__search_index.setdefault(word, dict())
+                weights[track.track_id] = weights.get(track.track_id, 0) + SEARCH_FIELD_WEIGHTS[field]
+        self.__search_words = None
 
     def get_num_tracks(self):
         return self.__num_tracks
 
     def get_track_by_id(self, track_id):
-        return self.__tracks_index[track_id]
+        return self.__tracks_index.get(track_id)
+
+    def get_track_ids(self) -> List[int]:
+        return self.__sorted_track_ids()
+
+    def get_tracks_page(self, after_id: int, limit: int) -> List[Track]:
+        track_ids = self.__sorted_track_ids()
+        start = bisect(track_ids, after_id)
+        return [self.__tracks_index[track_id] for track_id in track_ids[start:start + limit]]
+
+    def __sorted_track_ids(self) -> List[int]:
+        if not self.__track_ids_sorted:
+            self.__track_ids.sort()
+            self.__track_ids_sorted = True
+        return self.__track_ids
+
+    def get_random_track(self) -> Track:
+        if not self.__tracks:
+            return None
+        return random.choice(self.__tracks)
 
     def get_track(self, id: int) -> Track:
         track = None
@@ -63,33 +138,112 @@ class MemoryRepository:
     def get_track_list(self) -> List:
         return self.__tracks
 
-    @staticmethod
-    def generate_genre_dict(string):
-        genre_dict = string.replace("'", "\"")
-        new_dict = json.loads(genre_dict)[0]
-        return new_dict
+    def get_tracks_by_artist(self, artist_name: str) -> List[Track]:
+        return list(self.__artist_index.get(artist_name, []))
+
+    def get_tracks_by_title(self, track_title: str) -> List[Track]:
+        return list(self.__title_index.get(normalise_title(track_title), []))
+
+    def get_tracks_by_genre(self, genre_name: str) -> List[Track]:
+        return list(self.__genre_index.get(genre_name, []))
+
+    def get_artist_names(self) -> List[str]:
+        return self.__get_sorted_names('artist', self.__artist_index)
+
+    def get_track_titles(self) -> List[str]:
+        return self.__get_sorted_names('title', self.__title_index)
+
+    def get_genre_names(self) -> List[str]:
+        return self.__get_sorted_names('genre', self.__genre_index)
+
+    def search_tracks(self, query: str, limit: int = 10, offset: int = 0) -> List[Track]:
+        terms = search_terms(query)
+        if len(terms) == 0:
+            return []
+        if self.__search_words is None:
+            self.__search_words = sorted(self.__search_index)
+        scores = None
+        for term in terms:
+            # Best weight of any indexed word starting with term, per track.
+            term_scores = dict()
+            index = bisect_left(self.__search_words, term)
+            while index < len(self.__search_words) and self.__search_words[index].startswith(term):
+                for track_id, weight in self.__search_index[self.__search_words[index]].items():
+                    term_scores[track_id] = max(term_scores.get(track_id, 0), weight)
+                index += 1
+            # Every term has to match.
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {track_id: scores[track_id] + weight for track_id, weight in term_scores.items()
+                          if track_id in scores}
+        ranked = sorted(scores, key=lambda track_id: (-scores[track_id], track_id))
+        return [self.__tracks_index[track_id] for track_id in ranked[offset:offset + limit]]
 
-    def generate_genre(self, genre_id, title):
-        new_genre = Genre(genre_id, title)
-        if title not in self.__genres:
-            self.__genres.append(title)
-        return new_genre
+    def get_suggestions(self, field: str, prefix: str, limit: int = 10) -> List[str]:
+        if field not in self.__prefix_indexes:
+            names = {'artist': self.get_artist_names, 'title': self.get_track_titles, 'genre': self.get_genre_names}
+            self.__prefix_indexes[field] = PrefixIndex(names[field]())
+        return self.__prefix_indexes[field].search(prefix, limit)
 
-    def populate_tracks(self, track_repo):
+    def __get_sorted_names(self, key, index: dict) -> List[str]:
+        if key not in self.__sorted_names:
+            self.__sorted_names[key] = sorted(name for name in index if name is not None)
+        return self.__sorted_names[key]
+
+    def add_review(self, review, user: User = None):
+        with self.__reviews_lock:
+            self.__reviews_index.setdefault(review.track.track_id, []).append(len(self.__reviews))
+            self.__reviews.append(review)
+            self.__review_users.append(user)
+
+    def add_user_to_review(self, user: User):
+        with self.__reviews_lock:
+            if self.__review_users:
+                self.__review_users[-1] = user
+
+    def get_review_list(self) -> List:
+        return self.__reviews
+
+    def get_review_by_track(self, track_id: int) -> List:
+        return [self.__reviews[position] for position in self.__reviews_index.get(track_id, [])]
+
+    def get_user_by_track(self, track_id: int) -> List[User]:
+        users = [self.__review_users[position] for position in self.__reviews_index.get(track_id, [])]
+        return [user for user in users if user is not None]
+
+    def get_reviews_and_users_by_track(self, track_id: int):
+        return self.get_review_by_track(track_id), self.get_user_by_track(track_id)
+
+    def get_data_version(self):
+        # The repository lives in this process only, its writes reach the caches through CachingRepository.
+        return None
+
+    def get_catalogue_version(self):
+        return None
+
+    def add_genre(self, genre: Genre):
+        if genre.name not in self.__genres:
+            self.__genres.append(genre.name)
+
+    def populate_tracks(self, track_repo, context: ImportContext = None):
+        # One import run. Rows repeating a track id are skipped, and artists and genres are shared between tracks.
+        if context is None:
+            context = ImportContext()
         for item in track_repo:
+            if not context.first_seen('tracks', int(item['track_id'])):
+                continue
             new_track = Track(int(item['track_id']), item['track_title'])
-            new_track.artist = Artist(int(item['artist_id']), item['artist_name'])
+            new_track.artist = context.artist(item)
             new_track.track_duration = round(float(item['track_duration']))
             new_track.track_url = item['track_url']
-            if item['track_genres'].strip() != "":
-                new_dict = self.generate_genre_dict(item['track_genres'])
-                new_genre = self.generate_genre(int(new_dict['genre_id']), new_dict['genre_title'])
+            for new_genre in extract_genres(item, context.genre_parser):
+                if context.first_seen('genres', new_genre.genre_id):
+                    self.add_genre(new_genre)
                 new_track.add_genre(new_genre)
             if item['album_id'].strip() != "":
                 new_track.album = Album(int(item['album_id']), item['album_title'])
-            self.__num_tracks += 1
-            self.__tracks.append(new_track)
-            self.__tracks_index[int(item['track_id'])] = new_track
+            self.add_track(new_track)
 
     def populate_albums(self, album_repo):
         for item in track_repo:
@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Table, MetaData, Column, Integer, String, Date, DateTime,
-    ForeignKey, ARRAY
+    ForeignKey, ARRAY, Index, DDL, PrimaryKeyConstraint, bindparam, event, inspect, text
 )
 
 from sqlalchemy.orm import mapper, relationship, synonym
@@ -28,14 +28,14 @@ reviews_table = Table(
     Column('id', Integer, primary_key=True, autoincrement=True),
     Column('review', String(1024), nullable=False),
     Column('rating', Integer, nullable=False),
-    Column('track_id', Integer, ForeignKey('tracks.id'), nullable=False),
-    Column('user_id', Integer, ForeignKey('users.id'))
+    Column('track_id', Integer, ForeignKey('tracks.id'), nullable=False, index=True),
+    Column('user_id', Integer, ForeignKey('users.id'), index=True)
 )
 
 tracks_table = Table(
     'tracks', metadata,
     Column('id', Integer, primary_key=True),
-    Column('title', String(64), nullable=False),
+    Column('title', String(64), nullable=False, index=True),
     Column('artist_id', Integer, ForeignKey('artists.id')),
     Column('album_id', Integer, ForeignKey('albums.id')),
     Column('duration', String(255), nullable=False),
@@ -53,23 +53,109 @@ albums_table = Table(
 artists_table = Table(
     'artists', metadata,
     Column('id', Integer, primary_key=True, unique=True),
-    Column('name', String(64), nullable=False)
+    Column('name', String(64), nullable=False, index=True)
 )
 
 genres_table = Table(
     'genres', metadata,
     Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('genre_id', Integer),
-    Column('name', String(64), nullable=False)
+    # A genre is stored once, track_genres refers to it by its FMA genre id.
+    Column('genre_id', Integer, nullable=False, unique=True, index=True),
+    Column('name', String(64), nullable=False, index=True)
 )
 
 track_genres_table = Table(
     'track_genres', metadata,
-    Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('genre_id', ForeignKey('genres.genre_id')),
-    Column('track_id', ForeignKey('tracks.id'))
+    Column('genre_id', ForeignKey('genres.genre_id'), nullable=False),
+    Column('track_id', ForeignKey('tracks.id'), nullable=False),
+    # The genres of a track are found through the primary key, which a table without rowid stores its rows in.
+    PrimaryKeyConstraint('track_id', 'genre_id'),
+    # Genre searches go from genre_id to track_id, so the pair is covered by a single index.
+    Index('ix_track_genres_genre_id_track_id', 'genre_id', 'track_id'),
+    sqlite_with_rowid=False
+)
+
+# name -> value pairs describing the last import, e.g. the fingerprint of the csv files it was read from.
+import_metadata_table = Table(
+    'import_metadata', metadata,
+    Column('name', String(64), primary_key=True),
+    Column('value', String(255), nullable=False)
 )
 
+# Tables written by an import, in foreign key order. Users and their reviews are not part of the catalogue.
+catalogue_tables = [albums_table, artists_table, genres_table, tracks_table, track_genres_table,
+                    import_metadata_table]
+
+# Columns identifying a row of each catalogue table when an import is compared with the database.
+catalogue_keys = {
+    'albums': ('id',),
+    'artists': ('id',),
+    'genres': ('genre_id',),
+    'tracks': ('id',),
+    'track_genres': ('genre_id', 'track_id'),
+    'import_metadata': ('name',)
+}
+
+# Full-text index over track titles, artist names and album titles, the rowid of a row is the track id.
+# SQLAlchemy has no construct for FTS5 virtual tables, so it is created and dropped together with the metadata.
+TRACK_SEARCH_TABLE = 'track_search'
+create_track_search = DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS track_search USING fts5(title, artist, album, tokenize='unicode61')")
+event.listen(metadata, 'after_create', create_track_search.execute_if(dialect='sqlite'))
+event.listen(metadata, 'before_drop', DDL("DROP TABLE IF EXISTS track_search").execute_if(dialect='sqlite'))
+
+track_search_rows = (
+    "SELECT tracks.id, tracks.title, artists.name, albums.title FROM tracks "
+    "LEFT JOIN artists ON artists.id = tracks.artist_id LEFT JOIN albums ON albums.id = tracks.album_id"
+)
+
+
+def index_tracks_for_search(connection, track_ids=None):
+    # Rewrites the search rows of the given tracks from the tracks, artists and albums tables, or rebuilds the
+    # whole search table if track_ids is None. connection can be a Connection or a Session.
+    if track_ids is None:
+        connection.execute(text("DELETE FROM track_search"))
+        connection.execute(text(f"INSERT INTO track_search(rowid, title, artist, album) {track_search_rows}"))
+        return
+    track_ids = list(track_ids)
+    if len(track_ids) == 0:
+        return
+    ids = bindparam('track_ids', expanding=True)
+    connection.execute(text("DELETE FROM track_search WHERE rowid IN :track_ids").bindparams(ids),
+                       {'track_ids': track_ids})
+    connection.execute(text(f"INSERT INTO track_search(rowid, title, artist, album) {track_search_rows} "
+                            "WHERE tracks.id IN :track_ids").bindparams(ids), {'track_ids': track_ids})
+
+
+def create_missing_indexes(engine):
+    # metadata.create_all only creates indexes together with new tables, this adds any tables and indexes that an
+    # existing database file is missing. Databases created before genre ids were unique can hold a genre more than
+    # once, all but the first row of each are dropped before the unique index is created. Their track_genres rows
+    # had an id of their own and could link a track to a genre more than once, the table is rebuilt keyed by
+    # (track_id, genre_id) with each link copied once.
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if inspector.has_table(genres_table.name):
+            connection.execute(text("DELETE FROM genres WHERE id NOT IN "
+                                    "(SELECT MIN(id) FROM genres GROUP BY genre_id)"))
+        if inspector.has_table(track_genres_table.name) and \
+                inspector.get_pk_constraint(track_genres_table.name)['constrained_columns'] != ['track_id', 'genre_id']:
+            for index in inspector.get_indexes(track_genres_table.name):
+                connection.execute(text(f"DROP INDEX {index['name']}"))
+            connection.execute(text("ALTER TABLE track_genres RENAME TO track_genres_old"))
+            track_genres_table.create(connection)
+            connection.execute(text("INSERT INTO track_genres (genre_id, track_id) SELECT DISTINCT genre_id, track_id "
+                                    "FROM track_genres_old WHERE genre_id IS NOT NULL AND track_id IS NOT NULL"))
+            connection.execute(text("DROP TABLE track_genres_old"))
+    for table in metadata.sorted_tables:
+        table.create(engine, checkfirst=True)
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    with engine.begin() as connection:
+        if not inspect(connection).has_table(TRACK_SEARCH_TABLE):
+            connection.execute(create_track_search)
+            index_tracks_for_search(connection)
+
 def map_model_to_tables():
     # map names i.e '_User__user_name' references the class item.
     # i.e, while the albums_table row is called year, the class calls for
@@ -105,7 +191,8 @@ def map_model_to_tables():
         '_Artist__artist_id': artists_table.c.id,
         '_Artist__full_name': artists_table.c.name
     })
-    mapper(Genre, genres_table, properties={
+    # Genres are identified by their genre id, so the session holds one object per stored genre.
+    mapper(Genre, genres_table, primary_key=[genres_table.c.genre_id], properties={
         '_Genre__genre_id': genres_table.c.genre_id,
         '_Genre__name': genres_table.c.name
     })
@@ -0,0 +1,25 @@
+from bisect import bisect_left
+from typing import List
+
+
+class PrefixIndex:
+    # Case-insensitive prefix lookups over a fixed list of names.
+    # The names are kept sorted by their casefolded form, so every name starting with a prefix sits in one
+    # contiguous slice that is found with a binary search.
+
+    def __init__(self, names):
+        entries = sorted((name.casefold(), name) for name in set(names) if name is not None)
+        self.__keys = [key for key, name in entries]
+        self.__names = [name for key, name in entries]
+
+    def __len__(self):
+        return len(self.__names)
+
+    def search(self, prefix: str, limit: int = 10) -> List[str]:
+        prefix = prefix.casefold()
+        matches = []
+        index = bisect_left(self.__keys, prefix)
+        while index < len(self.__keys) and len(matches) < limit and self.__keys[index].startswith(prefix):
+            matches.append(self.__names[index])
+            index += 1
+        return matches
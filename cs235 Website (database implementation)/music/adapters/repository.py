@@ -1,4 +1,7 @@
 import abc
+import re
+import threading
+import time
 from typing import List
 from datetime import date
 
@@ -14,6 +17,48 @@ from music.domainmodel.genre import Genre
 repo_instance = None
 
 
+def normalise_title(title: str) -> str:
+    # Track titles are matched the way the domain model stores them, i.e. without surrounding whitespace.
+    return title.strip() if type(title) is str else title
+
+
+# Relative weights of the fields matched by search_tracks, a title match ranks above an artist or album match.
+SEARCH_FIELD_WEIGHTS = {'title': 10.0, 'artist': 5.0, 'album': 2.0}
+
+
+def search_terms(text: str) -> List[str]:
+    # Splits search text into lower case words the way the full-text index tokenizes, i.e. on anything that is
+    # not a letter or digit.
+    return re.findall(r'[^\W_]+', text.casefold()) if type(text) is str else []
+
+
+_UNCHECKED = object()
+
+
+class VersionCheck:
+    # Follows a version that other processes can change, e.g. the repository's get_catalogue_version. version() is
+    # called at most every interval seconds, changed() tells whether it returned something new since the last call.
+    # The first call only notes the version, so it has to come before anything depending on the version is cached.
+
+    def __init__(self, version, interval: float = 1.0, clock=time.monotonic):
+        self.__version = version
+        self.__interval = interval
+        self.__clock = clock
+        self.__known = _UNCHECKED
+        self.__check_at = None
+        self.__lock = threading.Lock()
+
+    def changed(self) -> bool:
+        now = self.__clock()
+        if self.__check_at is not None and now < self.__check_at:
+            return False
+        version = self.__version()
+        with self.__lock:
+            self.__check_at = now + self.__interval
+            known, self.__known = self.__known, version
+            return known is not _UNCHECKED and version != known
+
+
 class RepositoryException(Exception):
 
     def __init__(self, message=None):
@@ -24,7 +69,10 @@ class AbstractRepository(abc.ABC):
 
     @abc.abstractmethod
     def add_user(self, user: User):
-        """" Adds a User to the repository. """
+        """" Adds a User to the repository, which gives the user a new user id.
+
+        Raises RepositoryException if the user name is already taken.
+        """
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -64,6 +112,27 @@ class AbstractRepository(abc.ABC):
         """ Returns specific track at id given. """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_track_ids(self) -> List[int]:
+        """ Returns the ids of all tracks in the database, in ascending order. """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_random_track(self) -> Track:
+        """ Returns a random track from the database.
+
+        If there are no tracks, this method returns None.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_tracks_page(self, after_id: int, limit: int) -> List[Track]:
+        """ Returns up to limit tracks with an id greater than after_id, in ascending id order.
+
+        If there are no matches, this method returns an empty list.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_num_tracks(self) -> int:
         """ Returns the number of tracks in the database. """
@@ -87,12 +156,33 @@ class AbstractRepository(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def get_user_by_track(self, track_id: int, review_id: int) -> List[User]:
+    def get_user_by_track(self, track_id: int) -> List[User]:
         """ Returns a list of all users in the database
         with specific track id.
         """
         raise NotImplementedError
 
+    def get_reviews_and_users_by_track(self, track_id: int):
+        """ Returns the reviews of the track with the given id and the users who wrote them, as a pair of lists.
+        """
+        return self.get_review_by_track(track_id), self.get_user_by_track(track_id)
+
+    def get_data_version(self):
+        """ Returns a value that changes whenever a review is added or a new catalogue is imported, by this or any
+        other process sharing the repository's storage.
+
+        Returns None if the repository is private to this process, whose own writes can be followed instead.
+        """
+        return None
+
+    def get_catalogue_version(self):
+        """ Returns a value that changes whenever a new catalogue is imported, by this or any other process sharing
+        the repository's storage.
+
+        Returns None if the repository is private to this process.
+        """
+        return None
+
     @abc.abstractmethod
     def get_track_list(self) -> List[Track]:
         """ Returns a list of Tracks, from the database.
@@ -101,6 +191,60 @@ class AbstractRepository(abc.ABC):
         """
         raise NotImplementedError
 
+    def get_tracks_by_artist(self, artist_name: str) -> List[Track]:
+        """ Returns a list of Tracks by the artist with the given full name.
+
+        If there are no matches, this method returns an empty list.
+        """
+        return [track for track in self.get_track_list()
+                if track.artist is not None and track.artist.full_name == artist_name]
+
+    def get_tracks_by_title(self, track_title: str) -> List[Track]:
+        """ Returns a list of Tracks with the given title.
+
+        If there are no matches, this method returns an empty list.
+        """
+        track_title = normalise_title(track_title)
+        return [track for track in self.get_track_list() if track.title is not None and track.title == track_title]
+
+    def get_tracks_by_genre(self, genre_name: str) -> List[Track]:
+        """ Returns a list of Tracks tagged with the genre with the given name.
+
+        If there are no matches, this method returns an empty list.
+        """
+        return [track for track in self.get_track_list()
+                if any(genre.name == genre_name for genre in track.genres)]
+
+    @abc.abstractmethod
+    def get_artist_names(self) -> List[str]:
+        """ Returns the distinct full names of all artists with tracks, sorted. """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_track_titles(self) -> List[str]:
+        """ Returns the distinct titles of all tracks, sorted. """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_genre_names(self) -> List[str]:
+        """ Returns the distinct names of all genres, sorted. """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search_tracks(self, query: str, limit: int = 10, offset: int = 0) -> List[Track]:
+        """ Returns the tracks whose title, artist name or album title contain every word of query (each word
+        matches as a prefix), best matches first, skipping the first offset results and returning at most limit.
+
+        If query has no words or nothing matches, this method returns an empty list.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_suggestions(self, field: str, prefix: str, limit: int = 10) -> List[str]:
+        """ Returns up to limit artist names, track titles or genre names (field is 'artist', 'title' or 'genre')
+        that start with prefix, ignoring case. """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_artist_list(self) -> List[Artist]:
         """ Returns a list of Artists, from the database.
@@ -119,16 +263,20 @@ class AbstractRepository(abc.ABC):
 
     @abc.abstractmethod
     def add_user_to_review(self, user: User):
-        """ Add's user to the user_id attribute in the database"""
+        """ Add's user to the user_id attribute of the latest review in the database.
+
+        Reviews written by a user should be added with add_review(review, user), another review can be added in
+        between.
+        """
         raise NotImplementedError
 
     def add_genre_to_tracks(self, genre_list: List[Genre], track_id: int):
-        """ Add's user to the user_id attribute in the database"""
+        """ Links the track with the given id to the genres, adding the genres that are not stored yet."""
         raise NotImplementedError
 
     @abc.abstractmethod
-    def add_review(self, review: Review):
-        """ Adds review to database."""
+    def add_review(self, review: Review, user: User = None):
+        """ Adds review to database, written by user if one is given."""
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -1,30 +1,26 @@
-from flask import Blueprint, redirect, render_template, url_for, request
+from flask import Blueprint, redirect, render_template, url_for, request, jsonify
 from flask_wtf import FlaskForm
 from wtforms import IntegerField, SubmitField
 from wtforms.validators import DataRequired
 
 
 import music.adapters.repository as repo
+from music.page_cache import cached_page
 
-import random, math
+import math
 
 track_blueprint = Blueprint('track_bp', __name__)
-database = repo.repo_instance
 
+TRACKS_PER_PAGE = 10
 
-def create_some_track():
-    num_items = database.get_num_tracks()
-    index = random.randint(0, num_items)
-    some_track = database.get_track_by_id(index)
-    while some_track is None:
-        index = random.randint(0, num_items)
-        some_track = database.get_track_by_id(index)
-    return some_track
+SUGGESTION_FIELDS = ('artist', 'title', 'genre')
+SUGGESTION_LIMIT = 10
+MAX_SUGGESTION_LIMIT = 50
 
 
 @track_blueprint.route('/track')
 def list_track():
-    some_track = create_some_track()
+    some_track = repo.repo_instance.get_random_track()
     track_message = ''
     logged_in = False
     if request.cookies.get('User') is not None:
@@ -32,110 +28,103 @@ def list_track():
     return render_template('track_list.html', track=some_track, message=track_message, logged_in=logged_in)
 
 
-@track_blueprint.route('/tracks/<int:index>', methods=['POST', 'GET'])
+@track_blueprint.route('/tracks/<int:index>', methods=['GET'])
+@cached_page
 def success(index):
-    form = PageView()
-    list_of_tracks = database.get_track_list()
-    track_length = database.get_num_tracks()
-    some_track = create_some_track()
-    new_track_list = []
-    index = index*10
-    previous_index = index-10
-    for i in range(previous_index, index):
-        if i < track_length:
-            new_track_list.append(list_of_tracks[i])
-        else:
-            break
-    if request.form.get('back') is not None:
-        if index != 1:
-            index = int((index / 10)-1)
-            return redirect(url_for('track_bp.success', index=index))
-    elif request.form.get('forward') is not None:
-        if index != 1:
-            index = int((index / 10)+1)
-            return redirect(url_for('track_bp.success', index=index))
-    return render_template('track_list_all.html', form=form, handler_url=int(index/10), track=some_track, track_list=new_track_list)
+    some_track = repo.repo_instance.get_random_track()
+    new_track_list = get_tracks_on_page(index)
+    prev_url = url_for('track_bp.success', index=index-1) if index > 1 else None
+    # The last page has no forward link.
+    has_next = index * TRACKS_PER_PAGE < repo.repo_instance.get_num_tracks()
+    next_url = url_for('track_bp.success', index=index+1) if has_next else None
+    return render_template('track_list_all.html', prev_url=prev_url, next_url=next_url, track=some_track, track_list=new_track_list)
 
 
 @track_blueprint.route('/block_choice', methods=['POST', 'GET'])
 def list_some_tracks():
-    track_length = database.get_num_tracks()
-    page_num = int(math.ceil(track_length/10))
-    some_track = create_some_track()
     form = ListSome()
     if request.method == 'POST':
         return redirect(url_for('track_bp.success', index=int(request.form.get('index'))))
-    else:
-        return render_template('track_list_some.html', form=form, handler_url="block_choice", track=some_track, amount=page_num)
+    track_length = repo.repo_instance.get_num_tracks()
+    page_num = int(math.ceil(track_length/TRACKS_PER_PAGE))
+    some_track = repo.repo_instance.get_random_track()
+    return render_template('track_list_some.html', form=form, handler_url="block_choice", track=some_track, amount=page_num)
+
+
+def get_tracks_on_page(page_number):
+    # Pages start at 1. The id list gives the last id of the previous page, which is then used as a keyset
+    # cursor, so a deep page costs the same single query as the first one.
+    track_ids = repo.repo_instance.get_track_ids()
+    start = (page_number - 1) * TRACKS_PER_PAGE
+    if start < 0 or start >= len(track_ids):
+        return []
+    after_id = track_ids[start - 1] if start > 0 else -1
+    return repo.repo_instance.get_tracks_page(after_id, TRACKS_PER_PAGE)
 
 
 @track_blueprint.route('/track_find/<int:track_id>', methods=['POST', 'GET'])
+@cached_page
 def track_viewer_id(track_id):
-    some_track = create_some_track()
-    tracks = database.get_track_list()
-    track_message = ''
-    for track in tracks:
-        if track_id == track.track_id:
-            review_list = database.get_review_by_track(track_id)
-            user_list = database.get_user_by_track(track_id)
-            return render_template("track_view.html", artist=track.artist.full_name, song=track.title, album=track.album.title, url=track.track_url, duration=track.track_duration, reviews=review_list, users=user_list, track=some_track)
-        else:
-            track_message = "Track with specified ID doesn't exist"
+    some_track = repo.repo_instance.get_random_track()
+    track = repo.repo_instance.get_track_by_id(track_id)
+    if track is None:
+        return render_template('track_list.html', track=some_track, message="Track with specified ID doesn't exist")
 
-    return render_template('track_list.html', track=tracks, message=track_message)
+    artist = track.artist.full_name if track.artist is not None else None
+    album = track.album.title if track.album is not None else None
+    review_list, user_list = repo.repo_instance.get_reviews_and_users_by_track(track_id)
+    return render_template("track_view.html", artist=artist, song=track.title, album=album, url=track.track_url, duration=track.track_duration, reviews=review_list, users=user_list, track=some_track)
 
 
 @track_blueprint.route('/track_find_artist/<artist_name>', methods=['POST', 'GET'])
+@cached_page
 def track_viewer_artist(artist_name):
-    new_track_list = []
-    form = PageView()
-    tracks = database.get_track_list()
-    some_track = create_some_track()
-    for track in tracks:
-        if artist_name == track.artist.full_name:
-            new_track_list.append(track)
-    return render_template('track_list_all.html', form=form, handler_url=artist_name, track=some_track, track_list=new_track_list)
+    new_track_list = repo.repo_instance.get_tracks_by_artist(artist_name)
+    some_track = repo.repo_instance.get_random_track()
+    return render_template('track_list_all.html', track=some_track, track_list=new_track_list)
 
 
 @track_blueprint.route('/track_find_track/<track_title>', methods=['POST', 'GET'])
+@cached_page
 def track_viewer_title(track_title):
-    new_track_list = []
-    tracks = database.get_track_list()
-    form = PageView()
-    some_track = create_some_track()
-    for track in tracks:
-        if track.title is not None:
-            if track_title == track.title:
-                new_track_list.append(track)
-    return render_template('track_list_all.html', form=form, handler_url=track_title, track=some_track, track_list=new_track_list)
+    new_track_list = repo.repo_instance.get_tracks_by_title(track_title)
+    some_track = repo.repo_instance.get_random_track()
+    return render_template('track_list_all.html', track=some_track, track_list=new_track_list)
 
 
 @track_blueprint.route('/track_find_genre/<genre_name>', methods=['POST', 'GET'])
+@cached_page
 def track_viewer_genre(genre_name):
-    new_track_list = []
-    tracks = database.get_track_list()
-    form = PageView()
-    some_track = create_some_track()
-    genre_found = False
-    for track in tracks:
-        genres_list = track.genres
-        for genre in genres_list:
-            if genre.name == genre_name:
-                new_track_list.append(track)
-                genre_found = True
-                break
-    if not genre_found:
+    new_track_list = repo.repo_instance.get_tracks_by_genre(genre_name)
+    some_track = repo.repo_instance.get_random_track()
+    if len(new_track_list) == 0:
         logged_in = False
         if request.cookies.get('User') is not None:
             logged_in = True
         return render_template('track_list.html', track=some_track, message="No tracks found with specified genre", logged_in=logged_in)
-    return render_template('track_list_all.html', form=form, handler_url=genre_name, track=some_track, track_list=new_track_list)
+    return render_template('track_list_all.html', track=some_track, track_list=new_track_list)
+
+
+@track_blueprint.route('/search_tracks/<int:page>', methods=['POST', 'GET'])
+@cached_page
+def search_tracks(page):
+    # Full-text search over titles, artists and albums, e.g. /search_tracks/1?q=kurt, one page of ranked results.
+    query = request.args.get('q', '')
+    if request.form.get('back') is not None:
+        if page > 1:
+            return redirect(url_for('track_bp.search_tracks', page=page-1, q=query))
+    elif request.form.get('forward') is not None:
+        return redirect(url_for('track_bp.search_tracks', page=page+1, q=query))
+    some_track = repo.repo_instance.get_random_track()
+    offset = max(page - 1, 0) * TRACKS_PER_PAGE
+    new_track_list = repo.repo_instance.search_tracks(query, TRACKS_PER_PAGE, offset)
+    prev_url = url_for('track_bp.search_tracks', page=page-1, q=query) if page > 1 else None
+    next_url = url_for('track_bp.search_tracks', page=page+1, q=query)
+    return render_template('track_list_all.html', prev_url=prev_url, next_url=next_url, track=some_track, track_list=new_track_list)
 
 
 @track_blueprint.route('/find', methods=['GET', 'POST'])
 def find_track():
-    some_track = create_some_track()
-    tracks = database.get_track_list()
     form = SearchForm()
     if form.validate_on_submit():
         if form.id.data is not None:
@@ -147,10 +136,20 @@ def find_track():
         elif request.form.get('genre_name') is not None:
             return redirect(url_for("track_bp.track_viewer_genre", genre_name=request.form.get('genre_name')))
 
-        else:
-            return render_template("track_search.html", form=form, handler_url="find", track=some_track, track_list=tracks)
-    else:
-        return render_template("track_search.html", form=form, handler_url="find", track=some_track, track_list=tracks)
+    some_track = repo.repo_instance.get_random_track()
+    return render_template("track_search.html", form=form, handler_url="find", track=some_track)
+
+
+@track_blueprint.route('/api/suggest', methods=['GET'])
+def suggest():
+    # e.g. /api/suggest?field=artist&q=aw returns the first artist names starting with "aw", ignoring case.
+    field = request.args.get('field', '')
+    prefix = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', SUGGESTION_LIMIT, type=int), 1), MAX_SUGGESTION_LIMIT)
+    if field not in SUGGESTION_FIELDS:
+        return jsonify(error=f"field should be one of {', '.join(SUGGESTION_FIELDS)}"), 400
+    suggestions = repo.repo_instance.get_suggestions(field, prefix, limit)
+    return jsonify(field=field, q=prefix, suggestions=suggestions)
 
 
 class SearchForm(FlaskForm):
@@ -161,8 +160,3 @@ class SearchForm(FlaskForm):
 
 class ListSome(FlaskForm):
     submit = SubmitField("Submit")
-
-
-class PageView(FlaskForm):
-    back = SubmitField("<-")
-    forward = SubmitField("->")
\ No newline at end of file
@@ -0,0 +1,132 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, render_template, request
+
+import music.adapters.repository as repo
+from music.adapters.repository import VersionCheck
+
+# layout.html puts the random sidebar track between these, it is cut out of cached pages and rendered for every
+# response.
+SIDEBAR_START = b'<!-- random track -->'
+SIDEBAR_END = b'<!-- /random track -->'
+
+
+class CachedPage:
+
+    def __init__(self, body: bytes, mimetype: str):
+        self.head, start, rest = body.partition(SIDEBAR_START)
+        self.tail = rest.partition(SIDEBAR_END)[2]
+        self.has_sidebar = bool(start)
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        # HTTP dates have no fractions of a second.
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def render(self) -> bytes:
+        if not self.has_sidebar:
+            return self.head
+        sidebar = render_template('simple_track.html', track=repo.repo_instance.get_random_track())
+        return self.head + SIDEBAR_START + sidebar.encode() + SIDEBAR_END + self.tail
+
+
+class PageCache:
+    # Rendered pages by path and query string, least recently used ones are dropped beyond maxsize and every page
+    # expires ttl seconds after it was rendered.
+    # Pages showing a track's reviews are also filed under its id, so a new review only drops those pages.
+    # Writes of other processes are only seen through version(), e.g. the repository's get_data_version: it is
+    # checked at most every revalidate_interval seconds and the whole cache is dropped when it changed.
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 300.0, version=None, revalidate_interval: float = 1.0,
+                 clock=time.monotonic):
+        self.__maxsize = maxsize
+        self.__ttl = ttl
+        self.__version = None if version is None else VersionCheck(version, revalidate_interval, clock)
+        self.__clock = clock
+        self.__pages = OrderedDict()
+        self.__keys_by_track = dict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__pages)
+
+    def get(self, key: str) -> CachedPage:
+        self.revalidate()
+        with self.__lock:
+            entry = self.__pages.get(key)
+            if entry is None:
+                return None
+            expires, page = entry
+            if expires <= self.__clock():
+                del self.__pages[key]
+                return None
+            self.__pages.move_to_end(key)
+            return page
+
+    def put(self, key: str, page: CachedPage, track_id: int = None):
+        with self.__lock:
+            self.__pages[key] = (self.__clock() + self.__ttl, page)
+            self.__pages.move_to_end(key)
+            if track_id is not None:
+                self.__keys_by_track.setdefault(track_id, set()).add(key)
+            while len(self.__pages) > self.__maxsize:
+                self.__pages.popitem(last=False)
+
+    def revalidate(self):
+        if self.__version is not None and self.__version.changed():
+            self.clear()
+
+    def invalidate_track(self, track_id: int):
+        with self.__lock:
+            for key in self.__keys_by_track.pop(track_id, ()):
+                self.__pages.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__pages.clear()
+            self.__keys_by_track.clear()
+
+    def on_repository_change(self, group: str, track_id: int = None):
+        # Invalidation listener for CachingRepository. Users are not shown on anonymous pages except as reviewers,
+        # which comes with a review.
+        if group == 'reviews' and track_id is not None:
+            self.invalidate_track(track_id)
+        elif group != 'users':
+            self.clear()
+
+
+def cached_page(view):
+    # Serves GET requests of anonymous visitors (no User cookie) from the app's page cache, with an ETag and
+    # Last-Modified so browsers can revalidate with a 304 instead of downloading the page again.
+    # A track_id argument of the view ties the page to that track's reviews.
+    # The random sidebar track is not part of the cached page, so the ETag is weak: a 304 keeps the browser's
+    # sidebar track, the rest of the page is the same.
+    @wraps(view)
+    def wrapper(**kwargs):
+        page_cache = current_app.extensions.get('page_cache')
+        if page_cache is None or request.method != 'GET' or request.cookies.get('User') is not None:
+            return view(**kwargs)
+
+        key = request.full_path
+        page = page_cache.get(key)
+        if page is None:
+            response = make_response(view(**kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            page = CachedPage(body, response.mimetype)
+            page_cache.put(key, page, kwargs.get('track_id'))
+        else:
+            body = page.render()
+
+        response = current_app.response_class(body, mimetype=page.mimetype)
+        response.set_etag(page.etag, weak=True)
+        response.last_modified = page.last_modified
+        # Browsers keep the page but check with the server before using it again.
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
@@ -0,0 +1,133 @@
+import os
+
+import pytest
+
+from music.adapters.caching_repository import CachingRepository, TTLCache, CACHED_METHODS
+from music.adapters.csvdatareader import TrackCSVReader
+from music.adapters.memory_repository import MemoryRepository
+from music.domainmodel.review import Review
+from music.domainmodel.track import Track
+from music.domainmodel.user import User
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def caching_repo(clock):
+    dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    albums_file_name = os.path.join(dirname, 'data/raw_albums_test.csv')
+    tracks_file_name = os.path.join(dirname, 'data/raw_tracks_test.csv')
+    reader = TrackCSVReader(albums_file_name, tracks_file_name)
+    repo = MemoryRepository()
+    repo.populate_tracks(reader.iter_tracks_file())
+    return CachingRepository(repo, ttl=60, clock=clock)
+
+
+class TestCachingRepository:
+
+    def test_reads_are_cached(self, caching_repo):
+        track = caching_repo.get_track_by_id(2)
+        assert caching_repo.get_track_by_id(2) is track
+        assert caching_repo.get_track_by_id(99999) is None
+        assert caching_repo.get_track_by_id(99999) is None
+
+        assert caching_repo.hits == 2
+        assert caching_repo.misses == 2
+        assert caching_repo.cache_stats()['get_track_by_id'] == {'hits': 2, 'misses': 2, 'size': 2}
+
+    def test_entries_expire(self, caching_repo, clock):
+        caching_repo.get_num_tracks()
+        clock.now = 59
+        caching_repo.get_num_tracks()
+        clock.now = 61
+        caching_repo.get_num_tracks()
+
+        assert caching_repo.cache_stats()['get_num_tracks'] == {'hits': 1, 'misses': 2, 'size': 1}
+
+    def test_writes_invalidate(self, caching_repo):
+        events = []
+        caching_repo.add_invalidation_listener(lambda group, track_id: events.append((group, track_id)))
+
+        assert caching_repo.get_num_tracks() == 10
+        caching_repo.add_track(Track(1000, 'New'))
+        assert caching_repo.get_num_tracks() == 11
+
+        assert caching_repo.get_user('shyamli') is None
+        user = User(1, 'Shyamli', 'pw12345')
+        caching_repo.add_user(user)
+        assert caching_repo.get_user('shyamli') is user
+
+        assert caching_repo.get_review_by_track(2) == []
+        assert caching_repo.get_review_by_track(3) == []
+        review = Review(caching_repo.get_track_by_id(2), 'Great', 5)
+        caching_repo.add_review(review)
+        caching_repo.add_user_to_review(user)
+        assert caching_repo.get_review_by_track(2) == [review]
+        assert caching_repo.get_user_by_track(2) == [user]
+
+        assert events == [('catalogue', None), ('users', None), ('reviews', 2), ('reviews', 2)]
+
+    def test_random_track_is_served_from_the_cache(self, caching_repo):
+        caching_repo.get_track_ids()
+        for track_id in caching_repo.get_track_ids():
+            caching_repo.get_track_by_id(track_id)
+        misses = caching_repo.misses
+
+        assert caching_repo.get_random_track().track_id in caching_repo.get_track_ids()
+        assert caching_repo.misses == misses
+
+    def test_users_and_reviews_are_not_cached(self, caching_repo):
+        # They change at runtime, through whichever process serves the request.
+        caching_repo.get_user('shyamli')
+        caching_repo.get_number_of_users()
+        caching_repo.get_review_by_track(2)
+        caching_repo.repository.add_user(User(1, 'Shyamli', 'pw12345'))
+        caching_repo.repository.add_review(Review(caching_repo.get_track_by_id(2), 'Great', 5))
+
+        assert caching_repo.get_user('shyamli') is not None
+        assert caching_repo.get_number_of_users() == 1
+        assert len(caching_repo.get_review_by_track(2)) == 1
+        assert set(caching_repo.cache_stats()) == set(CACHED_METHODS['catalogue'])
+
+    def test_imports_of_other_processes_invalidate(self, caching_repo, clock, monkeypatch):
+        versions = ['old csv']
+        monkeypatch.setattr(caching_repo.repository, 'get_catalogue_version', lambda: versions[-1])
+        caching_repo = CachingRepository(caching_repo.repository, ttl=60, clock=clock)
+        events = []
+        caching_repo.add_invalidation_listener(lambda group, track_id: events.append((group, track_id)))
+        assert caching_repo.get_num_tracks() == 10
+
+        # e.g. the gunicorn master finishing an import after the worker was forked.
+        caching_repo.repository.add_track(Track(1000, 'New'))
+        versions.append('new csv')
+        clock.now = 0.5
+        assert caching_repo.get_num_tracks() == 10
+        clock.now = 1
+        assert caching_repo.get_num_tracks() == 11
+        assert events == [('catalogue', None)]
+
+    def test_other_methods_are_passed_on(self, caching_repo):
+        assert caching_repo.get_track(2) is caching_repo.repository.get_track(2)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(2, 60)
+    cache.put(('a',), 1)
+    cache.put(('b',), 2)
+    cache.get(('a',))
+    cache.put(('c',), 3)
+
+    assert cache.get(('a',)) == 1
+    assert cache.get(('c',)) == 3
+    assert len(cache) == 2
@@ -0,0 +1,263 @@
+import os
+import shutil
+from array import array
+
+import pytest
+
+from music.adapters import catalogue_snapshot
+from music.adapters.columnar_repository import ColumnarRepository, ListColumn, StringTable, TextColumn, \
+    PackedStringTable, TrackRows
+from music.adapters.csv_data_importer import open_catalogue_snapshot, csv_stat_signature
+from music.adapters.csvdatareader import TrackCSVReader
+from music.adapters.memory_repository import MemoryRepository
+from music.adapters.repository import RepositoryException
+from music.domainmodel.album import Album
+from music.domainmodel.artist import Artist
+from music.domainmodel.genre import Genre
+from music.domainmodel.review import Review
+from music.domainmodel.track import Track
+from music.domainmodel.user import User
+
+
+def data_files():
+    dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(dirname, 'data/raw_albums_test.csv'), os.path.join(dirname, 'data/raw_tracks_test.csv')
+
+
+def create_reader():
+    return TrackCSVReader(*data_files())
+
+
+@pytest.fixture
+def columnar_repo():
+    reader = create_reader()
+    repo = ColumnarRepository()
+    repo.populate_albums(reader.iter_albums_file())
+    repo.populate_tracks(reader.iter_tracks_file())
+    return repo
+
+
+class TestColumnarRepository:
+
+    def test_tracks_page(self, columnar_repo):
+        assert list(columnar_repo.get_track_ids()) == [2, 3, 5, 10, 20, 30, 134, 137, 138, 139]
+        assert columnar_repo.get_num_tracks() == 10
+
+        first_page = columnar_repo.get_tracks_page(-1, 4)
+        assert [track.track_id for track in first_page] == [2, 3, 5, 10]
+        assert [track.track_id for track in columnar_repo.get_tracks_page(137, 4)] == [138, 139]
+        assert columnar_repo.get_tracks_page(139, 4) == []
+
+    def test_tracks_are_materialised_from_the_columns(self, columnar_repo):
+        track = columnar_repo.get_track_by_id(2)
+
+        assert (track.title, track.track_duration) == ('Food', 168)
+        assert track.artist == Artist(1, 'AWOL')
+        assert track.artist.full_name == 'AWOL'
+        assert (track.album.title, track.album.release_year) == ('AWOL - A Way Of Life', 2009)
+        assert track.track_url.startswith('http://freemusicarchive.org/music/AWOL/')
+        assert [genre.name for genre in track.genres] == ['Hip-Hop']
+        assert columnar_repo.get_track_by_id(1) is None
+
+    def test_random_track(self, columnar_repo):
+        assert columnar_repo.get_random_track().track_id in columnar_repo.get_track_ids()
+        assert ColumnarRepository().get_random_track() is None
+
+    def test_same_results_as_the_memory_repository(self, columnar_repo):
+        memory_repo = MemoryRepository()
+        memory_repo.populate_tracks(create_reader().iter_tracks_file())
+
+        def ids(tracks):
+            return [track.track_id for track in tracks]
+
+        assert ids(columnar_repo.get_track_list()) == ids(memory_repo.get_track_list())
+        assert columnar_repo.get_artist_names() == memory_repo.get_artist_names()
+        assert columnar_repo.get_track_titles() == memory_repo.get_track_titles()
+        assert columnar_repo.get_genre_names() == memory_repo.get_genre_names()
+        for name in memory_repo.get_artist_names():
+            assert ids(columnar_repo.get_tracks_by_artist(name)) == ids(memory_repo.get_tracks_by_artist(name))
+        for title in memory_repo.get_track_titles():
+            assert ids(columnar_repo.get_tracks_by_title(title)) == ids(memory_repo.get_tracks_by_title(title))
+        for name in memory_repo.get_genre_names():
+            assert ids(columnar_repo.get_tracks_by_genre(name)) == ids(memory_repo.get_tracks_by_genre(name))
+        for query in ('awol', 'free', 'AWOL food', 'alec eyesores', 'niris', 'a', 'nothing matches', '  '):
+            assert ids(columnar_repo.search_tracks(query)) == ids(memory_repo.search_tracks(query))
+        assert ids(columnar_repo.search_tracks('awol', 2, 2)) == [5, 134]
+
+    def test_search_indexes(self, columnar_repo):
+        assert [track.track_id for track in columnar_repo.get_tracks_by_title(' Food ')] == [2]
+        assert columnar_repo.get_tracks_by_artist('Nobody') == []
+        assert columnar_repo.get_tracks_by_title('No such track') == []
+        assert columnar_repo.get_tracks_by_genre('No such genre') == []
+
+    def test_listings_create_tracks_when_read(self, columnar_repo):
+        tracks = columnar_repo.get_tracks_by_artist('AWOL')
+        assert isinstance(tracks, TrackRows)
+        assert len(tracks) == 4
+        assert isinstance(tracks[1:3], TrackRows)
+        assert [track.track_id for track in tracks[1:3]] == [3, 5]
+        assert tracks[-1].track_id == 134
+        assert tracks == columnar_repo.get_tracks_by_artist('AWOL')
+        with pytest.raises(IndexError):
+            tracks[4]
+
+        # The tracks read together share their artist and album.
+        first, second = tracks[:2]
+        assert first.artist is second.artist
+        assert first.album is second.album
+        assert len(columnar_repo.get_track_list()) == 10
+
+    def test_count_tracks_by_genre(self, columnar_repo):
+        counts = columnar_repo.count_tracks_by_genre()
+
+        assert counts['Avant-Garde'] == 2
+        assert sum(counts.values()) == sum(len(track.genres) for track in columnar_repo.get_track_list())
+
+    def test_suggestions(self, columnar_repo):
+        assert columnar_repo.get_suggestions('artist', 'a') == ['Airway', 'Alec K. Redfearn & the Eyesores', 'AWOL']
+        assert columnar_repo.get_suggestions('title', 'fo') == ['Food']
+        assert columnar_repo.get_suggestions('genre', 'hip') == ['Hip-Hop']
+
+    def test_add_track(self, columnar_repo):
+        track = Track(4, 'Awake')
+        track.artist = Artist(1000, 'Awesome Band')
+        track.album = Album(1000, 'First')
+        track.add_genre(Genre(21, 'Hip-Hop'))
+        columnar_repo.add_track(track)
+
+        assert list(columnar_repo.get_track_ids())[:4] == [2, 3, 4, 5]
+        assert columnar_repo.get_track_by_id(4).album.title == 'First'
+        assert columnar_repo.get_artist_by_id(1000) == Artist(1000, 'Awesome Band')
+        assert columnar_repo.get_album_by_id('1000').title == 'First'
+        # Indexes built before the track was added are rebuilt.
+        assert columnar_repo.get_suggestions('artist', 'aw') == ['Awesome Band', 'AWOL']
+        assert 4 in [track.track_id for track in columnar_repo.get_tracks_by_genre('Hip-Hop')]
+        assert [track.track_id for track in columnar_repo.search_tracks('awake')] == [4]
+
+        # A track id is only stored once.
+        columnar_repo.add_track(Track(4, 'Again'))
+        assert columnar_repo.get_num_tracks() == 11
+        assert columnar_repo.get_track_by_id(4).title == 'Awake'
+
+    def test_users_and_reviews(self, columnar_repo):
+        user = User(1, 'Shyamli', 'pw12345')
+        columnar_repo.add_user(user)
+        review = Review(columnar_repo.get_track_by_id(2), 'Great', 5)
+        columnar_repo.add_review(review)
+        columnar_repo.add_user_to_review(user)
+
+        assert columnar_repo.get_user('shyamli') is user
+        assert columnar_repo.get_num_users() == 1
+        assert columnar_repo.get_review_by_track(2) == [review]
+        assert columnar_repo.get_user_by_track(2) == [user]
+        assert columnar_repo.get_review_by_track(3) == []
+
+        columnar_repo.add_review(Review(columnar_repo.get_track_by_id(3), 'Fine', 4), user)
+        columnar_repo.add_review(Review(columnar_repo.get_track_by_id(5), 'Meh', 2))
+        assert columnar_repo.get_user_by_track(3) == [user]
+        assert columnar_repo.get_user_by_track(5) == []
+
+
+def test_columns():
+    strings = StringTable()
+    assert strings.intern('Food') == strings.intern('Food') == 0
+    assert strings.intern(None) == -1
+    assert (strings.text(0), strings.text(-1), strings.code('Nope')) == ('Food', None, -1)
+
+    urls = TextColumn()
+    for url in ('http://a', None, 'http://b/é'):
+        urls.append(url)
+    assert [urls[row] for row in range(len(urls))] == ['http://a', None, 'http://b/é']
+
+    genres = ListColumn()
+    for genre_rows in ([0, 2], [], [2]):
+        genres.append(genre_rows)
+    assert [list(genres[row]) for row in range(len(genres))] == [[0, 2], [], [2]]
+
+    tracks_by_key = ListColumn.group(array('i', [1, -1, 0, 1]), 3)
+    assert [list(tracks_by_key[key]) for key in range(3)] == [[2], [0, 3], []]
+
+    packed = PackedStringTable(memoryview(b'FoodHip-Hop'), array('q', [0, 4, 11]))
+    assert (packed.code('Hip-Hop'), packed.code('Food'), packed.code('Jazz'), len(packed)) == (1, 0, -1, 2)
+    assert (packed.text(1), packed.text(-1)) == ('Hip-Hop', None)
+
+
+class TestCatalogueSnapshot:
+
+    def test_same_results_as_the_repository_it_was_saved_from(self, columnar_repo, tmp_path):
+        columnar_repo.save_snapshot(tmp_path / 'catalogue.snapshot', {'source': 'test'})
+        snapshot_repo = ColumnarRepository.open_snapshot(tmp_path / 'catalogue.snapshot')
+
+        def ids(tracks):
+            return [track.track_id for track in tracks]
+
+        assert snapshot_repo.snapshot_metadata == {'source': 'test'}
+        assert list(snapshot_repo.get_track_ids()) == list(columnar_repo.get_track_ids())
+        assert ids(snapshot_repo.get_tracks_page(3, 4)) == [5, 10, 20, 30]
+        for track in columnar_repo.get_track_list():
+            copy = snapshot_repo.get_track_by_id(track.track_id)
+            assert (copy.title, copy.track_url, copy.track_duration) == \
+                   (track.title, track.track_url, track.track_duration)
+            assert (copy.artist, copy.album, copy.genres) == (track.artist, track.album, track.genres)
+            assert copy.album.release_year == track.album.release_year
+        assert snapshot_repo.get_artist_names() == columnar_repo.get_artist_names()
+        assert snapshot_repo.get_genre_names() == columnar_repo.get_genre_names()
+        for name in columnar_repo.get_artist_names():
+            assert ids(snapshot_repo.get_tracks_by_artist(name)) == ids(columnar_repo.get_tracks_by_artist(name))
+        for query in ('awol', 'AWOL food', 'nothing matches'):
+            assert ids(snapshot_repo.search_tracks(query)) == ids(columnar_repo.search_tracks(query))
+        assert snapshot_repo.count_tracks_by_genre() == columnar_repo.count_tracks_by_genre()
+        assert snapshot_repo.get_suggestions('artist', 'a') == columnar_repo.get_suggestions('artist', 'a')
+        assert snapshot_repo.get_album_by_id(1) == columnar_repo.get_album_by_id(1)
+        assert snapshot_repo.get_artist_by_id(999) is None
+
+    def test_catalogue_is_read_only(self, columnar_repo, tmp_path):
+        columnar_repo.save_snapshot(tmp_path / 'catalogue.snapshot')
+        snapshot_repo = ColumnarRepository.open_snapshot(tmp_path / 'catalogue.snapshot')
+
+        with pytest.raises(RepositoryException):
+            snapshot_repo.add_track(Track(4, 'Awake'))
+        with pytest.raises(RepositoryException):
+            snapshot_repo.add_genre(Genre(1, 'Pop'))
+        # Users are not part of the snapshot.
+        snapshot_repo.add_user(User(1, 'Shyamli', 'pw12345'))
+        assert snapshot_repo.get_num_users() == 1
+
+    def test_other_versions_are_rejected(self, columnar_repo, tmp_path, monkeypatch):
+        path = tmp_path / 'catalogue.snapshot'
+        columnar_repo.save_snapshot(path)
+        monkeypatch.setattr(catalogue_snapshot, 'SNAPSHOT_VERSION', catalogue_snapshot.SNAPSHOT_VERSION + 1)
+        with pytest.raises(RepositoryException):
+            ColumnarRepository.open_snapshot(path)
+
+        path.write_bytes(b'not a snapshot')
+        with pytest.raises(RepositoryException):
+            ColumnarRepository.open_snapshot(path)
+
+    def test_rewritten_when_the_csv_files_change(self, tmp_path, monkeypatch):
+        albums_path, tracks_path = str(tmp_path / 'albums.csv'), str(tmp_path / 'tracks.csv')
+        shutil.copyfile(data_files()[0], albums_path)
+        shutil.copyfile(data_files()[1], tracks_path)
+        path = tmp_path / 'catalogue.snapshot'
+
+        repository = open_catalogue_snapshot(path, albums_path, tracks_path)
+        assert repository.get_num_tracks() == 10
+        written = path.stat().st_mtime_ns
+        assert open_catalogue_snapshot(path, albums_path, tracks_path).get_num_tracks() == 10
+        assert path.stat().st_mtime_ns == written
+
+        # Touched, not changed: the new modification times are stored, so the files are only hashed once.
+        os.utime(tracks_path, ns=(written + 10 ** 9, written + 10 ** 9))
+        monkeypatch.setattr('music.adapters.csv_data_importer.build_catalogue_snapshot', None)
+        assert open_catalogue_snapshot(path, albums_path, tracks_path).get_num_tracks() == 10
+        assert ColumnarRepository.open_snapshot(path).snapshot_metadata['csv_stat'] == \
+            csv_stat_signature(albums_path, tracks_path)
+        monkeypatch.setattr('music.adapters.csv_data_importer.csv_import_metadata', None)
+        assert open_catalogue_snapshot(path, albums_path, tracks_path).get_num_tracks() == 10
+        monkeypatch.undo()
+
+        with open(tracks_path, 'rb') as tracks_file:
+            lines = tracks_file.readlines()
+        with open(tracks_path, 'wb') as tracks_file:
+            tracks_file.writelines(lines[:-1])
+        assert open_catalogue_snapshot(path, albums_path, tracks_path).get_num_tracks() < 10
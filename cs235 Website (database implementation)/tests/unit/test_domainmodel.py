@@ -7,7 +7,8 @@ from music.domainmodel.genre import Genre
 from music.domainmodel.review import Review
 from music.domainmodel.album import Album
 from music.domainmodel.user import User
-from music.adapters.csvdatareader import TrackCSVReader
+from music.adapters.csvdatareader import TrackCSVReader, GenreParser, TRACK_COLUMNS, ALBUM_COLUMNS, csv_record_ranges, \
+    parse_track_range
 
 
 class TestArtist:
@@ -675,11 +676,15 @@ class TestUser:
         assert user1.reviews == [review3]
 
 
-def create_csv_reader():
+def create_csv_file_names():
     dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     albums_file_name = os.path.join(dirname, 'data/raw_albums_excerpt.csv')
     tracks_file_name = os.path.join(dirname, 'data/raw_tracks_excerpt.csv')
-    reader = TrackCSVReader(albums_file_name, tracks_file_name)
+    return albums_file_name, tracks_file_name
+
+
+def create_csv_reader():
+    reader = TrackCSVReader(*create_csv_file_names())
     reader.read_csv_files()
     return reader
 
@@ -745,3 +750,68 @@ class TestCSVReader:
         # genre id = 3>]'
         sorted_genre_sample = str(sorted_genres[:3])
         assert sorted_genre_sample == '[<Genre Avant-Garde, genre id = 1>, <Genre International, genre id = 2>, <Genre Blues, genre id = 3>]'
+
+    def test_streamed_rows(self):
+        reader = create_csv_reader()
+
+        # Rows are yielded lazily and only carry the columns used by the domain model.
+        track_rows = reader.iter_tracks_file()
+        first_track_row = next(track_rows)
+        assert tuple(first_track_row) == TRACK_COLUMNS
+        assert first_track_row['track_title'] == 'Food'
+        assert 1 + sum(1 for _ in track_rows) == 2000
+
+        album_rows = list(reader.iter_albums_file())
+        assert tuple(album_rows[0]) == ALBUM_COLUMNS
+        assert album_rows[0]['album_title'] == 'AWOL - A Way Of Life'
+
+    def test_genre_parser(self):
+        parser = GenreParser()
+        cell = "[{'genre_id': '21', 'genre_title': 'Hip-Hop', 'genre_url': 'http://freemusicarchive.org/genre/Hip-Hop/'}, " \
+               "{'genre_id': '4', 'genre_title': \"Children's\", 'genre_url': 'http://freemusicarchive.org/genre/Childrens/'}]"
+
+        genres = parser.parse(cell)
+        assert str(list(genres)) == "[<Genre Hip-Hop, genre id = 21>, <Genre Children's, genre id = 4>]"
+
+        # Identical cells are parsed once and a genre id always maps to the same Genre object.
+        assert parser.parse(cell) is genres
+        assert parser.parse("[{'genre_id': '21', 'genre_title': 'Hip-Hop', 'genre_url': ''}]")[0] is genres[0]
+
+        assert parser.parse('') == ()
+        assert parser.parse('[]') == ()
+        assert parser.parse(None) == ()
+
+    def test_parallel_read(self):
+        reader = create_csv_reader()
+        parallel_reader = TrackCSVReader(*create_csv_file_names())
+        parallel_reader.read_csv_files(workers=2)
+
+        def describe(track):
+            return (track.track_id, track.title, track.track_url, track.track_duration, track.artist.full_name,
+                    track.album, [(genre.genre_id, genre.name) for genre in track.genres])
+
+        # Same tracks in the same order, with artists and genres merged the same way.
+        assert [describe(track) for track in parallel_reader.dataset_of_tracks] == \
+               [describe(track) for track in reader.dataset_of_tracks]
+        assert parallel_reader.dataset_of_artists == reader.dataset_of_artists
+        assert parallel_reader.dataset_of_albums == reader.dataset_of_albums
+        assert parallel_reader.dataset_of_genres == reader.dataset_of_genres
+        tracks_by_artist = {}
+        for track in parallel_reader.dataset_of_tracks:
+            assert tracks_by_artist.setdefault(track.artist.artist_id, track.artist) is track.artist
+
+    def test_record_ranges(self, tmp_path):
+        csv_file = str(tmp_path / 'tracks.csv')
+        with open(csv_file, 'w', newline='') as tracks_csv:
+            tracks_csv.write('track_id,track_title,"track\nurl"\r\n')
+            for track_id in range(50):
+                tracks_csv.write(f'{track_id},"Title, with ""quotes""\r\nand a newline",url{track_id}\r\n')
+
+        header, ranges = csv_record_ranges(csv_file, 7)
+        assert header == ['track_id', 'track_title', 'track\nurl']
+        assert len(ranges) > 1
+        assert all(end == next_start for (start, end), (next_start, _) in zip(ranges, ranges[1:]))
+
+        rows = [row for start, end in ranges for row, genres in parse_track_range(csv_file, header, start, end)]
+        assert [row['track_id'] for row in rows] == [str(track_id) for track_id in range(50)]
+        assert rows[0]['track_title'] == 'Title, with "quotes"\nand a newline'
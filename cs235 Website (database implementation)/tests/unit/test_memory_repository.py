@@ -0,0 +1,165 @@
+import os
+
+import pytest
+
+from music.adapters.csvdatareader import TrackCSVReader, ImportContext
+from music.adapters.memory_repository import MemoryRepository
+from music.adapters.prefix_index import PrefixIndex
+from music.adapters.repository import RepositoryException
+from music.domainmodel.artist import Artist
+from music.domainmodel.review import Review
+from music.domainmodel.track import Track
+from music.domainmodel.user import User
+
+
+@pytest.fixture
+def memory_repo():
+    dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    albums_file_name = os.path.join(dirname, 'data/raw_albums_test.csv')
+    tracks_file_name = os.path.join(dirname, 'data/raw_tracks_test.csv')
+    reader = TrackCSVReader(albums_file_name, tracks_file_name)
+    repo = MemoryRepository()
+    repo.populate_tracks(reader.iter_tracks_file())
+    return repo
+
+
+class TestMemoryRepository:
+
+    def test_tracks_page(self, memory_repo):
+        assert memory_repo.get_track_ids() == [2, 3, 5, 10, 20, 30, 134, 137, 138, 139]
+
+        first_page = memory_repo.get_tracks_page(-1, 4)
+        assert [track.track_id for track in first_page] == [2, 3, 5, 10]
+
+        # Pages continue from the last id of the previous page.
+        next_page = memory_repo.get_tracks_page(first_page[-1].track_id, 4)
+        assert [track.track_id for track in next_page] == [20, 30, 134, 137]
+
+        assert [track.track_id for track in memory_repo.get_tracks_page(137, 4)] == [138, 139]
+        assert memory_repo.get_tracks_page(139, 4) == []
+
+    def test_track_ids_added_out_of_order(self, memory_repo):
+        for track_id in (4, 1, 200):
+            memory_repo.add_track(Track(track_id, f'Track {track_id}'))
+
+        assert memory_repo.get_track_ids() == [1, 2, 3, 4, 5, 10, 20, 30, 134, 137, 138, 139, 200]
+        assert [track.track_id for track in memory_repo.get_tracks_page(-1, 3)] == [1, 2, 3]
+
+    def test_random_track(self, memory_repo):
+        assert memory_repo.get_random_track().track_id in memory_repo.get_track_ids()
+        assert MemoryRepository().get_random_track() is None
+
+    def test_search_indexes(self, memory_repo):
+        assert [track.track_id for track in memory_repo.get_tracks_by_artist('AWOL')] == [2, 3, 5, 134]
+        assert [track.track_id for track in memory_repo.get_tracks_by_title(' Food ')] == [2]
+        assert [track.track_id for track in memory_repo.get_tracks_by_genre('Avant-Garde')] == [137, 138]
+
+        assert memory_repo.get_tracks_by_artist('Nobody') == []
+        assert memory_repo.get_tracks_by_title('No such track') == []
+        assert memory_repo.get_tracks_by_genre('No such genre') == []
+
+    def test_users_index(self, memory_repo):
+        user = User(1, 'Shyamli', 'pw12345')
+        memory_repo.add_user(user)
+
+        assert memory_repo.get_user('shyamli') is user
+        assert memory_repo.get_user('nobody') is None
+
+    def test_users_get_new_ids(self, memory_repo):
+        memory_repo.add_user(User(0, 'Shyamli', 'pw12345'))
+        memory_repo.add_user(User(0, 'Dave', 'pw12345'))
+
+        assert [memory_repo.get_user(name).user_id for name in ('shyamli', 'dave')] == [1, 2]
+        with pytest.raises(RepositoryException):
+            memory_repo.add_user(User(0, 'shyamli', 'pw54321'))
+        assert memory_repo.get_number_of_users() == 2
+
+    def test_reviews_by_track(self, memory_repo):
+        user = User(1, 'Shyamli', 'pw12345')
+        review = Review(memory_repo.get_track_by_id(2), 'Great', 5)
+        memory_repo.add_review(review)
+        memory_repo.add_user_to_review(user)
+        memory_repo.add_review(Review(memory_repo.get_track_by_id(3), 'Okay', 3))
+
+        assert memory_repo.get_review_by_track(2) == [review]
+        assert memory_repo.get_user_by_track(2) == [user]
+        assert memory_repo.get_user_by_track(3) == []
+        assert memory_repo.get_reviews_and_users_by_track(2) == ([review], [user])
+
+        # The user of a review can be added with it.
+        memory_repo.add_review(Review(memory_repo.get_track_by_id(5), 'Fine', 4), user)
+        memory_repo.add_review(Review(memory_repo.get_track_by_id(10), 'Meh', 2))
+        assert memory_repo.get_user_by_track(5) == [user]
+        assert memory_repo.get_user_by_track(10) == []
+
+    def test_search_options(self, memory_repo):
+        assert memory_repo.get_artist_names() == ['AWOL', 'Airway', 'Alec K. Redfearn & the Eyesores', 'Kurt Vile',
+                                                  'Nicky Cook']
+        assert memory_repo.get_track_titles()[:3] == ['CandyAss', 'Electric Ave', 'Food']
+        assert 'Hip-Hop' in memory_repo.get_genre_names()
+        assert memory_repo.get_genre_names() == sorted(set(memory_repo.get_genre_names()))
+
+    def test_suggestions(self, memory_repo):
+        assert memory_repo.get_suggestions('artist', 'a') == ['Airway', 'Alec K. Redfearn & the Eyesores', 'AWOL']
+        assert memory_repo.get_suggestions('artist', 'AW') == ['AWOL']
+        assert memory_repo.get_suggestions('artist', 'a', limit=1) == ['Airway']
+        assert memory_repo.get_suggestions('title', 'fo') == ['Food']
+        assert memory_repo.get_suggestions('genre', 'hip') == ['Hip-Hop']
+        assert memory_repo.get_suggestions('artist', 'zz') == []
+
+        # Names added after the first lookup are picked up by the rebuilt index.
+        track = Track(1000, 'Awake')
+        track.artist = Artist(1000, 'Awesome Band')
+        memory_repo.add_track(track)
+        assert memory_repo.get_suggestions('artist', 'aw') == ['Awesome Band', 'AWOL']
+
+    def test_full_text_search(self, memory_repo):
+        assert [track.track_id for track in memory_repo.search_tracks('free')] == [10]
+        assert [track.track_id for track in memory_repo.search_tracks('AWOL food')] == [2]
+        assert [track.track_id for track in memory_repo.search_tracks('alec eyesores')] == [139]
+        assert memory_repo.search_tracks('nothing matches') == []
+        assert memory_repo.search_tracks('  ') == []
+
+        assert [track.track_id for track in memory_repo.search_tracks('awol', 2)] == [2, 3]
+        assert [track.track_id for track in memory_repo.search_tracks('awol', 2, 2)] == [5, 134]
+
+        memory_repo.add_track(Track(1000, 'Niris'))
+        assert [track.track_id for track in memory_repo.search_tracks('niris')] == [1000, 20, 30]
+
+    def test_populate_skips_repeated_rows(self):
+        dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        reader = TrackCSVReader(os.path.join(dirname, 'data/raw_albums_test.csv'),
+                                os.path.join(dirname, 'data/raw_tracks_test.csv'))
+        rows = list(reader.iter_tracks_file())
+        repo = MemoryRepository()
+        repo.populate_tracks(rows + rows)
+
+        assert repo.get_track_ids() == [2, 3, 5, 10, 20, 30, 134, 137, 138, 139]
+        # Tracks of the same artist share one Artist object.
+        assert repo.get_track_by_id(2).artist is repo.get_track_by_id(3).artist
+
+
+def test_import_context():
+    context = ImportContext()
+
+    assert context.first_seen('tracks', 2)
+    assert not context.first_seen('tracks', 2)
+    assert context.first_seen('albums', 2)
+    assert context.seen('tracks', 2) and not context.seen('artists', 2)
+    assert context.count('tracks') == 1
+
+    artist = context.artist({'artist_id': '1', 'artist_name': 'AWOL'})
+    assert context.artist({'artist_id': '1', 'artist_name': 'AWOL'}) is artist
+
+    # A new run starts empty.
+    assert ImportContext().first_seen('tracks', 2)
+
+
+def test_prefix_index():
+    index = PrefixIndex(['beta', 'Alpha', 'alphabet', 'Gamma', 'alpha', None])
+
+    assert len(index) == 5
+    assert index.search('al') == ['Alpha', 'alpha', 'alphabet']
+    assert index.search('ALPHAB') == ['alphabet']
+    assert index.search('') == ['Alpha', 'alpha', 'alphabet', 'beta', 'Gamma']
+    assert index.search('z') == []
@@ -0,0 +1,48 @@
+from music.page_cache import CachedPage, PageCache, SIDEBAR_START, SIDEBAR_END
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def page(body: bytes = b'<p>tracks</p>') -> CachedPage:
+    return CachedPage(body, 'text/html')
+
+
+def test_pages_expire():
+    clock = Clock()
+    page_cache = PageCache(ttl=60, clock=clock)
+    page_cache.put('/tracks/1', page())
+    clock.now = 59
+    assert page_cache.get('/tracks/1') is not None
+    clock.now = 61
+    assert page_cache.get('/tracks/1') is None
+    assert len(page_cache) == 0
+
+
+def test_pages_are_dropped_when_the_data_version_changes():
+    clock = Clock()
+    versions = [(1, 'csv'), (1, 'csv'), (2, 'csv')]
+    page_cache = PageCache(version=lambda: versions[0], revalidate_interval=1, clock=clock)
+    assert page_cache.get('/tracks/1') is None
+    page_cache.put('/tracks/1', page())
+    assert page_cache.get('/tracks/1') is not None
+
+    # e.g. a review added by another process, which is only checked for once a second.
+    versions.pop(0)
+    versions.pop(0)
+    clock.now = 0.5
+    assert page_cache.get('/tracks/1') is not None
+    clock.now = 1
+    assert page_cache.get('/tracks/1') is None
+
+
+def test_sidebar_is_cut_out_of_the_page():
+    cached = page(b'<div>' + SIDEBAR_START + b'<p>random track</p>' + SIDEBAR_END + b'</div>')
+    assert cached.has_sidebar
+    assert (cached.head, cached.tail) == (b'<div>', b'</div>')
+    assert page().render() == b'<p>tracks</p>'
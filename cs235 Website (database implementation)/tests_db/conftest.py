@@ -6,7 +6,10 @@ from sqlalchemy.orm import sessionmaker, clear_mappers
 from music.adapters import database_repository
 from music.adapters.orm import metadata, map_model_to_tables
 import music.adapters.repository as repo
+from music.adapters.csvdatareader import TrackCSVReader
+from music.adapters.csv_data_importer import create_objects, create_objects_bulk
 
+from music import create_app
 from utils import get_project_root
 
 TEST_DATA_PATH_DATABASE_FULL = get_project_root() / "music" / "adapters" / "data"
@@ -15,10 +18,21 @@ TEST_DATA_PATH_DATABASE_LIMITED = get_project_root() / "tests" / "data"
 TEST_DATABASE_URI_IN_MEMORY = 'sqlite://'
 TEST_DATABASE_URI_FILE = 'sqlite:///music-test.db'
 
+data_path = str(TEST_DATA_PATH_DATABASE_LIMITED)
 data = TrackCSVReader(data_path + '/raw_albums_test.csv', data_path + '/raw_tracks_test.csv')
 tracks = data.read_tracks_file()
 albums = data.read_albums_file()
 
+@pytest.fixture
+def client(tmp_path):
+    my_app = create_app({
+        'TESTING': True,
+        'TEST_DATA_PATH': TEST_DATA_PATH_DATABASE_LIMITED,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'music-test.db'),
+        'WTF_CSRF_ENABLED': False
+    })
+    return my_app.test_client()
+
 @pytest.fixture
 def database_engine():
     clear_mappers()
@@ -32,9 +46,34 @@ def database_engine():
     # Create the SQLAlchemy DatabaseRepository instance for an sqlite3-based repository.
     repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory)
     create_objects(tracks, albums, repo.repo_instance)
+    repo.repo_instance.close_session()
+    yield engine
+    metadata.drop_all(engine)
+
+@pytest.fixture
+def bulk_database_engine():
+    clear_mappers()
+    engine = create_engine(TEST_DATABASE_URI_IN_MEMORY)
+    metadata.create_all(engine)
+    map_model_to_tables()
+    session_factory = sessionmaker(autocommit=False, autoflush=True, bind=engine)
+    repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory)
+    create_objects_bulk(tracks, albums, repo.repo_instance)
     yield engine
     metadata.drop_all(engine)
 
+@pytest.fixture
+def bulk_session_factory():
+    clear_mappers()
+    engine = create_engine(TEST_DATABASE_URI_IN_MEMORY)
+    metadata.create_all(engine)
+    map_model_to_tables()
+    session_factory = sessionmaker(autocommit=False, autoflush=True, bind=engine)
+    repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory)
+    create_objects_bulk(tracks, albums, repo.repo_instance)
+    yield session_factory
+    metadata.drop_all(engine)
+
 @pytest.fixture
 def session_factory():
     clear_mappers()
@@ -48,6 +87,7 @@ def session_factory():
     # Create the SQLAlchemy DatabaseRepository instance for an sqlite3-based repository.
     repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory)
     create_objects(tracks, albums, repo.repo_instance)
+    repo.repo_instance.close_session()
     yield session_factory
     metadata.drop_all(engine)
 
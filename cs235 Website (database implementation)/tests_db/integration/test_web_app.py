@@ -1,6 +1,27 @@
+import itertools
+import math
+import threading
+
 import pytest
 
 from flask import session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import music.adapters.repository as repo
+from music.blueprints.track import TRACKS_PER_PAGE
+
+
+@pytest.fixture
+def executed_statements():
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', record_statement)
+    yield statements
+    event.remove(Engine, 'before_cursor_execute', record_statement)
 
 
 def test_register(client):
@@ -87,4 +108,157 @@ def test_tracks(client):
 
     # Check that without providing a date query parameter the page includes the first article.
     assert b'AWOL' in response.data
-    assert b'Kurt Vile' in response.data
\ No newline at end of file
+    assert b'Kurt Vile' in response.data
+
+
+def test_tracks_pages_link_to_their_neighbours(client):
+    first_page = client.get('/tracks/1').data
+    assert b'href="/tracks/2"' in first_page
+    assert b'href="/tracks/0"' not in first_page
+
+    # The last page has no forward link.
+    last = math.ceil(repo.repo_instance.get_num_tracks() / TRACKS_PER_PAGE)
+    last_page = client.get(f'/tracks/{last}').data
+    assert f'href="/tracks/{last - 1}"'.encode() in last_page
+    assert f'href="/tracks/{last + 1}"'.encode() not in last_page
+
+    # Pages are only linked to, nothing posts to them.
+    assert client.post('/tracks/1', data={'forward': '0'}).status_code == 405
+
+
+@pytest.mark.parametrize(('url', 'max_queries'), (
+        ('/', 2),
+        ('/tracks/1', 7),
+        ('/tracks/150', 7),
+        ('/track_find/2', 7),
+        ('/track_find_artist/AWOL', 7),
+        ('/track_find_track/Food', 7),
+        ('/track_find_genre/Hip-Hop', 7),
+        ('/find', 9),
+))
+def test_query_count_per_endpoint(client, executed_statements, url, max_queries):
+    # The first request loads the cached track ids, which every page uses afterwards.
+    client.get('/')
+    executed_statements.clear()
+
+    response = client.get(url)
+    assert response.status_code == 200
+
+    # Relationships are loaded per relationship rather than per rendered track. Cached pages also check the data
+    # version of the database.
+    assert len(executed_statements) <= max_queries
+
+
+def test_suggest(client):
+    response = client.get('/api/suggest?field=artist&q=aw')
+    assert response.status_code == 200
+    assert response.get_json() == {'field': 'artist', 'q': 'aw', 'suggestions': ['AWOL']}
+
+    response = client.get('/api/suggest?field=artist&q=a')
+    assert len(response.get_json()['suggestions']) == 10
+
+    response = client.get('/api/suggest?field=title&q=FO&limit=1')
+    assert response.get_json()['suggestions'] == ['Food']
+
+    response = client.get('/api/suggest?field=album&q=a')
+    assert response.status_code == 400
+
+
+def test_search_tracks(client):
+    response = client.get('/search_tracks/1?q=kurt')
+    assert response.status_code == 200
+    assert b'Kurt Vile' in response.data
+
+    response = client.post('/search_tracks/1?q=kurt', data={'forward': '0'})
+    assert response.headers['Location'].endswith('/search_tracks/2?q=kurt')
+
+
+def test_concurrent_requests_use_their_own_sessions(client):
+    # Every request thread gets its own session (and connection) for the length of its app context.
+    urls = ['/', '/tracks/1', '/track_find/2', '/track_find_artist/AWOL', '/search_tracks/1?q=awol'] * 8
+    statuses = []
+
+    def get(url):
+        statuses.append(client.application.test_client().get(url).status_code)
+
+    threads = [threading.Thread(target=get, args=(url,)) for url in urls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * len(urls)
+
+
+def test_repeated_reads_are_served_from_the_repository_cache(client, executed_statements, monkeypatch):
+    # Every page shows a random sidebar track, the same one here.
+    monkeypatch.setattr('music.adapters.caching_repository.random.choice', lambda track_ids: track_ids[0])
+    client.get('/track_find/2')
+    executed_statements.clear()
+
+    # The track, its reviews and the sidebar track all come from the cache.
+    response = client.get('/track_find/2')
+    assert response.status_code == 200
+    assert executed_statements == []
+
+
+def test_review_invalidates_the_cached_track_reviews(client):
+    client.get('/track_find/2')
+    client.set_cookie('localhost', 'User', 'silverstream')
+
+    response = client.post('/user_review', data={'review': 'great tune', 'track_name': '<Track Food, track id = 2>',
+                                                  'rating': '4'})
+    assert response.status_code == 200
+
+    response = client.get('/track_find/2')
+    assert b'great tune' in response.data
+
+
+def test_anonymous_pages_are_served_from_the_page_cache(client, executed_statements, monkeypatch):
+    # The sidebar track is rendered for every response, the same one here.
+    monkeypatch.setattr('music.adapters.caching_repository.random.choice', lambda track_ids: track_ids[0])
+    first = client.get('/tracks/2')
+    executed_statements.clear()
+
+    second = client.get('/tracks/2')
+    assert second.data == first.data
+    assert executed_statements == []
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert 'Last-Modified' in second.headers
+
+    # Revalidation of an unchanged page.
+    response = client.get('/tracks/2', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    # Pages of logged in users are rendered for them.
+    client.set_cookie('localhost', 'User', 'silverstream')
+    response = client.get('/tracks/2')
+    assert 'ETag' not in response.headers
+
+
+def test_review_invalidates_the_cached_track_page(client):
+    etag = client.get('/track_find/2').headers['ETag']
+    other_etag = client.get('/track_find/3').headers['ETag']
+
+    client.set_cookie('localhost', 'User', 'silverstream')
+    client.post('/user_review', data={'review': 'great tune', 'track_name': '<Track Food, track id = 2>',
+                                      'rating': '4'})
+    client.delete_cookie('localhost', 'User')
+
+    response = client.get('/track_find/2', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'great tune' in response.data
+    assert client.get('/track_find/3', headers={'If-None-Match': other_etag}).status_code == 304
+
+
+def test_cached_pages_show_a_new_random_track(client, monkeypatch):
+    track_ids = itertools.cycle([2, 3])
+    monkeypatch.setattr('music.adapters.caching_repository.random.choice', lambda ids: next(track_ids))
+    first = client.get('/tracks/1')
+    second = client.get('/tracks/1')
+
+    assert first.data != second.data
+    assert {b'Title: Food' in first.data, b'Title: Food' in second.data} == {True, False}
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert client.get('/tracks/1', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
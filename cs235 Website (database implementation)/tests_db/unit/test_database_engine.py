@@ -0,0 +1,38 @@
+import pytest
+
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool
+
+from music.adapters.database_engine import create_database_engine
+
+
+def test_pool_modes(tmp_path):
+    database_uri = f"sqlite:///{tmp_path / 'pool.db'}"
+
+    assert isinstance(create_database_engine(database_uri, 'queue').pool, QueuePool)
+    assert isinstance(create_database_engine(database_uri, 'singleton').pool, SingletonThreadPool)
+    assert isinstance(create_database_engine(database_uri, 'null').pool, NullPool)
+
+    # An in-memory database only exists on its own connection, so it is never shared through a QueuePool.
+    assert isinstance(create_database_engine('sqlite://', 'queue').pool, SingletonThreadPool)
+
+    with pytest.raises(ValueError):
+        create_database_engine(database_uri, 'unknown')
+
+
+def test_pragmas_are_set_on_connect(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == 'wal'
+        # NORMAL
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA cache_size").scalar() == -16 * 1024
+
+
+def test_pooled_connections_are_reused(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'reuse.db'}", 'queue')
+
+    with engine.connect() as connection:
+        first = connection.connection.dbapi_connection
+    with engine.connect() as connection:
+        assert connection.connection.dbapi_connection is first
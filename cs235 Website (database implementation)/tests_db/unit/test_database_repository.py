@@ -1,12 +1,16 @@
 import pytest
 
 import music.adapters.repository as repo
+from music.adapters.repository import RepositoryException, VersionCheck
 from music.adapters.database_repository import SqlAlchemyRepository
+from music.adapters.csvdatareader import TrackCSVReader
+from music.adapters.csv_data_importer import generate_catalogue_rows
+from utils import get_project_root
 
 from datetime import date
 from typing import List
 
-from sqlalchemy import desc, asc, insert, delete
+from sqlalchemy import desc, asc, insert, delete, event
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 from sqlalchemy.orm import scoped_session, make_transient
@@ -193,3 +197,209 @@ def test_can_retrieve_an_track_and_add_a_review_to_it(session_factory):
     track_fetched = repo.get_track_by_id(5)
 
     assert track_fetched in review.track
+
+
+def test_repository_gives_users_new_ids(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+
+    # Ids come from the users table, not from the id the user was created with.
+    repo.add_user(User(0, 'Dave', 'pw12345'))
+    repo.add_user(User(0, 'Martin', 'pw12345'))
+    assert repo.get_user('martin').user_id == repo.get_user('dave').user_id + 1
+
+    with pytest.raises(RepositoryException):
+        repo.add_user(User(0, 'dave', 'pw54321'))
+    assert repo.get_number_of_users() == 3
+
+
+def test_data_version_changes_with_reviews_and_imports(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+    version = repo.get_data_version()
+
+    repo.set_import_metadata({'csv_stat': 'touched'})
+    assert repo.get_data_version() == version
+
+    repo.add_review(Review(repo.get_track_by_id(2), "lets a go", 3))
+    reviewed_version = repo.get_data_version()
+    assert reviewed_version != version
+
+    repo.set_import_metadata({'csv_sha256': 'new csv files'})
+    assert repo.get_data_version() not in (version, reviewed_version)
+
+
+def test_imports_of_other_processes_drop_the_cached_track_ids(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+    repo._catalogue_version = VersionCheck(repo.get_catalogue_version, interval=0)
+    track_ids = repo.get_track_ids()
+
+    importer = SqlAlchemyRepository(bulk_session_factory)
+    track = Track(1000, 'New')
+    track.track_duration = 100
+    importer.add_track(track)
+    assert repo.get_track_ids() == track_ids
+
+    importer.set_import_metadata({'csv_sha256': 'new csv files'})
+    assert repo.get_track_ids() == track_ids + [1000]
+
+
+def test_repository_adds_the_user_with_the_review(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+
+    # A review added by another request right after this one does not take its user.
+    user = repo.get_user('silverstream')
+    repo.add_review(Review(repo.get_track_by_id(2), "lets a go", 3), user)
+    repo.add_review(Review(repo.get_track_by_id(3), "another track", 4))
+
+    assert repo.get_user_by_track(2) == [user]
+    assert repo.get_user_by_track(3) == []
+
+
+def test_repository_can_retrieve_reviews_and_users_by_track(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+
+    user = repo.get_user('silverstream')
+    repo.add_review(Review(repo.get_track_by_id(2), "lets a go", 3))
+    repo.add_user_to_review(user)
+    repo.add_review(Review(repo.get_track_by_id(3), "another track", 4))
+
+    assert [review.review_text for review in repo.get_review_by_track(2)] == ["lets a go"]
+    assert repo.get_user_by_track(2) == [user]
+    assert repo.get_user_by_track(3) == []
+    assert repo.get_review_by_track(5) == []
+
+    # The track view gets both lists from one query.
+    statements = []
+    event.listen(bulk_session_factory.kw['bind'], 'before_cursor_execute',
+                 lambda connection, cursor, statement, *args: statements.append(statement))
+    reviews, users = repo.get_reviews_and_users_by_track(2)
+    assert ([review.review_text for review in reviews], users) == (["lets a go"], [user])
+    assert len(statements) == 1
+
+
+def test_repository_retrieves_track_by_primary_key_with_relationships(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+
+    track = repo.get_track_by_id(2)
+    repo.close_session()
+
+    # Artist, album and genres were loaded with the track, so they are usable once the session is gone.
+    assert track.title == 'Food'
+    assert track.artist.full_name == 'AWOL'
+    assert track.album.title == 'AWOL - A Way Of Life'
+    assert [genre.name for genre in track.genres] == ['Hip-Hop']
+
+    assert repo.get_track_by_id(4) is None
+
+
+def test_repository_random_track_comes_from_track_ids(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+
+    track_ids = repo.get_track_ids()
+    assert track_ids == [2, 3, 5, 10, 20, 30, 134, 137, 138, 139]
+    for _ in range(20):
+        assert repo.get_random_track().track_id in track_ids
+
+    # Inserting a track refreshes the cached ids.
+    track = Track(140, "Gamer")
+    track.track_duration = 5
+    repo.add_track(track)
+    assert repo.get_track_ids()[-1] == 140
+
+
+def test_repository_can_retrieve_tracks_page(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+
+    first_page = repo.get_tracks_page(-1, 4)
+    assert [track.track_id for track in first_page] == [2, 3, 5, 10]
+
+    next_page = repo.get_tracks_page(first_page[-1].track_id, 4)
+    assert [track.track_id for track in next_page] == [20, 30, 134, 137]
+
+    assert repo.get_tracks_page(139, 4) == []
+    assert repo.get_num_tracks() == 10
+
+
+def test_repository_can_search_tracks(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+
+    assert [track.track_id for track in repo.get_tracks_by_artist('AWOL')] == [2, 3, 5, 134]
+    assert [track.track_id for track in repo.get_tracks_by_title(' Food ')] == [2]
+    assert [track.track_id for track in repo.get_tracks_by_genre('Avant-Garde')] == [137, 138]
+
+    assert repo.get_tracks_by_artist('Nobody') == []
+    assert repo.get_tracks_by_title('No such track') == []
+    assert repo.get_tracks_by_genre('No such genre') == []
+
+
+def test_repository_can_retrieve_search_options(bulk_session_factory, monkeypatch):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+
+    assert repo.get_artist_names() == ['AWOL', 'Airway', 'Alec K. Redfearn & the Eyesores', 'Kurt Vile', 'Nicky Cook']
+    assert repo.get_track_titles()[:3] == ['CandyAss', 'Electric Ave', 'Food']
+    assert len(repo.get_track_titles()) == len(set(repo.get_track_titles()))
+    assert 'Hip-Hop' in repo.get_genre_names()
+    assert repo.get_genre_names() == sorted(set(repo.get_genre_names()))
+
+    # The cached options are refreshed when the catalogue changes.
+    repo.add_artist(Artist(99, "Zed"))
+    assert repo.get_artist_names()[-1] == 'Zed'
+
+    # Albums are part of the catalogue too.
+    invalidations = []
+    monkeypatch.setattr(repo, 'invalidate_catalogue_cache', lambda: invalidations.append('catalogue'))
+    repo.add_album(Album(99, "Zed"))
+    assert invalidations == ['catalogue']
+
+
+def test_repository_can_full_text_search_tracks(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+
+    assert [track.track_id for track in repo.search_tracks('free')] == [10]
+    assert [track.track_id for track in repo.search_tracks('AWOL food')] == [2]
+    assert [track.track_id for track in repo.search_tracks('alec eyesores')] == [139]
+    assert repo.search_tracks('nothing matches') == []
+    assert repo.search_tracks('  ') == []
+
+    # Results are paginated.
+    first_page = repo.search_tracks('awol', 2)
+    second_page = repo.search_tracks('awol', 2, 2)
+    assert len(first_page) == 2 and len(second_page) == 2
+    assert {track.track_id for track in first_page + second_page} == {2, 3, 5, 134}
+
+    # Added tracks are indexed, and a title match ranks above album matches.
+    track = Track(140, "Niris")
+    track.track_duration = 5
+    repo.add_track(track)
+    assert [track.track_id for track in repo.search_tracks('niris')] == [140, 20, 30]
+
+
+def test_repository_syncs_only_changed_catalogue_rows(bulk_session_factory):
+    repo = SqlAlchemyRepository(bulk_session_factory)
+    data_path = get_project_root() / "tests" / "data"
+    data = TrackCSVReader(str(data_path / 'raw_albums_test.csv'), str(data_path / 'raw_tracks_test.csv'))
+    tracks = data.read_tracks_file()
+    albums = data.read_albums_file()
+
+    # Nothing changed.
+    changes = repo.sync_catalogue(generate_catalogue_rows(tracks, albums))
+    assert all(counts == {'inserted': 0, 'updated': 0, 'deleted': 0} for counts in changes.values())
+
+    # Track 3 has a new title, tracks 2 and 139 are gone, but track 2 has a review.
+    review = Review(repo.get_track_by_id(2), 'Great', 5)
+    repo.add_review(review)
+    changed_tracks = []
+    for track in tracks:
+        if track['track_id'] == '3':
+            track = dict(track, track_title='Electric Avenue')
+        if track['track_id'] not in ('2', '139'):
+            changed_tracks.append(track)
+    changes = repo.sync_catalogue(generate_catalogue_rows(changed_tracks, albums))
+
+    assert changes['tracks'] == {'inserted': 0, 'updated': 1, 'deleted': 1}
+    assert changes['artists']['deleted'] == 1
+    assert repo.get_track_by_id(3).title == 'Electric Avenue'
+    assert repo.get_track_by_id(139) is None
+    assert repo.get_track_by_id(2).title == 'Food'
+    assert len(repo.get_review_by_track(2)) == 1
+    assert [track.track_id for track in repo.search_tracks('avenue')] == [3]
+    assert repo.search_tracks('candyass') == []
@@ -7,7 +7,7 @@ from music.domainmodel.genre import Genre
 from music.domainmodel.review import Review
 from music.domainmodel.album import Album
 from music.domainmodel.user import User
-from music.adapters.csvdatareader import TrackCSVReader
+from music.adapters.csvdatareader import TrackCSVReader, GenreParser, TRACK_COLUMNS, ALBUM_COLUMNS
 
 
 class TestArtist:
@@ -745,3 +745,33 @@ class TestCSVReader:
         # genre id = 3>]'
         sorted_genre_sample = str(sorted_genres[:3])
         assert sorted_genre_sample == '[<Genre Avant-Garde, genre id = 1>, <Genre International, genre id = 2>, <Genre Blues, genre id = 3>]'
+
+    def test_streamed_rows(self):
+        reader = create_csv_reader()
+
+        # Rows are yielded lazily and only carry the columns used by the domain model.
+        track_rows = reader.iter_tracks_file()
+        first_track_row = next(track_rows)
+        assert tuple(first_track_row) == TRACK_COLUMNS
+        assert first_track_row['track_title'] == 'Food'
+        assert 1 + sum(1 for _ in track_rows) == 2000
+
+        album_rows = list(reader.iter_albums_file())
+        assert tuple(album_rows[0]) == ALBUM_COLUMNS
+        assert album_rows[0]['album_title'] == 'AWOL - A Way Of Life'
+
+    def test_genre_parser(self):
+        parser = GenreParser()
+        cell = "[{'genre_id': '21', 'genre_title': 'Hip-Hop', 'genre_url': 'http://freemusicarchive.org/genre/Hip-Hop/'}, " \
+               "{'genre_id': '4', 'genre_title': \"Children's\", 'genre_url': 'http://freemusicarchive.org/genre/Childrens/'}]"
+
+        genres = parser.parse(cell)
+        assert str(list(genres)) == "[<Genre Hip-Hop, genre id = 21>, <Genre Children's, genre id = 4>]"
+
+        # Identical cells are parsed once and a genre id always maps to the same Genre object.
+        assert parser.parse(cell) is genres
+        assert parser.parse("[{'genre_id': '21', 'genre_title': 'Hip-Hop', 'genre_url': ''}]")[0] is genres[0]
+
+        assert parser.parse('') == ()
+        assert parser.parse('[]') == ()
+        assert parser.parse(None) == ()
@@ -1,29 +1,50 @@
-from sqlalchemy import select, inspect
+import os
+import shutil
+
+from sqlalchemy import create_engine, select, inspect, func
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from music import create_app
+
+from music.adapters.csv_data_importer import create_objects
+from music.adapters.csvdatareader import TrackCSVReader, extract_genres
+from music.adapters.database_repository import SqlAlchemyRepository
+from music.adapters.orm import metadata, map_model_to_tables, create_missing_indexes
+from music.domainmodel.genre import Genre
+from music.domainmodel.track import Track
+from utils import get_project_root
+
+TEST_DATA_PATH_DATABASE_LIMITED = get_project_root() / "tests" / "data"
 
-from music.adapters.orm import metadata
 
 def test_database_populate_inspect_table_names(database_engine):
 
     # Get table information
     inspector = inspect(database_engine)
-    assert inspector.get_table_names() == ['users', 'user_review', 'tracks', 'albums', 'artists', 'genres']
+    assert inspector.get_table_names() == ['albums', 'artists', 'genres', 'import_metadata', 'track_genres',
+                                           'track_search', 'track_search_config', 'track_search_content',
+                                           'track_search_data', 'track_search_docsize', 'track_search_idx', 'tracks',
+                                           'user_review', 'users']
 
 def test_database_populate_select_all_genres(database_engine):
 
-    # Get table information
-    inspector = inspect(database_engine)
-    name_of_genres_table = inspector.get_table_names()[5]
-
     with database_engine.connect() as connection:
-        # query for records in table tags
-        select_statement = select([metadata.tables[name_of_genres_table]])
+        # query for records in table genres, each genre is stored once
+        select_statement = select([metadata.tables['genres']])
         result = connection.execute(select_statement)
 
-        all_genre_names = []
+        all_genres = []
         for row in result:
-            all_genre_names.append(row['name'])
+            all_genres.append((row['genre_id'], row['name']))
+
+        assert all_genres == [(21, 'Hip-Hop'), (10, 'Pop'), (76, 'Experimental Pop'), (103, 'Singer-Songwriter'),
+                              (1, 'Avant-Garde'), (32, 'Noise'), (17, 'Folk')]
 
-        assert all_genre_names == ['pop', 'rock', 'metal', 'jazz']
+        # track_genres links a track to each of its genres once
+        track_genres_table = metadata.tables['track_genres']
+        result = connection.execute(select([track_genres_table]).where(track_genres_table.c.track_id.in_([20, 137])))
+        assert sorted((row['track_id'], row['genre_id']) for row in result) == [(20, 76), (20, 103), (137, 1),
+                                                                                (137, 32)]
 
 def test_database_populate_select_all_users(database_engine):
 
@@ -123,3 +144,192 @@ def test_database_populate_select_all_artists(database_engine):
         assert nr_artists[0] == (1, 'Sever')
 
 
+def test_database_populate_twice_writes_every_row():
+
+    # Every run of create_objects starts with an empty ImportContext, so the first run does not hide any rows from
+    # the second one.
+    reader = TrackCSVReader(str(TEST_DATA_PATH_DATABASE_LIMITED / 'raw_albums_test.csv'),
+                            str(TEST_DATA_PATH_DATABASE_LIMITED / 'raw_tracks_test.csv'))
+    tracks, albums = reader.read_tracks_file(), reader.read_albums_file()
+    for _ in range(2):
+        clear_mappers()
+        engine = create_engine('sqlite://')
+        metadata.create_all(engine)
+        map_model_to_tables()
+        create_objects(tracks, albums, SqlAlchemyRepository(sessionmaker(bind=engine)))
+
+        with engine.connect() as connection:
+            def count(table_name):
+                return connection.execute(select([func.count()]).select_from(metadata.tables[table_name])).scalar()
+
+            assert count('users') == 1
+            assert count('artists') == 5
+            assert count('albums') == 5
+            assert count('tracks') == 10
+
+
+def test_database_populate_stores_genres():
+
+    # create_objects stores every genre once, before the tracks linking to it.
+    reader = TrackCSVReader(str(TEST_DATA_PATH_DATABASE_LIMITED / 'raw_albums_test.csv'),
+                            str(TEST_DATA_PATH_DATABASE_LIMITED / 'raw_tracks_test.csv'))
+    tracks, albums = reader.read_tracks_file(), reader.read_albums_file()
+    expected_links = {(genre.genre_id, int(track_row['track_id']))
+                      for track_row in tracks for genre in extract_genres(track_row)}
+    clear_mappers()
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+    map_model_to_tables()
+    repository = SqlAlchemyRepository(sessionmaker(bind=engine))
+    create_objects(tracks, albums, repository)
+
+    with engine.connect() as connection:
+        genre_ids = [row[0] for row in connection.execute(select([metadata.tables['genres'].c.genre_id]))]
+        links = set(connection.execute(select([metadata.tables['track_genres'].c.genre_id,
+                                               metadata.tables['track_genres'].c.track_id])))
+    assert sorted(genre_ids) == sorted({genre_id for genre_id, track_id in expected_links})
+    assert links == expected_links
+    assert [track.track_id for track in repository.get_tracks_by_genre('Avant-Garde')] == [137, 138]
+
+    # Adding a track with a stored genre links to it, and add_genre_to_tracks only inserts what is missing.
+    track = Track(4, 'Awake')
+    track.track_duration = 180
+    track.add_genre(Genre(1, 'Avant-Garde'))
+    repository.add_track(track)
+    repository.add_genre_to_tracks([Genre(1, 'Avant-Garde'), Genre(1000, 'Vaporwave')], 4)
+    repository.add_genre_to_tracks([Genre(1000, 'Vaporwave')], 4)
+    assert [track.track_id for track in repository.get_tracks_by_genre('Avant-Garde')] == [4, 137, 138]
+    assert [track.track_id for track in repository.get_tracks_by_genre('Vaporwave')] == [4]
+    repository.close_session()
+
+
+def test_database_genre_keys(bulk_database_engine):
+
+    inspector = inspect(bulk_database_engine)
+    unique_indexes = [index['column_names'] for index in inspector.get_indexes('genres') if index['unique']]
+    assert ['genre_id'] in unique_indexes
+    assert inspector.get_pk_constraint('track_genres')['constrained_columns'] == ['track_id', 'genre_id']
+
+
+def test_database_old_genre_layout_is_migrated():
+
+    # Databases written before genres were keyed have an id per track_genres row and can repeat both tables' rows.
+    engine = create_engine('sqlite://')
+    with engine.begin() as connection:
+        connection.execute("CREATE TABLE genres (id INTEGER PRIMARY KEY, genre_id INTEGER, name VARCHAR(64) NOT NULL)")
+        connection.execute("CREATE TABLE track_genres (id INTEGER PRIMARY KEY, genre_id INTEGER, track_id INTEGER)")
+        connection.execute("CREATE INDEX ix_track_genres_genre_id_track_id ON track_genres (genre_id, track_id)")
+        connection.execute("INSERT INTO genres (genre_id, name) VALUES (1, 'Avant-Garde'), (1, 'Avant-Garde'), "
+                           "(21, 'Hip-Hop')")
+        connection.execute("INSERT INTO track_genres (genre_id, track_id) VALUES (1, 2), (1, 2), (21, 2), (1, 3), "
+                           "(1, 3), (NULL, 3)")
+    create_missing_indexes(engine)
+
+    inspector = inspect(engine)
+    assert inspector.get_pk_constraint('track_genres')['constrained_columns'] == ['track_id', 'genre_id']
+    assert ['genre_id', 'track_id'] in [index['column_names'] for index in inspector.get_indexes('track_genres')]
+    assert not inspector.has_table('track_genres_old')
+    with engine.connect() as connection:
+        genre_ids = [row[0] for row in connection.execute(select([metadata.tables['genres'].c.genre_id]))]
+        links = list(connection.execute(select([metadata.tables['track_genres'].c.genre_id,
+                                                metadata.tables['track_genres'].c.track_id])))
+    assert sorted(genre_ids) == [1, 21]
+    assert sorted(links) == [(1, 2), (1, 3), (21, 2)]
+
+    # The migrated database needs no further changes.
+    create_missing_indexes(engine)
+    with engine.connect() as connection:
+        assert connection.execute(select([func.count()]).select_from(metadata.tables['track_genres'])).scalar() == 3
+
+
+def test_database_bulk_populate_row_counts(bulk_database_engine):
+
+    with bulk_database_engine.connect() as connection:
+        def count(table_name):
+            return connection.execute(select([func.count()]).select_from(metadata.tables[table_name])).scalar()
+
+        assert count('users') == 1
+        assert count('artists') == 5
+        assert count('albums') == 5
+        assert count('tracks') == 10
+
+        # Genres are de-duplicated across the whole file, the association table keeps one row per track genre.
+        genre_ids = [row[0] for row in connection.execute(select([metadata.tables['genres'].c.genre_id]))]
+        assert len(genre_ids) == len(set(genre_ids))
+        assert count('track_genres') >= count('tracks')
+
+
+def test_database_bulk_populate_links_tracks(bulk_database_engine):
+
+    with bulk_database_engine.connect() as connection:
+        tracks_table = metadata.tables['tracks']
+        row = connection.execute(select([tracks_table]).where(tracks_table.c.id == 2)).fetchone()
+        assert (row['title'], row['artist_id'], row['album_id']) == ('Food', 1, 1)
+
+
+def test_database_review_lookup_indexes(bulk_database_engine):
+
+    inspector = inspect(bulk_database_engine)
+    indexed_columns = [index['column_names'] for index in inspector.get_indexes('user_review')]
+    assert ['track_id'] in indexed_columns
+    assert ['user_id'] in indexed_columns
+
+
+def test_database_search_indexes(bulk_database_engine):
+
+    inspector = inspect(bulk_database_engine)
+
+    def indexed_columns(table_name):
+        return [index['column_names'] for index in inspector.get_indexes(table_name)]
+
+    assert ['name'] in indexed_columns('artists')
+    assert ['title'] in indexed_columns('tracks')
+    assert ['name'] in indexed_columns('genres')
+    assert ['genre_id', 'track_id'] in indexed_columns('track_genres')
+
+
+def boot(data_path, database_uri, testing=False):
+    # Every app maps the domain model again.
+    clear_mappers()
+    return create_app({'TESTING': testing, 'TEST_DATA_PATH': data_path, 'SQLALCHEMY_DATABASE_URI': database_uri,
+                       'IMPORT_IN_BACKGROUND': False, 'WTF_CSRF_ENABLED': False})
+
+
+def test_database_startup_skips_unchanged_csv_files(tmp_path, monkeypatch):
+    data_path = tmp_path / 'data'
+    shutil.copytree(TEST_DATA_PATH_DATABASE_LIMITED, data_path)
+    database_uri = 'sqlite:///' + str(tmp_path / 'music.db')
+    boot(data_path, database_uri, testing=True)
+
+    reloads = []
+    monkeypatch.setattr('music.reload_catalogue', lambda *args, **kwargs: reloads.append(kwargs))
+
+    # Neither unchanged files nor a new modification time of the same contents cause a reload.
+    boot(data_path, database_uri)
+    os.utime(data_path / 'raw_tracks_excerpt.csv', (0, 0))
+    boot(data_path, database_uri)
+    assert reloads == []
+
+    with open(data_path / 'raw_tracks_excerpt.csv', 'a', encoding='utf-8') as tracks_file:
+        tracks_file.write('\n')
+    boot(data_path, database_uri)
+    assert len(reloads) == 1
+
+
+def test_database_reload_keeps_users_and_reviews(tmp_path):
+    data_path = tmp_path / 'data'
+    shutil.copytree(TEST_DATA_PATH_DATABASE_LIMITED, data_path)
+    database_uri = 'sqlite:///' + str(tmp_path / 'music.db')
+    client = boot(data_path, database_uri, testing=True).test_client()
+    client.set_cookie('localhost', 'User', 'silverstream')
+    client.post('/user_review', data={'review': 'great tune', 'track_name': '<Track Food, track id = 2>',
+                                      'rating': '4'})
+
+    tracks_file_name = data_path / 'raw_tracks_excerpt.csv'
+    tracks_file_name.write_bytes(tracks_file_name.read_bytes().replace(b',Food,', b',Food (Remix),'))
+    client = boot(data_path, database_uri).test_client()
+    client.set_cookie('localhost', 'User', 'silverstream')
+
+    response = client.get('/track_find/2')
+    assert b'Food (Remix)' in response.data
+    assert b'great tune' in response.data